@@ -0,0 +1,273 @@
+import csv
+import sys
+import random
+import argparse
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: fall back to the random module
+    np = None
+
+
+DIRECTIONS = ("N", "E", "S", "W")
+
+# Number of routes and inter-arrival times drawn at once.
+BLOCK_SIZE = 4096
+
+
+class RouteSampler:
+    """
+    Draws (source, dest) routes in pre-generated blocks.
+    Sources follow the per-direction weights (N, E, S, W); the destination is uniform among the other three roads.
+    """
+    def __init__(self, rng, weights=None, block_size=BLOCK_SIZE):
+        self.rng = rng
+        self.weights = list(weights) if weights else [1, 1, 1, 1]
+        self.block_size = block_size
+        self.block = []
+        self.position = 0
+
+    def refill(self):
+        if np is not None:
+            p = np.asarray(self.weights, dtype=float)
+            sources = self.rng.numpy.choice(4, size=self.block_size, p=p / p.sum())
+            dests = (sources + self.rng.numpy.integers(1, 4, size=self.block_size)) % 4
+            self.block = list(zip(sources.tolist(), dests.tolist()))
+        else:
+            sources = self.rng.python.choices(range(4), weights=self.weights, k=self.block_size)
+            self.block = [(s, (s + self.rng.python.randint(1, 3)) % 4) for s in sources]
+        self.position = 0
+
+    def next(self):
+        if self.position >= len(self.block):
+            self.refill()
+        source, dest = self.block[self.position]
+        self.position += 1
+        return DIRECTIONS[source], DIRECTIONS[dest]
+
+
+class SeededRandom:
+    """
+    Seeded random generators: the random module's, and NumPy's when it is available.
+    """
+    def __init__(self, seed=None):
+        self.python = random.Random(seed)
+        self.numpy = np.random.default_rng(seed) if np is not None else None
+
+    def exponentials(self, rate, n):
+        """Returns n inter-arrival times of a Poisson process of the given rate."""
+        if self.numpy is not None:
+            return self.numpy.exponential(1.0 / rate, n).tolist()
+        return [self.python.expovariate(rate) for _ in range(n)]
+
+    def uniforms(self, n):
+        if self.numpy is not None:
+            return self.numpy.random(n).tolist()
+        return [self.python.random() for _ in range(n)]
+
+
+# Arrival models: iterables of (time, source, dest), time in seconds since the start, non-decreasing.
+class ConstantArrivals:
+    """
+    batch_size vehicles every interval seconds (the historical generator).
+    """
+    def __init__(self, interval, batch_size=1, weights=None, seed=None):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.rng = SeededRandom(seed)
+        self.routes = RouteSampler(self.rng, weights)
+
+    def __iter__(self):
+        t = 0.0
+        while True:
+            for _ in range(self.batch_size):
+                yield (t, *self.routes.next())
+            t += self.interval
+
+
+class PoissonArrivals:
+    """
+    Poisson arrivals at a constant rate (vehicles per second).
+    """
+    def __init__(self, rate, weights=None, seed=None):
+        self.rate = rate
+        self.rng = SeededRandom(seed)
+        self.routes = RouteSampler(self.rng, weights)
+
+    def __iter__(self):
+        t = 0.0
+        while True:
+            for gap in self.rng.exponentials(self.rate, BLOCK_SIZE):
+                t += gap
+                yield (t, *self.routes.next())
+
+
+class RushHourArrivals:
+    """
+    Poisson arrivals whose rate ramps linearly from base_rate up to peak_rate and back down,
+    around each peak time (seconds since midnight) of a daily cycle.
+    Generated by thinning a Poisson process at peak_rate.
+    """
+    def __init__(self, base_rate, peak_rate, peaks=(8 * 3600, 17.5 * 3600), ramp=3600,
+                 period=86400, weights=None, seed=None):
+        self.base_rate = base_rate
+        self.peak_rate = max(peak_rate, base_rate)
+        self.peaks = peaks
+        self.ramp = ramp
+        self.period = period
+        self.rng = SeededRandom(seed)
+        self.routes = RouteSampler(self.rng, weights)
+
+    def rate(self, t):
+        """Arrival rate at time t."""
+        t = t % self.period
+        closeness = max(0.0, max(1 - abs(t - peak) / self.ramp for peak in self.peaks))
+        return self.base_rate + (self.peak_rate - self.base_rate) * closeness
+
+    def __iter__(self):
+        t = 0.0
+        while True:
+            gaps = self.rng.exponentials(self.peak_rate, BLOCK_SIZE)
+            for gap, u in zip(gaps, self.rng.uniforms(BLOCK_SIZE)):
+                t += gap
+                if u * self.peak_rate <= self.rate(t):
+                    yield (t, *self.routes.next())
+
+
+class BurstArrivals:
+    """
+    Poisson arrivals at base_rate, plus burst_size vehicles arriving at once every burst_interval seconds.
+    """
+    def __init__(self, base_rate, burst_size, burst_interval, weights=None, seed=None):
+        self.base = PoissonArrivals(base_rate, weights, seed)
+        self.burst_size = burst_size
+        self.burst_interval = burst_interval
+
+    def __iter__(self):
+        next_burst = self.burst_interval
+        for t, source, dest in self.base:
+            while next_burst <= t:
+                for _ in range(self.burst_size):
+                    yield (next_burst, *self.base.routes.next())
+                next_burst += self.burst_interval
+            yield t, source, dest
+
+
+class TraceArrivals:
+    """
+    Replays a recorded trace: a CSV file of "time,source,dest" lines, streamed without loading it in memory.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, newline="") as f:
+            reader = csv.reader(f)
+            for row in reader:
+                if not row or row[0].startswith("#") or row[0] == "time":
+                    continue
+                yield self.parse_row(row, reader.line_num)
+
+    def parse_row(self, row, line):
+        """
+        Returns the (time, source, dest) of a trace line; raises ValueError, with the line number,
+        if it is not a valid arrival.
+        """
+        if len(row) < 3:
+            raise ValueError(f"{self.path}:{line}: expected time,source,dest, got {','.join(row)!r}")
+        try:
+            t = float(row[0])
+        except ValueError:
+            raise ValueError(f"{self.path}:{line}: invalid time {row[0]!r}") from None
+        source, dest = row[1].strip(), row[2].strip()
+        for road in (source, dest):
+            if road not in DIRECTIONS:
+                raise ValueError(f"{self.path}:{line}: invalid road {road!r} (expected one of {', '.join(DIRECTIONS)})")
+        if source == dest:
+            raise ValueError(f"{self.path}:{line}: source and destination are both {source}")
+        return t, source, dest
+
+
+def build_model(kind, interval=None, batch_size=1, rate=None, peak_rate=None, burst_size=None,
+                burst_interval=None, weights=None, trace=None, seed=None):
+    """
+    Builds an arrival model from its name and parameters (as given on the command line).
+    """
+    if kind == "constant":
+        return ConstantArrivals(interval, batch_size, weights, seed)
+    if kind == "poisson":
+        return PoissonArrivals(rate, weights, seed)
+    if kind == "rush-hour":
+        return RushHourArrivals(rate, peak_rate, weights=weights, seed=seed)
+    if kind == "bursts":
+        return BurstArrivals(rate, burst_size, burst_interval, weights, seed)
+    if kind == "trace":
+        return TraceArrivals(trace)
+    raise ValueError(f"unknown arrival model: {kind}")
+
+def parse_weights(text):
+    """
+    Parses per-direction weights given as "N,E,S,W" (e.g. "2,1,2,1").
+    """
+    weights = [float(w) for w in text.split(",")]
+    if len(weights) != 4:
+        raise argparse.ArgumentTypeError("expected 4 comma-separated weights (N,E,S,W)")
+    return weights
+
+def add_arguments(parser):
+    """
+    Adds the arrival model options to an argparse parser.
+    """
+    group = parser.add_argument_group("arrival model")
+    group.add_argument("--arrivals", choices=["constant", "poisson", "rush-hour", "bursts", "trace"],
+                       default="constant", help="arrival process of the normal vehicles")
+    group.add_argument("--rate", type=float, default=1.0, help="(base) arrival rate, in vehicles per second")
+    group.add_argument("--peak-rate", type=float, default=10.0, help="rush-hour peak rate, in vehicles per second")
+    group.add_argument("--burst-size", type=int, default=20, help="vehicles per burst")
+    group.add_argument("--burst-interval", type=float, default=60.0, help="seconds between bursts")
+    group.add_argument("--weights", type=parse_weights, default=None, help="per-direction weights N,E,S,W")
+    group.add_argument("--trace", default=None, help="trace file to replay (time,source,dest CSV)")
+    group.add_argument("--seed", type=int, default=None, help="seed of the arrival times and routes")
+
+def check_arguments(parser, args):
+    """
+    Reports the invalid combinations of the options added with add_arguments (exits through parser.error).
+    """
+    if args.arrivals == "trace" and args.trace is None:
+        parser.error("--arrivals trace requires --trace")
+
+def model_from_args(args, interval, batch_size):
+    """
+    Builds the arrival model selected by the options added with add_arguments.
+    """
+    return build_model(args.arrivals, interval, batch_size, args.rate, args.peak_rate, args.burst_size,
+                       args.burst_interval, args.weights, args.trace, args.seed)
+
+
+def main(argv=None):
+    """
+    Records an arrival model into a trace file, for later replay with --arrivals trace.
+    """
+    parser = argparse.ArgumentParser(description="Record vehicle arrivals into a trace file.")
+    parser.add_argument("output", help="trace file to write")
+    parser.add_argument("--duration", type=float, default=3600, help="seconds of arrivals to record")
+    parser.add_argument("--interval", type=float, default=1.0, help="interval of the constant model, in seconds")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    check_arguments(parser, args)
+
+    model = model_from_args(args, args.interval, 1)
+    count = 0
+    with open(args.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["time", "source", "dest"])
+        for t, source, dest in model:
+            if t > args.duration:
+                break
+            writer.writerow([f"{t:.6f}", source, dest])
+            count += 1
+    print(f"[ARRIVALS] {count} arrivals written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import random
+from collections import deque
+import sim_clock
+import metrics
+import event_log
+import profiling
+import arrivals
+from common import (
+    NS_GREEN, VehicleMessage, LIGHT_CHANGE_INTERVAL, PRIORITY_GEN_INTERVAL, COORDINATOR_TICK_BUDGET,
+    NORMAL_GEN_INTERVAL, NORMAL_GEN_BATCH_SIZE, QUEUE_CAPACITY, COORDINATOR_SCHEDULER, COORDINATOR_RIGHT_ON_RED,
+    DISPLAY_HOST, DISPLAY_PORT, DISPLAY_SUBSCRIBER_BUFFER, DISPLAY_FRAME_RATE
+)
+from lights import LightCycle, publish_state, publish_changes, PRIORITY_COMMANDS
+from coordinator import (
+    send_update, announce_light_change, pass_priority_vehicle, process_drained_vehicles, schedule_waiting_vehicles,
+    take_priority_vehicle
+)
+from display import Dashboard
+from ipc_utils import QUEUE_DIRECTIONS, LIGHTS_PRIORITY_REQUESTS, LIGHTS_PRIORITY_RELEASE
+
+
+# Period of the adaptive controller's checks (in simulated seconds), as in lights.main
+ADAPTIVE_STEP = 0.1
+
+
+class DisplaySink:
+    """
+    Stands in for the display socket: the coordinator's lines are handed to the display task.
+    """
+    def __init__(self):
+        self.lines = deque()
+        self.ready = asyncio.Event()
+
+    def sendall(self, data):
+        self.lines.append(data)
+        self.ready.set()
+
+
+class AsyncIntersection:
+    """
+    The intersection in a single process: the lights, both generators, the coordinator and the
+    display run as asyncio tasks instead of processes.
+
+    Each road has an asyncio.Queue for its normal vehicles and one for its priority vehicles
+    (standing in for the priority message type), the light state is a plain dict read directly
+    by the coordinator, and the priority requests and releases go to the lights through a queue
+    of commands instead of their control pipe. The decisions are those of lights.py and
+    coordinator.py; only the waiting is asynchronous.
+    """
+    def __init__(self, model, controller="fixed", light_interval=LIGHT_CHANGE_INTERVAL,
+                 display_address=(DISPLAY_HOST, DISPLAY_PORT), dashboard=False, display_log=None,
+                 capacity=QUEUE_CAPACITY, budget=COORDINATOR_TICK_BUDGET, scheduler=COORDINATOR_SCHEDULER,
+                 right_on_red=COORDINATOR_RIGHT_ON_RED):
+        """
+        capacity is the number of normal vehicles each road holds (0 for no limit), or a dict of capacities
+        per direction (QUEUE_CAPACITY for the missing ones); a generator waits for room in a full road.
+        scheduler and right_on_red select how the coordinator lets vehicles through, as in coordinator.main.
+        """
+        self.model = model
+        self.controller = controller
+        self.light_interval = light_interval
+        self.display_address = display_address
+        self.budget = budget
+        self.scheduler = scheduler
+        self.right_on_red = right_on_red
+
+        capacities = capacity if isinstance(capacity, dict) else dict.fromkeys(QUEUE_DIRECTIONS, capacity)
+        self.queues = {d: asyncio.Queue(capacities.get(d, QUEUE_CAPACITY)) for d in QUEUE_DIRECTIONS}
+        self.priority_queues = {d: asyncio.Queue() for d in QUEUE_DIRECTIONS}
+        self.waiting = {d: deque() for d in QUEUE_DIRECTIONS}  # Waiting lines of the conflict scheduler
+        self.shared_state = {}
+        self.commands = asyncio.Queue()
+        self.wakeup = asyncio.Event()
+
+        self.sink = DisplaySink()
+        self.dashboard = Dashboard(depths=self.queue_depths) if dashboard else None
+        self.log_file = open(display_log, "ab") if display_log is not None else None
+        self.subscribers = set()
+
+    def queue_depths(self):
+        """
+        Returns the number of vehicles waiting on each road.
+        """
+        return {d: self.queues[d].qsize() + self.priority_queues[d].qsize() + len(self.waiting[d])
+                for d in QUEUE_DIRECTIONS}
+
+    def publish(self, state):
+        publish_state(self.shared_state, state)
+        self.wakeup.set()
+
+    async def sleep(self, seconds):
+        """
+        Sleeps for the given number of simulated seconds.
+        """
+        await asyncio.sleep(sim_clock.real_interval(seconds))
+
+    # Lights
+    async def wait_for_commands(self, timeout):
+        """
+        Waits up to timeout simulated seconds for a command, and returns the commands received.
+        """
+        try:
+            commands = [await asyncio.wait_for(self.commands.get(), sim_clock.real_interval(max(timeout, 0)))]
+        except asyncio.TimeoutError:
+            return []
+        while not self.commands.empty():
+            commands.append(self.commands.get_nowait())
+        return commands
+
+    async def run_lights(self):
+        cycle = LightCycle(self.controller, self.light_interval, sim_clock.now())
+        while True:
+            priority_start = cycle.priority_start
+            depths = self.queue_depths() if self.controller == "adaptive" else None
+            changes = cycle.step(sim_clock.now(), depths)
+            publish_changes(self.shared_state, changes, priority_start)
+            if changes:
+                self.wakeup.set()
+
+            timeout = cycle.next_step(sim_clock.now(), ADAPTIVE_STEP)
+            for command in await self.wait_for_commands(ADAPTIVE_STEP if timeout is None else timeout):
+                if command[0] in PRIORITY_COMMANDS:
+                    cycle.request_priority(PRIORITY_COMMANDS[command[0]])
+                elif command == LIGHTS_PRIORITY_RELEASE:
+                    cycle.release_priority()
+
+    # Generators
+    async def run_normal_traffic(self):
+        vehicle_id = 0
+        start = sim_clock.now()
+        for arrival_time, source, dest in self.model:
+            delay = start + arrival_time - sim_clock.now()
+            if delay > 0:
+                await self.sleep(delay)
+            vehicle_id += 1
+            vehicle = VehicleMessage(vehicle_id, source, dest)
+            await self.queues[source].put(vehicle)
+            self.wakeup.set()
+            metrics.inc(f"generated.{source}")
+            event_log.record_vehicle(event_log.GENERATED, vehicle)
+
+    async def run_priority_traffic(self):
+        vehicle_id = 0
+        while True:
+            await self.sleep(PRIORITY_GEN_INTERVAL)
+            vehicle_id -= 1
+            source = random.choice(QUEUE_DIRECTIONS)
+            dest = random.choice([d for d in QUEUE_DIRECTIONS if d != source])
+            vehicle = VehicleMessage(vehicle_id, source, dest, priority=True)
+            self.priority_queues[source].put_nowait(vehicle)
+            self.wakeup.set()
+            metrics.inc(f"priority_generated.{source}")
+            event_log.record_vehicle(event_log.GENERATED, vehicle)
+
+            self.commands.put_nowait(LIGHTS_PRIORITY_REQUESTS[source])
+            event_log.record_vehicle(event_log.PRIORITY_REQUESTED, vehicle)
+
+    # Coordinator
+    def drain_active_directions(self, active_directions):
+        """
+        Takes the vehicles waiting on the active directions, at most budget in total, as
+        coordinator.drain_active_directions does. Returns the non-priority vehicles per direction
+        and the list of priority vehicles found.
+        """
+        share = max(1, self.budget // len(active_directions))
+        vehicles_by_direction = {}
+        priority_vehicles = []
+        for direction in active_directions:
+            priority_queue = self.priority_queues[direction]
+            priority_vehicles.extend(priority_queue.get_nowait() for _ in range(priority_queue.qsize()))
+            queue = self.queues[direction]
+            vehicles = [queue.get_nowait() for _ in range(min(share, queue.qsize()))]
+            if vehicles:
+                vehicles_by_direction[direction] = vehicles
+        return vehicles_by_direction, priority_vehicles
+
+    def fill_waiting_lines(self, state):
+        """
+        Tops up the waiting lines of the conflict scheduler, as coordinator.fill_waiting_lines does.
+        Returns True if any vehicle was taken, and the list of priority vehicles found.
+        """
+        green = state.get_active_directions()
+        share = max(1, self.budget // len(green))
+        received, priority_vehicles = False, []
+        for direction in green:
+            priority_queue = self.priority_queues[direction]
+            if not priority_queue.empty():
+                priority_vehicles.extend(priority_queue.get_nowait() for _ in range(priority_queue.qsize()))
+                received = True
+        for direction, queue in self.queues.items():
+            line = self.waiting[direction]
+            missing = (share if direction in green else int(self.right_on_red)) - len(line)
+            for _ in range(min(missing, queue.qsize())):
+                line.append(queue.get_nowait())
+                received = True
+        return received, priority_vehicles
+
+    async def run_coordinator(self):
+        sink = self.sink
+        last_state = self.shared_state["state"]
+        send_update(sink, f"[COORDINATOR] 🚦 Initial traffic lights: {last_state}")
+        unexpected_vehicles = deque()  # Priority vehicles taken before their lights, in arrival order
+
+        while True:
+            self.wakeup.clear()
+            state = self.shared_state["state"]
+
+            if state != last_state:
+                last_state = state
+                announce_light_change(sink, state)
+
+                if state.is_priority_vehicle_light():
+                    send_update(sink, f"[COORDINATOR] 🚨 High priority on the way.")
+                    direction = state.get_active_directions()[0]
+                    vehicle = take_priority_vehicle(unexpected_vehicles, direction)
+                    queue = self.priority_queues[direction]
+                    if vehicle is None and not queue.empty():
+                        vehicle = queue.get_nowait()
+                    if vehicle is not None:
+                        pass_priority_vehicle(vehicle, sink)
+                    else:
+                        send_update(sink, f"[COORDINATOR] 🚨 No priority vehicle waiting, resuming the normal cycle.")
+                    # Release the lights and wait for their acknowledgment (see coordinator.release_priority_lights)
+                    releases = self.shared_state.get("releases", 0)
+                    self.commands.put_nowait(LIGHTS_PRIORITY_RELEASE)
+                    while self.shared_state.get("releases", 0) == releases:
+                        self.wakeup.clear()
+                        await self.wakeup.wait()
+                    last_state = None
+                    continue
+
+            if self.scheduler == "conflict":
+                received, priority_vehicles = self.fill_waiting_lines(state)
+                passed = schedule_waiting_vehicles(self.waiting, state, sink, self.budget, self.right_on_red)
+                received = received or passed > 0
+            else:
+                vehicles_by_direction, priority_vehicles = self.drain_active_directions(state.get_active_directions())
+                if vehicles_by_direction:
+                    process_drained_vehicles(vehicles_by_direction, state.get_active_directions(), sink)
+                received = bool(vehicles_by_direction) or bool(priority_vehicles)
+            unexpected_vehicles.extend(priority_vehicles)
+
+            if received:
+                await asyncio.sleep(0)  # Let the other tasks run before the next tick
+            else:
+                await self.wakeup.wait()
+
+    # Display
+    async def run_display(self):
+        server = await asyncio.start_server(self.serve_subscriber, *self.display_address)
+        print(f"[DISPLAY] Server listening on {self.display_address[0]}:{self.display_address[1]}.")
+        if self.dashboard is not None:
+            asyncio.create_task(self.render_dashboard())
+        async with server:
+            while True:
+                await self.sink.ready.wait()
+                self.sink.ready.clear()
+                lines, self.sink.lines = self.sink.lines, deque()
+                self.publish_lines(b"".join(lines))
+
+    def publish_lines(self, text):
+        """
+        Prints the lines (or hands them to the dashboard), and copies them to the log file and
+        to every subscriber, as display.publish does.
+        """
+        if self.dashboard is not None:
+            self.dashboard.update([line for line in text.split(b"\n") if line])
+        else:
+            sys.stdout.write(text.decode("utf-8", "replace"))
+            sys.stdout.flush()
+        if self.log_file is not None:
+            self.log_file.write(text)
+        for writer in self.subscribers:
+            if writer.transport.get_write_buffer_size() + len(text) <= DISPLAY_SUBSCRIBER_BUFFER:
+                writer.write(text)
+
+    async def serve_subscriber(self, reader, writer):
+        print(f"[DISPLAY] Connection established with {writer.get_extra_info('peername')}.")
+        self.subscribers.add(writer)
+        try:
+            while await reader.read(65536):
+                pass
+        except OSError:
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    async def render_dashboard(self):
+        while True:
+            self.dashboard.render()
+            await asyncio.sleep(1.0 / DISPLAY_FRAME_RATE)
+
+    # Control
+    async def wait_for_exit(self):
+        """
+        Waits for 'j' + Enter on the standard input ('p' and 'm' toggle profiling, as in main.py).
+        Without a readable standard input, runs until terminated.
+        """
+        loop = asyncio.get_running_loop()
+        fd = sys.stdin.fileno()
+        keys = asyncio.Queue()
+
+        def read_keys():
+            data = os.read(fd, 1024)
+            if not data:
+                loop.remove_reader(fd)
+            for line in data.decode("utf-8", "replace").splitlines():
+                keys.put_nowait(line.strip().lower())
+
+        try:
+            loop.add_reader(fd, read_keys)
+        except (OSError, ValueError):
+            pass  # Not selectable (e.g. a regular file)
+        try:
+            while True:
+                key = await keys.get()
+                if key == "j":
+                    return
+                if key == "p" and profiling.enabled():
+                    os.kill(os.getpid(), profiling.PROFILE_SIGNAL)
+                elif key == "m" and profiling.enabled():
+                    os.kill(os.getpid(), profiling.TRACEMALLOC_SIGNAL)
+        finally:
+            loop.remove_reader(fd)
+
+    async def run(self):
+        """
+        Runs every component until 'j' is pressed (or the process is terminated).
+        """
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stopped.set)
+
+        self.publish(NS_GREEN)  # Before the coordinator reads it
+        display = asyncio.create_task(self.run_display(), name="Display")
+        await asyncio.sleep(0)  # Let the display listen first
+        tasks = [display] + [
+            asyncio.create_task(coroutine, name=name) for name, coroutine in (
+                ("Lights", self.run_lights()),
+                ("Normal traffic", self.run_normal_traffic()),
+                ("Priority traffic", self.run_priority_traffic()),
+                ("Coordinator", self.run_coordinator()),
+            )
+        ]
+        print(f"[MAIN] All components started in {(time.monotonic() - started) * 1000:.1f} ms (asyncio runner).")
+
+        # Run until 'j', SIGTERM or a failing component. A component that simply returns (e.g. the normal
+        # traffic at the end of a replayed trace) ends alone, as its process would.
+        exit_requested = asyncio.create_task(self.wait_for_exit())
+        signalled = asyncio.create_task(stopped.wait())
+        pending = {exit_requested, signalled, *tasks}
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            failed = [task for task in done if task in tasks and task.exception() is not None]
+            for task in failed:
+                print(f"[MAIN] {task.get_name()} failed: {task.exception()!r}")
+            if failed or exit_requested in done or signalled in done:
+                break
+
+        print("[MAIN] Terminating all tasks...")
+        for task in tasks + [exit_requested, signalled]:
+            task.cancel()
+        await asyncio.gather(*tasks, exit_requested, signalled, return_exceptions=True)
+        for writer in self.subscribers:
+            writer.close()
+        if self.log_file is not None:
+            self.log_file.close()
+
+
+def run(args):
+    """
+    Runs the intersection with the asyncio runner, with main.py's options
+    (the metrics and event log are configured by main.py beforehand).
+    """
+    profiling.install("asyncio")
+    model = arrivals.model_from_args(args, NORMAL_GEN_INTERVAL, NORMAL_GEN_BATCH_SIZE)
+    intersection = AsyncIntersection(model, args.controller, dashboard=args.dashboard,
+                                     display_log=args.display_log, capacity=args.queue_capacity,
+                                     scheduler=args.scheduler)
+    try:
+        asyncio.run(intersection.run())
+    finally:
+        metrics.shutdown()
+        event_log.shutdown()
+        print("[MAIN] All tasks and resources cleaned up.")
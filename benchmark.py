@@ -0,0 +1,344 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import threading
+import multiprocessing
+import sim_clock
+import startup
+from common import VehicleMessage, NS_GREEN, COORDINATOR_TICK_BUDGET
+from ipc_utils import (
+    queue_keys, init_message_queues, send_obj_message, receive_obj_message, send_obj_messages, receive_batch, notify,
+    LIGHTS_PRIORITY_REQUESTS, BENCH_BASE_KEY
+)
+from lights import toggle_lights, set_priority_light
+from coordinator import process_drained_vehicles
+from simulation import LogSink
+from main import start_simulation, stop_processes
+from startup import ReadinessBarrier
+
+
+DIRECTIONS = ["N", "S", "E", "W"]
+
+# Queues used by the benchmarks, in their own key range: the micro-benchmarks use the first key,
+# the end-to-end runs the next intersection.
+BENCH_QUEUE_KEY = BENCH_BASE_KEY
+BENCH_INTERSECTION = 1
+
+PASS_PATTERN = re.compile(r"Vehicle (-?\d+) from .* PASSES\.")
+
+
+# Helpers
+def random_vehicle(rng, vehicle_id, priority=False):
+    source = rng.choice(DIRECTIONS)
+    dest = rng.choice([d for d in DIRECTIONS if d != source])
+    return VehicleMessage(vehicle_id, source, dest, priority)
+
+def stream_seed(seed, stream):
+    """
+    Returns the seed of one random stream of a run (e.g. "normal" or "priority"), derived from the run's seed
+    so that the streams are independent of each other; None (unseeded) if seed is None.
+    """
+    return None if seed is None else f"{seed}/{stream}"
+
+def percentiles(values):
+    """
+    Returns mean, p50, p99 and max of a list of latencies (in milliseconds), or None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return {"count": len(values), "mean_ms": sum(values) / len(values) * 1000,
+            "p50_ms": pick(0.50), "p99_ms": pick(0.99), "max_ms": values[-1] * 1000}
+
+def rate(n, seconds):
+    return n / seconds if seconds > 0 else 0.0
+
+
+# Micro-benchmarks
+def bench_ipc(n, transport="sysv"):
+    """
+    Vehicles per second through one queue of the given transport, one message per vehicle and batched.
+    """
+    queue = init_message_queues({"B": BENCH_QUEUE_KEY}, transport)["B"]
+    try:
+        rng = random.Random(0)
+        vehicles = [random_vehicle(rng, i + 1) for i in range(n)]
+        # The queue holds a limited number of bytes: move vehicles in chunks.
+        chunk = 256
+
+        start = time.perf_counter()
+        for i in range(0, n, chunk):
+            for vehicle in vehicles[i:i + chunk]:
+                send_obj_message(queue, vehicle)
+            for _ in vehicles[i:i + chunk]:
+                receive_obj_message(queue)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(0, n, chunk):
+            send_obj_messages(queue, vehicles[i:i + chunk])
+            received = 0
+            while received < len(vehicles[i:i + chunk]):
+                received += len(receive_batch(queue, chunk))
+        batched = time.perf_counter() - start
+    finally:
+        queue.remove()
+    prefix = "ipc" if transport == "sysv" else transport
+    return {f"{prefix}_single_vehicles_per_s": rate(n, single), f"{prefix}_batch_vehicles_per_s": rate(n, batched)}
+
+def bench_coordinator(n):
+    """
+    Vehicles per second through the coordinator's pairing and logging logic (no IPC, no display).
+    """
+    rng = random.Random(0)
+    active_directions = ["N", "S"]
+    ticks = []
+    for i in range(0, n, COORDINATOR_TICK_BUDGET):
+        per_direction = COORDINATOR_TICK_BUDGET // 2
+        ticks.append({
+            direction: [VehicleMessage(i + j, direction, rng.choice([d for d in DIRECTIONS if d != direction]))
+                        for j in range(per_direction)]
+            for direction in active_directions
+        })
+    sink = LogSink()
+    start = time.perf_counter()
+    for vehicles_by_direction in ticks:
+        process_drained_vehicles(vehicles_by_direction, active_directions, sink)
+    elapsed = time.perf_counter() - start
+    return {"coordinator_vehicles_per_s": rate(len(ticks) * COORDINATOR_TICK_BUDGET, elapsed)}
+
+def bench_light_state(n):
+    """
+    LightState operations per second on the coordinator's hot path.
+    """
+    state = NS_GREEN
+    priority = set_priority_light("E")
+    start = time.perf_counter()
+    for _ in range(n):
+        state = toggle_lights(state)
+        state == priority
+        state.is_priority_vehicle_light()
+        state.get_active_directions()
+    elapsed = time.perf_counter() - start
+    return {"light_state_ops_per_s": rate(4 * n, elapsed)}
+
+
+# End-to-end benchmark
+def bench_normal_traffic(queues, wakeup_fd, arrival_rate, created, seed=None):
+    """
+    Normal traffic generator at a fixed arrival rate. Records each vehicle's generation time in created.
+    """
+    startup.ready("normal_traffic")
+    rng = random.Random(stream_seed(seed, "normal"))
+    interval = 1.0 / arrival_rate
+    vehicle_id = 0
+    next_time = sim_clock.now()
+    while True:
+        vehicle_id += 1
+        vehicle = random_vehicle(rng, vehicle_id)
+        if vehicle_id < len(created):
+            created[vehicle_id] = vehicle.created_at
+        send_obj_message(queues[vehicle.source_road], vehicle)
+        notify(wakeup_fd)
+
+        next_time += interval
+        delay = next_time - sim_clock.now()
+        if delay > 0:
+            sim_clock.sleep(delay)
+
+def bench_priority_traffic(queues, shared_state, lights_fd, wakeup_fd, interval, signalled, seed=None):
+    """
+    Priority traffic generator. Records when the lights were requested for each priority vehicle.
+    """
+    startup.ready("priority_traffic")
+    rng = random.Random(stream_seed(seed, "priority"))
+    vehicle_id = 0
+    while True:
+        sim_clock.sleep(interval)
+        vehicle_id -= 1
+        vehicle = random_vehicle(rng, vehicle_id, priority=True)
+        send_obj_message(queues[vehicle.source_road], vehicle)
+        notify(wakeup_fd)
+        if -vehicle_id < len(signalled):
+            signalled[-vehicle_id] = sim_clock.now()
+        notify(lights_fd, LIGHTS_PRIORITY_REQUESTS[vehicle.source_road])
+
+def collect_passes(server_socket, created, signalled, results):
+    """
+    Stands in for the display process: timestamps every PASSES line it receives.
+    """
+    conn, _ = server_socket.accept()
+    buffer = b""
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            break
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        now = sim_clock.now()
+        for line in lines:
+            match = PASS_PATTERN.search(line.decode("utf-8", "replace"))
+            if not match:
+                continue
+            vehicle_id = int(match.group(1))
+            if vehicle_id > 0:
+                results["passed"] += 1
+                if vehicle_id < len(created) and created[vehicle_id]:
+                    results["latencies"].append(now - created[vehicle_id])
+            elif -vehicle_id < len(signalled) and signalled[-vehicle_id]:
+                results["preemptions"].append(now - signalled[-vehicle_id])
+    conn.close()
+
+def sample_queue_depths(queues, stop, samples, period=0.1):
+    """
+    Records the number of messages waiting in each queue every period seconds.
+    """
+    start = sim_clock.now()
+    while not stop.is_set():
+        depths = {direction: queue.current_messages for direction, queue in queues.items()}
+        samples.append([round(sim_clock.now() - start, 3)] + [depths[d] for d in DIRECTIONS])
+        stop.wait(period)
+
+def run_end_to_end(duration, arrival_rate, priority_interval, light_interval, controller="fixed",
+                   intersection=BENCH_INTERSECTION, seed=None, transport="sysv", scheduler="pairs",
+                   key_base=BENCH_BASE_KEY):
+    """
+    Runs the real lights and coordinator processes (as started by main.py) for duration seconds,
+    fed by rate-controlled generators, and measures throughput and latencies.
+    The run uses the queues of the given intersection of the key_base range and a display port chosen by
+    the system, so that concurrent runs with different intersections never share IPC resources.
+    """
+    capacity = int(arrival_rate * duration * 2) + 1000
+    created = multiprocessing.Array("d", capacity, lock=False)
+    signalled = multiprocessing.Array("d", int(duration / priority_interval) + 10, lock=False)
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind(("localhost", 0))
+    server_socket.listen(1)
+    results = {"passed": 0, "latencies": [], "preemptions": []}
+    collector = threading.Thread(target=collect_passes, args=(server_socket, created, signalled, results), daemon=True)
+    collector.start()
+
+    barrier = ReadinessBarrier()
+    processes, queues, shared_state = start_simulation(
+        display_address=server_socket.getsockname(), start_display=False, keys=queue_keys(intersection, key_base),
+        light_interval=light_interval, controller=controller, transport=transport, scheduler=scheduler,
+        normal_target=bench_normal_traffic, normal_args=(arrival_rate, created, seed),
+        priority_target=bench_priority_traffic, priority_args=(priority_interval, signalled, seed),
+        barrier=barrier
+    )
+
+    stop = threading.Event()
+    samples = []
+    sampler = threading.Thread(target=sample_queue_depths, args=(queues, stop, samples), daemon=True)
+    sampler.start()
+
+    start = sim_clock.now()
+    sim_clock.sleep(duration)
+    passed = results["passed"]
+    elapsed = sim_clock.now() - start
+    generated = sum(1 for t in created if t)
+    stop.set()
+    sampler.join()
+    stop_processes(processes, queues, shared_state)
+    collector.join(timeout=1)
+    server_socket.close()
+
+    return {
+        "duration_s": elapsed,
+        "arrival_rate": arrival_rate,
+        "controller": controller,
+        "transport": transport,
+        "scheduler": scheduler,
+        "generated": generated,
+        "passed": passed,
+        "vehicles_per_s": rate(passed, elapsed),
+        "latency": percentiles(results["latencies"]),
+        "preemption_latency": percentiles(results["preemptions"]),
+        "startup": barrier.timings(),
+        "queue_depth": {"columns": ["t"] + DIRECTIONS, "samples": samples},
+    }
+
+
+# Reporting
+def flatten(results, prefix=""):
+    """
+    Yields (name, value) for every number in the results, skipping time series.
+    """
+    for key, value in results.items():
+        if key in ("queue_depth", "meta"):
+            continue
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{key}", value
+
+def compare(results, baseline):
+    """
+    Prints the relative change of every metric against a previous results file.
+    """
+    previous = dict(flatten(baseline))
+    print(f"{'metric':48} {'baseline':>14} {'current':>14} {'change':>8}")
+    for name, value in flatten(results):
+        if name not in previous:
+            continue
+        old = previous[name]
+        change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{name:48} {old:14.2f} {value:14.2f} {change:>8}")
+
+
+def main(argv=None):
+    """
+    Entry point of the benchmark suite.
+    """
+    parser = argparse.ArgumentParser(description="Throughput and latency benchmarks of the traffic simulation.")
+    parser.add_argument("--duration", type=float, default=10, help="length of the end-to-end run, in seconds")
+    parser.add_argument("--rate", type=float, default=50, help="normal vehicles generated per second")
+    parser.add_argument("--priority-interval", type=float, default=2.5, help="seconds between priority vehicles")
+    parser.add_argument("--light-interval", type=float, default=1, help="seconds between light changes")
+    parser.add_argument("--controller", choices=["fixed", "adaptive"], default="fixed", help="light controller")
+    parser.add_argument("--transport", choices=["sysv", "ring"], default="sysv", help="queues of the end-to-end run")
+    parser.add_argument("--scheduler", choices=["pairs", "conflict"], default="pairs",
+                        help="coordinator scheduler of the end-to-end run")
+    parser.add_argument("--iterations", type=int, default=100000, help="iterations of the micro-benchmarks")
+    parser.add_argument("--skip-micro", action="store_true", help="do not run the micro-benchmarks")
+    parser.add_argument("--skip-e2e", action="store_true", help="do not run the end-to-end benchmark")
+    parser.add_argument("--output", default="bench_results.json", help="file the results are written to (JSON)")
+    parser.add_argument("--compare", metavar="FILE", help="previous results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = {"meta": {"python": platform.python_version(), "cpus": os.cpu_count(), "time": time.time()}}
+    if not args.skip_micro:
+        print("[BENCHMARK] Running micro-benchmarks...")
+        results["micro"] = {}
+        results["micro"].update(bench_ipc(args.iterations))
+        results["micro"].update(bench_ipc(args.iterations, "ring"))
+        results["micro"].update(bench_coordinator(args.iterations))
+        results["micro"].update(bench_light_state(args.iterations))
+    if not args.skip_e2e:
+        print(f"[BENCHMARK] Running end-to-end benchmark at {args.rate:g} vehicles/s for {args.duration:g}s...")
+        results["end_to_end"] = run_end_to_end(args.duration, args.rate, args.priority_interval,
+                                                  args.light_interval, args.controller,
+                                                  transport=args.transport, scheduler=args.scheduler)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[BENCHMARK] Results written to {args.output}")
+
+    for name, value in flatten(results):
+        print(f"  {name:46} {value:14.2f}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,151 @@
+import sim_clock
+
+
 # Time intervals (in seconds)
 NORMAL_GEN_INTERVAL = 3         # Interval for generating normal vehicles
 PRIORITY_GEN_INTERVAL = 21      # Interval for generating high-priority vehicles
 LIGHT_CHANGE_INTERVAL = 10      # Interval for traffic light changes
 
+# Light controller: "fixed" (toggle every LIGHT_CHANGE_INTERVAL) or "adaptive" (follow queue depths),
+# and the bounds of a green phase in adaptive mode (in seconds)
+LIGHT_CONTROLLER = "fixed"
+ADAPTIVE_MIN_GREEN = 3
+ADAPTIVE_MAX_GREEN = 30
+
+# Number of normal vehicles generated every NORMAL_GEN_INTERVAL (sent in batches per road)
+NORMAL_GEN_BATCH_SIZE = 1
+
+# Maximum number of vehicles the coordinator lets through per tick
+COORDINATOR_TICK_BUDGET = 32
+
+# How the coordinator lets vehicles through: "pairs" (the heads of the green roads, in pairs) or "conflict"
+# (the largest set of queue heads whose movements do not conflict, see movements.py), and whether
+# right turns may pass on red with the conflict scheduler
+COORDINATOR_SCHEDULER = "pairs"
+COORDINATOR_RIGHT_ON_RED = True
+
+# Grid mode: idle wait of a worker between two passes, and period of its progress reports (in seconds)
+GRID_POLL_INTERVAL = 0.05
+GRID_REPORT_INTERVAL = 10
+
+# Period of the metrics snapshot file, when enabled (in seconds)
+METRICS_SNAPSHOT_INTERVAL = 1.0
+
+# Simulated time runs CLOCK_SPEEDUP times faster than the wall clock (1 = real time)
+CLOCK_SPEEDUP = 1.0
+FAST_CLOCK_SPEEDUP = 1000.0     # Speed-up used by "python main.py --fast"
+
 # Socket configuration for the display process
 DISPLAY_HOST = "localhost"
 DISPLAY_PORT = 5000
 
+# Log lines the coordinator buffers for the display before dropping new ones, and bytes the
+# display buffers for each subscriber before dropping lines
+DISPLAY_BUFFER_LINES = 10000
+DISPLAY_SUBSCRIBER_BUFFER = 1 << 20
+
+# Redraws per second of the display's dashboard mode
+DISPLAY_FRAME_RATE = 4
+
+# Event log (main.py --event-log): bytes buffered per process, and interval at which the buffers are flushed (in seconds)
+EVENT_LOG_BUFFER_SIZE = 64 * 1024
+EVENT_LOG_FLUSH_INTERVAL = 1.0
+
+# Transport of the vehicle queues: "sysv" (SysV message queues) or "ring" (shared memory rings, see shm_ring.py),
+# and the 64-byte slots of each ring lane (a vehicle takes one slot, a full batch 33)
+IPC_TRANSPORT = "sysv"
+RING_SLOTS = 16384
+RING_PRIORITY_SLOTS = 256
+
+# Vehicles each road queue holds (0 for the transport's default: 16 KiB, about 1000 vehicles, for SysV queues,
+# RING_SLOTS for rings), or a dict of capacities per direction
+QUEUE_CAPACITY = 0
+
+# What the generators do with normal vehicles when their queue is full: "block" (wait up to QUEUE_BLOCK_TIMEOUT
+# seconds, or forever if None, then drop), "drop-newest", "drop-oldest" (SysV queues only), or "spill"
+# (write them to a file in QUEUE_SPILL_DIR, None for the system's temporary directory, and send them
+# back once the queue drains). Priority vehicles always wait for room.
+QUEUE_OVERFLOW_POLICY = "block"
+QUEUE_BLOCK_TIMEOUT = 1.0
+QUEUE_SPILL_DIR = None
+QUEUE_OVERFLOW_REPORT_INTERVAL = 5.0    # Seconds between warnings about the same overflowing queue
+# Spilled vehicles: real seconds between two attempts to send them back, real seconds a generator whose
+# arrivals ended keeps trying before dropping them, and bytes already sent back before a spill file is compacted
+QUEUE_SPILL_DRAIN_INTERVAL = 0.05
+QUEUE_SPILL_FINAL_TIMEOUT = 30.0
+QUEUE_SPILL_COMPACT_SIZE = 1 << 20
+
+# Profiling (main.py --profile-dir): "cprofile" or "sampling" CPU profiles, and the sampling period (in seconds)
+PROFILE_MODE = "cprofile"
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Backend used to share the light state between processes: "shm" (shared memory) or "manager"
+SHARED_STATE_BACKEND = "shm"
+
+# Wake the coordinator on new vehicles and light changes instead of polling every 100 ms
+COORDINATOR_EVENT_DRIVEN = True
+
+# Longest wait for the processes of an intersection to report that they are ready (in seconds)
+STARTUP_TIMEOUT = 5.0
+
+# Bit of each direction in a light state mask
+LIGHT_BITS = {"N": 0x1, "S": 0x2, "E": 0x4, "W": 0x8}
+
 class LightState:
     """
     Represents the state of the traffic lights at the intersection.
     Each direction is represented by an integer (1 for green, 0 for red).
+
+    States are immutable and interned: they are backed by a 4-bit mask (see LIGHT_BITS), there is
+    a single instance per mask, and LightState(...) or LightState.from_mask() return it. Equality is
+    identity, and the active directions are computed once per state.
     """
-    def __init__(self, north=1, south=1, east=0, west=0):
-        self.north = north
-        self.south = south
-        self.east = east
-        self.west = west
+    __slots__ = ("mask", "active_directions", "priority")
 
-    def __eq__(self, other):
+    def __new__(cls, north=1, south=1, east=0, west=0):
+        return cls.from_mask(
+            (LIGHT_BITS["N"] if north else 0) | (LIGHT_BITS["S"] if south else 0) |
+            (LIGHT_BITS["E"] if east else 0) | (LIGHT_BITS["W"] if west else 0)
+        )
+
+    @staticmethod
+    def from_mask(mask):
         """
-        Checks if two LightState objects are equal
+        Returns the state of the given mask.
         """
-        if isinstance(other, LightState):
-            return (self.north == other.north and
-                    self.south == other.south and
-                    self.east == other.east and
-                    self.west == other.west)
-        return False
+        return _LIGHT_STATES[mask & 0xF]
+
+    @classmethod
+    def _create(cls, mask):
+        state = object.__new__(cls)
+        active = tuple(d for d, bit in LIGHT_BITS.items() if mask & bit)
+        object.__setattr__(state, "mask", mask)
+        object.__setattr__(state, "active_directions", active)
+        object.__setattr__(state, "priority", len(active) == 1)
+        return state
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LightState is immutable")
+
+    def __reduce__(self):
+        """Unpickles to the interned instance."""
+        return LightState.from_mask, (self.mask,)
+
+    @property
+    def north(self):
+        return self.mask & 0x1
+
+    @property
+    def south(self):
+        return (self.mask >> 1) & 0x1
+
+    @property
+    def east(self):
+        return (self.mask >> 2) & 0x1
+
+    @property
+    def west(self):
+        return (self.mask >> 3) & 0x1
 
     def __repr__(self):
         """Return a string representation of the LightState."""
@@ -37,14 +155,23 @@ class LightState:
         """
         Checks if only one direction is green, indicating priority vehicles.
         """
-        return sum([self.north, self.south, self.east, self.west]) == 1
+        return self.priority
 
     def get_active_directions(self):
         """
-        Returns a list of active directions where the light is green.
+        Returns a tuple of active directions where the light is green.
         """
-        directions = {"N": self.north, "S": self.south, "E": self.east, "W": self.west}
-        return [dir for dir, state in directions.items() if state == 1]
+        return self.active_directions
+
+_LIGHT_STATES = tuple(LightState._create(mask) for mask in range(16))
+
+# The six legal states: normal cycle and priority (green for a single road)
+NS_GREEN = LightState.from_mask(LIGHT_BITS["N"] | LIGHT_BITS["S"])
+EW_GREEN = LightState.from_mask(LIGHT_BITS["E"] | LIGHT_BITS["W"])
+PRIORITY_LIGHTS = {direction: LightState.from_mask(bit) for direction, bit in LIGHT_BITS.items()}
+
+# Road on the right of each road: turning right means driving from a road to the one on its right
+RIGHT_OF = {"N": "E", "E": "S", "S": "W", "W": "N"}
 
 
 class VehicleMessage:
@@ -56,12 +183,16 @@ class VehicleMessage:
       source_road: The road section where the vehicle comes from ('N', 'S', 'E', or 'W').
       dest_road: The road section where the vehicle is headed.
       priority: Boolean flag indicating if the vehicle is high-priority (not used in this version).
+      created_at: Generation timestamp (sim_clock.now(), shared by all processes).
     """
-    def __init__(self, vehicle_id: int, source_road: str, dest_road: str, priority=False):
+    __slots__ = ("vehicle_id", "source_road", "dest_road", "priority", "created_at")
+
+    def __init__(self, vehicle_id: int, source_road: str, dest_road: str, priority=False, created_at=None):
         self.vehicle_id = vehicle_id
         self.source_road = source_road
         self.dest_road = dest_road
         self.priority = priority
+        self.created_at = sim_clock.now() if created_at is None else created_at
 
     def __repr__(self):
         """Return a string representation of the VehicleMessage."""
@@ -71,5 +202,4 @@ class VehicleMessage:
         """
         Returns True if the vehicle is turning right.
         """
-        right_of = {"N": "E", "E": "S", "S": "W", "W": "N"}
-        return self.dest_road == right_of.get(self.source_road)
\ No newline at end of file
+        return self.dest_road == RIGHT_OF.get(self.source_road)
\ No newline at end of file
@@ -1,13 +1,23 @@
-import time
-import os
-import signal
-from ipc_utils import receive_obj_message
-from common import LightState
+import sim_clock
+import metrics
+import event_log
+import profiling
+import startup
+from collections import deque
+from ipc_utils import (
+    receive_batch, receive_priority_vehicle, wait_for_wakeup, notify, LIGHTS_PRIORITY_RELEASE
+)
+from common import LightState, LIGHT_BITS, COORDINATOR_TICK_BUDGET, COORDINATOR_SCHEDULER, COORDINATOR_RIGHT_ON_RED
+from display import DisplayChannel
+from movements import select_movements
 
 
 # Global flags
 last_state = None
-unexpected_vehicle = None
+unexpected_vehicles = deque()  # Priority vehicles received before their lights, in arrival order
+
+# Upper bound on a single wait in event-driven mode (in seconds)
+EVENT_WAIT_TIMEOUT = 1.0
 
 
 # Utility functions
@@ -24,38 +34,86 @@ def get_priority_light(direction):
     """
     Returns a LightState with green only for the given direction.
     """
-    return LightState(
-        north=1 if direction == "N" else 0,
-        south=1 if direction == "S" else 0,
-        east=1 if direction == "E" else 0,
-        west=1 if direction == "W" else 0
-    )
+    return LightState.from_mask(LIGHT_BITS.get(direction, 0))
 
-# Function to process a high-priority vehicle
-def process_priority_vehicle(queue, shared_state, display_socket, lights_pid):
+def record_pass(vehicle):
     """
-    Processes a high-priority vehicle.
+    Counts a passing vehicle and its generation-to-pass latency.
     """
-    send_update(display_socket, f"[COORDINATOR] 🚨 High priority on the way.")
+    metrics.inc(("priority_passed." if vehicle.priority else "passed.") + vehicle.source_road)
+    metrics.observe("latency", sim_clock.now() - vehicle.created_at)
+    event_log.record_vehicle(event_log.PASSED, vehicle)
 
-    # Skip non-priority vehicles until the priority vehicle arrives.
-    vehicle = receive_obj_message(queue)
-    while not vehicle.priority:
-        send_update(display_socket, "-------------------------------- Solitary  --------------------------------")
-        send_update(display_socket, f"[COORDINATOR] ✅ {vehicle} PASSES.")
-        vehicle = receive_obj_message(queue)
+def announce_light_change(display_socket, state):
+    """
+    Logs a new traffic lights state.
+    """
+    send_update(display_socket,"---------------------------------------------------------------------------")
+    if state.is_priority_vehicle_light():
+        send_update(display_socket, f"[COORDINATOR] 🚦 Priority lights set: {state}")
+    else:
+        send_update(display_socket, f"[COORDINATOR] 🚦 Traffic lights changed: {state}")
 
-    # Allow priority vehicle to pass.
+def pass_priority_vehicle(vehicle, display_socket):
+    """
+    Lets a high-priority vehicle through.
+    """
     send_update(display_socket, "---------------------------- Priority Solitary ----------------------------")
     send_update(display_socket, f"[COORDINATOR] 🚨 {vehicle} PASSES.")
+    record_pass(vehicle)
+
+def wait_for_release(shared_state, releases, wakeup_fd=None):
+    """
+    Blocks until the lights have acknowledged a release after the given count of releases.
+    With wakeup_fd, the lights' notification of the acknowledgment wakes the coordinator up.
+    """
+    while shared_state.get("releases", 0) == releases:
+        if wakeup_fd is None:
+            sim_clock.sleep(0.05)
+        else:
+            wait_for_wakeup(wakeup_fd, EVENT_WAIT_TIMEOUT)
+
+def release_priority_lights(shared_state, lights_fd, wakeup_fd=None):
+    """
+    Asks the lights to leave the priority state, and waits until they acknowledge it (see
+    lights.publish_changes). The state they publish next may be the same priority light again,
+    for the next priority vehicle of the same road, so the acknowledgment is a counter, not a state change.
+    """
+    releases = shared_state.get("releases", 0)
+    notify(lights_fd, LIGHTS_PRIORITY_RELEASE)
+    wait_for_release(shared_state, releases, wakeup_fd)
+
+# Function to process a high-priority vehicle
+def take_priority_vehicle(unexpected, direction):
+    """
+    Removes and returns the oldest of the priority vehicles received ahead of their lights (unexpected)
+    that comes from the given road, or None.
+    """
+    for vehicle in unexpected:
+        if vehicle.source_road == direction:
+            unexpected.remove(vehicle)
+            return vehicle
+    return None
+
+def process_priority_vehicle(queue, shared_state, display_socket, lights_fd, wakeup_fd=None, vehicle=None):
+    """
+    Processes a high-priority vehicle, once the lights are green for its road only.
+    The vehicle is fetched ahead of the vehicles waiting in front of it (by its message type),
+    unless it was already received (vehicle).
+    """
+    send_update(display_socket, f"[COORDINATOR] 🚨 High priority on the way.")
 
-    # Signal lights to return to the normal cycle.
-    os.kill(lights_pid, signal.SIGUSR2)
+    if vehicle is None:
+        vehicle = receive_priority_vehicle(queue)
 
-    # Wait until the lights state is no longer the priority state (back to normal).
-    desired_state = get_priority_light(vehicle.source_road)
-    while shared_state.get("state") == desired_state:
-        time.sleep(0.05)
+    # Allow priority vehicle to pass.
+    if vehicle is not None:
+        pass_priority_vehicle(vehicle, display_socket)
+    else:
+        send_update(display_socket, f"[COORDINATOR] 🚨 No priority vehicle waiting, resuming the normal cycle.")
+
+    # Return the lights to the normal cycle.
+    release_priority_lights(shared_state, lights_fd, wakeup_fd)
 
 # Functions to process non-priority vehicles
 def process_pair(vehicle1, vehicle2, display_socket):
@@ -68,6 +126,8 @@ def process_pair(vehicle1, vehicle2, display_socket):
     else:
         send_update(display_socket, f"[COORDINATOR] ✅ {vehicle1} PASSES.")
         send_update(display_socket, f"[COORDINATOR] ✅ {vehicle2} PASSES.")
+    record_pass(vehicle1)
+    record_pass(vehicle2)
 
 def process_non_priority_vehicles(non_priority_vehicles, active_directions, display_socket):
     """
@@ -83,20 +143,116 @@ def process_non_priority_vehicles(non_priority_vehicles, active_directions, disp
         send_update(display_socket, "-------------------------------- Solitary  --------------------------------")
         for vehicle in non_priority_vehicles.values():
             send_update(display_socket, f"[COORDINATOR] ✅ {vehicle} PASSES.")
+            record_pass(vehicle)
+
+def drain_active_directions(queues, active_directions, budget=COORDINATOR_TICK_BUDGET):
+    """
+    Receives the vehicles waiting on the active directions, at most budget in total
+    (split evenly between the directions).
+    Returns a dict mapping each direction to its non-priority vehicles in arrival order,
+    and the list of priority vehicles found.
+    """
+    share = max(1, budget // len(active_directions))
+    vehicles_by_direction = {}
+    priority_vehicles = []
+    for direction in active_directions:
+        vehicles = []
+        for vehicle in receive_batch(queues[direction], share, block=False):
+            if vehicle.priority:
+                priority_vehicles.append(vehicle)
+            else:
+                vehicles.append(vehicle)
+        if vehicles:
+            vehicles_by_direction[direction] = vehicles
+    return vehicles_by_direction, priority_vehicles
+
+def process_drained_vehicles(vehicles_by_direction, active_directions, display_socket):
+    """
+    Processes drained vehicles round by round: the i-th vehicle of each active direction
+    goes together, as a pair or solitary, exactly as if they had been received on consecutive ticks.
+    """
+    rounds = max(len(vehicles) for vehicles in vehicles_by_direction.values())
+    for i in range(rounds):
+        non_priority_vehicles = {
+            direction: vehicles[i]
+            for direction, vehicles in vehicles_by_direction.items()
+            if i < len(vehicles)
+        }
+        process_non_priority_vehicles(non_priority_vehicles, active_directions, display_socket)
+
+# Conflict scheduler
+def fill_waiting_lines(queues, waiting, state, budget=COORDINATOR_TICK_BUDGET, right_on_red=COORDINATOR_RIGHT_ON_RED):
+    """
+    Receives vehicles into the waiting line of each road: up to budget vehicles split evenly between
+    the green roads, and the head of each red road if right turns may pass on red.
+    Returns True if any vehicle was received, and the list of priority vehicles found.
+    """
+    green = state.get_active_directions()
+    share = max(1, budget // len(green))
+    received, priority_vehicles = False, []
+    for direction, queue in queues.items():
+        line = waiting[direction]
+        missing = (share if direction in green else int(right_on_red)) - len(line)
+        if missing <= 0:
+            continue
+        for vehicle in receive_batch(queue, missing, block=False):
+            received = True
+            if vehicle.priority:
+                priority_vehicles.append(vehicle)
+            else:
+                line.append(vehicle)
+    return received, priority_vehicles
+
+def process_group(vehicles, display_socket):
+    """
+    Lets a group of vehicles with non-conflicting movements through, right turns first.
+    """
+    header = {1: "Solitary ", 2: "Pair"}.get(len(vehicles), f"Group of {len(vehicles)}")
+    send_update(display_socket, f"-------------------------------- {header} --------------------------------")
+    for vehicle in sorted(vehicles, key=lambda v: not v.is_turning_right()):
+        send_update(display_socket, f"[COORDINATOR] ✅ {vehicle} PASSES.")
+        record_pass(vehicle)
+
+def schedule_waiting_vehicles(waiting, state, display_socket, budget=COORDINATOR_TICK_BUDGET,
+                              right_on_red=COORDINATOR_RIGHT_ON_RED):
+    """
+    Lets the waiting vehicles through round by round: each round, the largest set of heads of the
+    waiting lines whose movements do not conflict passes together (see movements.select_movements).
+    Stops when no head may pass, or after budget vehicles. Returns the number of vehicles passed.
+    """
+    passed = 0
+    while passed < budget:
+        heads = {direction: line[0] for direction, line in waiting.items() if line}
+        directions = select_movements(heads, state, right_on_red) if heads else None
+        if not directions:
+            break
+        process_group([waiting[direction].popleft() for direction in directions], display_socket)
+        passed += len(directions)
+    return passed
 
 # Main
-def main(queues, shared_state, display_socket, lights_pid):
+def main(queues, shared_state, display_socket, lights_fd, wakeup_fd=None, scheduler=COORDINATOR_SCHEDULER):
     """
     Entry point for the coordinator process.
     Allows all vehicles (priority or not) to pass according to traffic regulations and the state of traffic lights.
+    lights_fd is the write end of the lights' control channel, used to release the priority lights.
+    If wakeup_fd is given, the coordinator sleeps until a vehicle or a light change is notified on it
+    instead of polling every 100 ms.
+    Log lines go through a DisplayChannel, so a slow display never holds up the coordinator.
+    scheduler is "pairs" (process_drained_vehicles) or "conflict" (schedule_waiting_vehicles, with
+    vehicles received ahead into per-road waiting lines).
     """
-    global unexpected_vehicle
     global last_state
 
+    profiling.install("coordinator")
+    display_socket = DisplayChannel(display_socket)
+    waiting = {direction: deque() for direction in queues}
+
     # Initialize and log the traffic lights state.
     current_state = shared_state.get("state")
     send_update(display_socket, f"[COORDINATOR] 🚦 Initial traffic lights: {current_state}")
     last_state = current_state
+    startup.ready("coordinator")
 
     while True:
         # Get the current traffic lights state.
@@ -105,49 +261,41 @@ def main(queues, shared_state, display_socket, lights_pid):
         # If the traffic lights have changed, print the change.
         if current_state != last_state:
             last_state = current_state
-            send_update(display_socket,"---------------------------------------------------------------------------")
+            announce_light_change(display_socket, current_state)
 
             # Handle priority vehicle passage if priority lights are active
             if last_state.is_priority_vehicle_light():
-                send_update(display_socket, f"[COORDINATOR] 🚦 Priority lights set: {current_state}")
-                if not unexpected_vehicle:
-                    active_direction = current_state.get_active_directions()[0]
-                    process_priority_vehicle(queues[active_direction], shared_state, display_socket, lights_pid)
-                    continue
-                else:
-                    # Allow priority vehicle to pass.
-                    send_update(display_socket, f"[COORDINATOR] 🚨 High priority on the way.")
-                    send_update(display_socket,"---------------------------- Priority Solitary ----------------------------")
-                    send_update(display_socket, f"[COORDINATOR] 🚨 {unexpected_vehicle} PASSES.")
-                    unexpected_vehicle = None
-
-                    # Signal lights to return to the normal cycle.
-                    os.kill(lights_pid, signal.SIGUSR2)
-
-                    # Wait until the lights state is no longer the priority state (back to normal).
-                    while shared_state.get("state") == last_state:
-                        time.sleep(0.05)
-
-            else:
-                send_update(display_socket, f"[COORDINATOR] 🚦 Traffic lights changed: {current_state}")
+                # The priority vehicle may already have been received while its road was green.
+                active_direction = current_state.get_active_directions()[0]
+                vehicle = take_priority_vehicle(unexpected_vehicles, active_direction)
+                process_priority_vehicle(queues[active_direction], shared_state, display_socket,
+                                         lights_fd, wakeup_fd, vehicle)
+                last_state = None  # Whatever the lights publish after the release is a new phase
+                continue
 
         # If no priority vehicle on the way.
         # Determine active directions from the current light state.
         active_directions = current_state.get_active_directions()
+        received = False
+
+        if active_directions and scheduler == "conflict":
+            # Receive the heads of every road, and let the largest compatible groups through.
+            received, priority_vehicles = fill_waiting_lines(queues, waiting, current_state)
+            unexpected_vehicles.extend(priority_vehicles)
+            received = schedule_waiting_vehicles(waiting, current_state, display_socket) > 0 or received
 
-        if active_directions:
-            non_priority_vehicles = {}
-            # Retrieve vehicles from each active direction.
-            for direction in active_directions:
-                vehicle = receive_obj_message(queues[direction], block=False)
-                if vehicle is not None:
-                    if vehicle.priority:
-                        unexpected_vehicle = vehicle
-                    else:
-                        non_priority_vehicles[direction] = vehicle
+        elif active_directions:
+            # Retrieve every waiting vehicle from the active directions, up to the tick budget.
+            non_priority_vehicles, priority_vehicles = drain_active_directions(queues, active_directions)
+            unexpected_vehicles.extend(priority_vehicles)
+            received = bool(non_priority_vehicles) or bool(priority_vehicles)
 
             # After checking all active directions, process non-priority vehicles.
             if non_priority_vehicles:
-                process_non_priority_vehicles(non_priority_vehicles, active_directions, display_socket)
+                process_drained_vehicles(non_priority_vehicles, active_directions, display_socket)
 
-        time.sleep(0.1)  # 100 msj
\ No newline at end of file
+        if wakeup_fd is None:
+            sim_clock.sleep(0.1)  # 100 ms
+        elif not received:
+            # Queues of the active directions are empty: sleep until something happens.
+            wait_for_wakeup(wakeup_fd, EVENT_WAIT_TIMEOUT)
@@ -1,59 +1,331 @@
-import socket
-import signal
 import sys
-from common import DISPLAY_HOST, DISPLAY_PORT
+import time
+import signal
+import socket
+import selectors
+import threading
+import sysv_ipc
+import profiling
+import startup
+from collections import deque, Counter
+from common import (
+    DISPLAY_HOST, DISPLAY_PORT, DISPLAY_BUFFER_LINES, DISPLAY_SUBSCRIBER_BUFFER, DISPLAY_FRAME_RATE
+)
 
-# Global variable to hold the server socket
+# Global variables to hold the server socket, the selector, and the optional dashboard and log file
 server_socket = None
-conn = None
+selector = None
+dashboard = None
+log_file = None
+
+
+class DisplayChannel:
+    """
+    Non-blocking stand-in for the display socket on the coordinator side.
+
+    sendall() only appends the line to a bounded in-memory buffer; a background thread
+    sends the buffered lines to the socket in batches. When the buffer is full, new lines are
+    dropped (and their number reported once the display catches up) so that the caller never
+    waits for the display.
+    """
+    def __init__(self, sock, capacity=DISPLAY_BUFFER_LINES):
+        self.sock = sock
+        self.capacity = capacity
+        self.lines = deque()
+        self.dropped = 0
+        self.closed = False
+        self.ready = threading.Condition()
+        self.writer = threading.Thread(target=self._write_loop, name="Display writer", daemon=True)
+        self.writer.start()
+
+    def sendall(self, data):
+        with self.ready:
+            if len(self.lines) >= self.capacity:
+                self.dropped += 1
+                return
+            self.lines.append(data)
+            if len(self.lines) == 1:
+                self.ready.notify()
+
+    def _write_loop(self):
+        while True:
+            with self.ready:
+                while not self.lines and not self.closed:
+                    self.ready.wait()
+                if not self.lines:
+                    return
+                batch, self.lines = self.lines, deque()
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                batch.append(f"[DISPLAY] ⚠️ {dropped} log lines dropped (display too slow).\n".encode("utf-8"))
+            try:
+                self.sock.sendall(b"".join(batch))
+            except OSError as exc:
+                print(f"[DISPLAY] Error sending updates, display output stopped: {exc}")
+                return
+
+    def close(self, timeout=1.0):
+        """
+        Sends the buffered lines (waiting at most timeout seconds), then closes the socket.
+        """
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.writer.join(timeout)
+        self.sock.close()
+
+
+class Client:
+    """
+    Connection to the display server. Clients that send lines are publishers (the coordinator),
+    the others are subscribers and receive a copy of every published line.
+    """
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.incoming = b""         # Received bytes not yet terminated by a newline
+        self.outgoing = deque()     # Lines waiting to be sent to the subscriber
+        self.outgoing_bytes = 0
+        self.publisher = False
+
+
+class Dashboard:
+    """
+    Aggregates the published lines instead of printing them, and redraws a summary of the
+    intersection DISPLAY_FRAME_RATE times per second: light state, vehicles waiting and passed
+    per direction, throughput and last priority event. Each line only updates a few counters,
+    so the cost of a frame does not depend on the event rate.
+    """
+    DIRECTIONS = ("N", "S", "E", "W")
+
+    def __init__(self, keys=None, stream=None, depths=None):
+        self.keys = keys or {}
+        self.depths = depths
+        self.queues = {}
+        self.stream = stream or sys.stdout
+        self.state = "unknown"
+        self.passed = Counter()
+        self.total = 0
+        self.priority_passed = 0
+        self.last_priority = None
+        self.lines = 0
+        self.started = time.monotonic()
+        self.history = deque([(self.started, 0)], maxlen=2 * DISPLAY_FRAME_RATE)
+
+    def update(self, lines):
+        """
+        Counts the passing vehicles and records the light changes and priority events.
+        """
+        for line in lines:
+            self.lines += 1
+            if line.endswith(b"PASSES."):
+                start = line.find(b" from ") + 6
+                self.passed[line[start:start + 1].decode("ascii", "replace")] += 1
+                self.total += 1
+                if b"Priority=True" in line:
+                    self.priority_passed += 1
+                    self.last_priority = (time.monotonic(), line[line.find(b"Vehicle"):].decode("utf-8", "replace"))
+            elif b"LightState(" in line:
+                self.state = line[line.find(b"LightState("):].decode("utf-8", "replace")
+
+    def queue_depths(self):
+        """
+        Returns the number of messages waiting in each queue, attaching to the queues once they exist
+        (or the result of the depths function given to the dashboard).
+        """
+        if self.depths is not None:
+            return self.depths()
+        depths = {}
+        for direction, key in self.keys.items():
+            if direction not in self.queues:
+                try:
+                    self.queues[direction] = sysv_ipc.MessageQueue(key)
+                except sysv_ipc.ExistentialError:
+                    continue
+            try:
+                depths[direction] = self.queues[direction].current_messages
+            except sysv_ipc.ExistentialError:
+                del self.queues[direction]
+        return depths
+
+    def render(self):
+        """
+        Redraws the dashboard.
+        """
+        now = time.monotonic()
+        self.history.append((now, self.total))
+        then, total_then = self.history[0]
+        rate = (self.total - total_then) / (now - then) if now > then else 0.0
+        depths = self.queue_depths()
+
+        rows = [
+            f"[DISPLAY] Dashboard - {now - self.started:.0f}s, {self.lines} log lines",
+            "",
+            f"  Lights:     {self.state}",
+            f"  Throughput: {rate:.1f} vehicles/s ({self.total} passed, {self.priority_passed} priority)",
+            "",
+            "  Road   Waiting   Passed",
+        ]
+        for direction in self.DIRECTIONS:
+            waiting = depths.get(direction, "-")
+            rows.append(f"  {direction:4} {waiting:>9} {self.passed[direction]:>8}")
+        rows.append("")
+        if self.last_priority is None:
+            rows.append("  Last priority: none")
+        else:
+            at, text = self.last_priority
+            rows.append(f"  Last priority: {text} ({now - at:.1f}s ago)")
+        # Clear the screen and draw from the top-left corner
+        self.stream.write("\x1b[H\x1b[2J" + "\n".join(rows) + "\n")
+        self.stream.flush()
+
 
 # Utility function
 def handle_shutdown(signum, frame):
     """Handles process termination signals to clean up sockets."""
-    global server_socket, conn
-
-    if conn:
-        conn.close()
-        print("[DISPLAY] Connection closed.")
+    if selector:
+        for key in list(selector.get_map().values()):
+            if isinstance(key.data, Client):
+                key.data.conn.close()
+        print("[DISPLAY] Connections closed.")
     if server_socket:
         server_socket.close()
         print("[DISPLAY] Server socket closed.")
+    if log_file:
+        log_file.close()
 
     sys.exit(0)  # Ensure process exits properly
 
+def split_lines(client, data):
+    """
+    Returns the complete lines of the data received from a client, keeping any partial line
+    for the next call (so that lines and multibyte characters split across reads stay whole).
+    """
+    *lines, client.incoming = (client.incoming + data).split(b"\n")
+    return lines
+
+def accept(sock):
+    conn, addr = sock.accept()
+    conn.setblocking(False)
+    selector.register(conn, selectors.EVENT_READ, Client(conn, addr))
+    print(f"[DISPLAY] Connection established with {addr}.")
+
+def disconnect(client):
+    selector.unregister(client.conn)
+    client.conn.close()
+    print(f"[DISPLAY] Connection with {client.addr} closed.")
+
+def publish(lines):
+    """
+    Prints the lines (or hands them to the dashboard), writes them to the log file if any,
+    and queues them for every subscriber. Lines that do not fit in a slow subscriber's buffer
+    are dropped for that subscriber only.
+    """
+    lines = [line for line in lines if line]
+    if not lines:
+        return
+    text = b"".join(line + b"\n" for line in lines)
+    if dashboard is not None:
+        dashboard.update(lines)
+    else:
+        sys.stdout.write(text.decode("utf-8", "replace"))
+        sys.stdout.flush()
+    if log_file is not None:
+        log_file.write(text)
+    for key in list(selector.get_map().values()):
+        subscriber = key.data
+        if not isinstance(subscriber, Client) or subscriber.publisher:
+            continue
+        if subscriber.outgoing_bytes + len(text) > DISPLAY_SUBSCRIBER_BUFFER:
+            continue
+        if not subscriber.outgoing:
+            selector.modify(subscriber.conn, selectors.EVENT_READ | selectors.EVENT_WRITE, subscriber)
+        subscriber.outgoing.append(text)
+        subscriber.outgoing_bytes += len(text)
+
+def read_client(client):
+    try:
+        data = client.conn.recv(65536)
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError:
+        data = b""
+    if not data:
+        disconnect(client)
+        return
+    client.publisher = True
+    publish(split_lines(client, data))
+
+def write_client(client):
+    while client.outgoing:
+        chunk = client.outgoing[0]
+        try:
+            sent = client.conn.send(chunk)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            disconnect(client)
+            return
+        client.outgoing_bytes -= sent
+        if sent < len(chunk):
+            client.outgoing[0] = chunk[sent:]
+            return
+        client.outgoing.popleft()
+    selector.modify(client.conn, selectors.EVENT_READ, client)
+
 # Server socket
-def main():
+def main(host=DISPLAY_HOST, port=DISPLAY_PORT, dashboard_mode=False, log_path=None, keys=None):
     """
     Entry point for the display process.
-    Sets up a TCP server on DISPLAY_HOST:DISPLAY_PORT and prints incoming messages.
+    Sets up a TCP server on host:port (DISPLAY_HOST:DISPLAY_PORT by default) and prints incoming messages.
+    Any number of clients can connect: the lines sent by publishers are printed and forwarded
+    to every subscriber (e.g. "nc localhost 5000" to follow the simulation from another terminal).
+    dashboard_mode replaces the printed lines with a Dashboard (reading the queues of the given keys),
+    and log_path, if given, receives every line.
     Ensures the socket is properly closed on shutdown.
     """
-    global server_socket, conn
+    global server_socket, selector, dashboard, log_file
 
     # Register signal handlers for graceful termination
     signal.signal(signal.SIGTERM, handle_shutdown)
+    profiling.install("display")
 
     # Create a TCP socket server.
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((DISPLAY_HOST, DISPLAY_PORT))
-    server_socket.listen(1)
-    print(f"[DISPLAY] Server listening on {DISPLAY_HOST}:{DISPLAY_PORT}. Waiting for connection...")
+    server_socket.bind((host, port))
+    server_socket.listen()
+    server_socket.setblocking(False)
+    print(f"[DISPLAY] Server listening on {host}:{port}. Waiting for connection...")
 
-    try:
-        # Wait for connection
-        conn, addr = server_socket.accept()
-        print(f"[DISPLAY] Connection established with {addr}.")
+    selector = selectors.DefaultSelector()
+    selector.register(server_socket, selectors.EVENT_READ)
 
-        # Handle connection
+    if log_path is not None:
+        log_file = open(log_path, "ab")
+    if dashboard_mode:
+        dashboard = Dashboard(keys)
+    frame_interval = 1.0 / DISPLAY_FRAME_RATE
+    next_frame = time.monotonic()
+    startup.ready("display")
+
+    try:
         while True:
-            data = conn.recv(1024)
-            if not data:
-                break  # Connection closed by client
-            messages = data.decode('utf-8').strip().split("\n")
-            for msg in messages:
-                if msg:
-                    print(msg)
+            timeout = None
+            if dashboard is not None:
+                now = time.monotonic()
+                if now >= next_frame:
+                    dashboard.render()
+                    next_frame = max(next_frame + frame_interval, now)
+                timeout = next_frame - now
+            for key, mask in selector.select(timeout):
+                if key.data is None:
+                    accept(key.fileobj)
+                    continue
+                if mask & selectors.EVENT_READ:
+                    read_client(key.data)
+                if mask & selectors.EVENT_WRITE and key.fileobj.fileno() != -1:
+                    write_client(key.data)
 
     except Exception as e:
         print(f"[DISPLAY] Error: {e}")
@@ -0,0 +1,378 @@
+import os
+import sys
+import time
+import heapq
+import atexit
+import signal
+import socket
+import struct
+import argparse
+import threading
+import multiprocessing
+import multiprocessing.util
+from collections import Counter
+import sim_clock
+from state_store import encode_light_state, decode_light_state
+from common import VehicleMessage, DISPLAY_HOST, DISPLAY_PORT, EVENT_LOG_BUFFER_SIZE, EVENT_LOG_FLUSH_INTERVAL
+
+
+# Event kinds
+GENERATED = 1           # Vehicle sent to its road's queue (generators)
+LIGHT_CHANGED = 2       # New light state published (lights)
+PASSED = 3              # Vehicle let through (coordinator)
+PRIORITY_REQUESTED = 4  # Priority vehicle announced to the lights (priority generator)
+PRIORITY_RESTORED = 5   # Lights back to the normal cycle after a priority vehicle (lights)
+
+KIND_NAMES = {
+    GENERATED: "generated", LIGHT_CHANGED: "light_changed", PASSED: "passed",
+    PRIORITY_REQUESTED: "priority_requested", PRIORITY_RESTORED: "priority_restored",
+}
+
+# File header: magic, clock speed-up and flush interval of the run (to bound how far records
+# written by different processes can be out of order).
+MAGIC = b"TRAFEVT1"
+HEADER = struct.Struct("<8sdd")
+
+# Record: simulated time (ns), kind, flags (priority flag, or light state mask), source, destination, vehicle id.
+RECORD = struct.Struct("<qBBcci")
+FLAG_PRIORITY = 0x1
+
+# Records read at once by the reader
+READ_CHUNK_RECORDS = 65536
+
+DIRECTIONS = ("N", "S", "E", "W")
+
+
+class EventLogWriter:
+    """
+    Append-only writer of fixed-size binary records.
+
+    The file is opened with O_APPEND before the processes are forked, and every process buffers
+    its own records, writing them in a single write() when the buffer is full, and every
+    flush_interval from a background thread (started by the first record of each process), so that
+    a process that records rarely does not hold its records back. Records of different processes
+    therefore never interleave within a record, but may be out of order by up to flush_interval
+    (real seconds).
+    """
+    def __init__(self, path, buffer_size=EVENT_LOG_BUFFER_SIZE, flush_interval=EVENT_LOG_FLUSH_INTERVAL):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+        os.write(self.fd, HEADER.pack(MAGIC, sim_clock.speedup(), flush_interval))
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.flushed_at = time.monotonic()
+        self.lock = threading.RLock()   # Reentrant: the SIGTERM handler may flush in the middle of a write
+        self.flusher_pid = None         # Process whose flusher thread is running
+        os.register_at_fork(after_in_child=self._after_fork)
+        multiprocessing.util.register_after_fork(self, EventLogWriter._flush_at_exit)
+        atexit.register(self.flush)
+
+    def _after_fork(self):
+        """
+        Starts the child with an empty buffer, and flushes it when the child is terminated.
+        """
+        if _writer is not self:
+            return  # Closed before the fork
+        self.buffer = bytearray()
+        self.flushed_at = time.monotonic()
+        self.lock = threading.RLock()
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, _flush_and_terminate)
+
+    def _flush_at_exit(self):
+        """
+        Flushes the buffer when a multiprocessing child exits, however it exits (its main function returns,
+        raises, or a signal handler installed later calls sys.exit): such children skip the atexit hooks.
+        """
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=0)
+
+    def write(self, kind, flags=0, source=b"-", dest=b"-", vehicle_id=0):
+        if self.flusher_pid != os.getpid():
+            self.flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, name="Event Log Flusher", daemon=True).start()
+        with self.lock:
+            self.buffer += RECORD.pack(int(sim_clock.now() * 1e9), kind, flags, source, dest, vehicle_id)
+            if len(self.buffer) >= self.buffer_size:
+                self.flush()
+
+    def flush(self, now=None):
+        with self.lock:
+            if self.buffer and self.fd is not None:
+                os.write(self.fd, self.buffer)
+                self.buffer = bytearray()
+            self.flushed_at = now or time.monotonic()
+
+    def _flush_periodically(self):
+        """
+        Flusher thread: writes the buffered records every flush_interval, until the log is closed.
+        """
+        while self.fd is not None:
+            time.sleep(max(0.0, self.flushed_at + self.flush_interval - time.monotonic()))
+            if time.monotonic() - self.flushed_at >= self.flush_interval:
+                self.flush()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            os.close(self.fd)
+            self.fd = None
+
+
+# Writer used by every component. Must be configured before the processes are started;
+# recording is a no-op while it is None.
+_writer = None
+
+def configure(path):
+    """
+    Creates the event log and enables recording in this process and its children.
+    """
+    global _writer
+    _writer = EventLogWriter(path)
+    return _writer
+
+def shutdown():
+    """
+    Flushes and closes the event log, if it was configured.
+    """
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+def _flush_and_terminate(signum, frame):
+    """
+    SIGTERM handler of the recording processes: flushes the buffered records, then terminates as before.
+    """
+    if _writer is not None:
+        _writer.flush()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+def record_vehicle(kind, vehicle):
+    """
+    Records a vehicle event (GENERATED, PASSED or PRIORITY_REQUESTED).
+    """
+    if _writer is not None:
+        _writer.write(kind, FLAG_PRIORITY if vehicle.priority else 0,
+                      vehicle.source_road.encode("ascii"), vehicle.dest_road.encode("ascii"), vehicle.vehicle_id)
+
+def record_lights(kind, state):
+    """
+    Records a light event (LIGHT_CHANGED or PRIORITY_RESTORED) with the new state.
+    """
+    if _writer is not None:
+        _writer.write(kind, encode_light_state(state))
+
+
+# Reader
+def read_header(f):
+    """
+    Reads the header of an event log. Returns (speedup, flush_interval).
+    """
+    magic, speedup, flush_interval = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("not an event log")
+    return speedup, flush_interval
+
+def iter_events(path):
+    """
+    Yields (time, kind, flags, source, dest, vehicle_id) for every record, in file order,
+    reading the file in chunks. A truncated last record is ignored.
+    """
+    with open(path, "rb") as f:
+        read_header(f)
+        buffer = bytearray(RECORD.size * READ_CHUNK_RECORDS)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                return
+            n -= n % RECORD.size
+            for t, kind, flags, source, dest, vehicle_id in RECORD.iter_unpack(memoryview(buffer)[:n]):
+                yield t / 1e9, kind, flags, source.decode("ascii"), dest.decode("ascii"), vehicle_id
+            if n < RECORD.size * READ_CHUNK_RECORDS:
+                return
+
+def iter_ordered_events(path):
+    """
+    Yields the events of iter_events in time order. Only the events of the reordering window
+    (the largest delay between processes, from the header) are held in memory.
+    """
+    with open(path, "rb") as f:
+        speedup, flush_interval = read_header(f)
+    window = 2 * flush_interval * speedup
+    heap, sequence = [], 0
+    for event in iter_events(path):
+        sequence += 1
+        heapq.heappush(heap, (event[0], sequence, event))
+        while heap[0][0] < event[0] - window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+class LatencyHistogram:
+    """
+    Log2 histogram of durations (1 µs resolution), for percentiles in constant memory.
+    """
+    def __init__(self, buckets=40):
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[min(int(max(seconds, 0) * 1e6).bit_length(), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """
+        Returns the upper bound (in seconds) of the bucket holding the q-th quantile.
+        """
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= q * self.count:
+                return min((2 ** i) / 1e6, self.max)
+        return self.max
+
+    def describe(self):
+        if not self.count:
+            return "none"
+        return (f"{self.count} samples, mean={self.total / self.count:.3f}s, p50<={self.percentile(0.5):.3f}s, "
+                f"p99<={self.percentile(0.99):.3f}s, max={self.max:.3f}s")
+
+
+def compute_stats(path):
+    """
+    Computes statistics over an event log in a single pass. Memory is bounded by the vehicles
+    in flight (generated but not passed yet), not by the size of the log.
+    """
+    kinds = Counter()
+    generated, passed = Counter(), Counter()
+    in_flight = {}  # vehicle_id -> generation or pass time, whichever was read first
+    latency, priority_latency, override = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    priority_since = None
+    first = last = None
+
+    for t, kind, flags, source, dest, vehicle_id in iter_events(path):
+        kinds[kind] += 1
+        first = t if first is None else min(first, t)
+        last = t if last is None else max(last, t)
+        if kind == GENERATED or kind == PASSED:
+            (generated if kind == GENERATED else passed)[source] += 1
+            other = in_flight.pop(vehicle_id, None)
+            if other is None:
+                in_flight[vehicle_id] = t
+            else:
+                (priority_latency if flags & FLAG_PRIORITY else latency).add(abs(t - other))
+        elif kind == LIGHT_CHANGED:
+            state = decode_light_state(flags)
+            if state is not None and state.is_priority_vehicle_light():
+                priority_since = t
+        elif kind == PRIORITY_RESTORED and priority_since is not None:
+            override.add(t - priority_since)
+            priority_since = None
+
+    return {
+        "events": sum(kinds.values()), "first": first, "last": last, "kinds": kinds,
+        "generated": generated, "passed": passed, "latency": latency,
+        "priority_latency": priority_latency, "override": override,
+    }
+
+def print_stats(path):
+    stats = compute_stats(path)
+    span = (stats["last"] - stats["first"]) if stats["events"] else 0.0
+    print(f"[EVENT_LOG] {path}: {stats['events']} events over {span:.1f}s of simulated time")
+    for kind, name in KIND_NAMES.items():
+        print(f"  {name:20} {stats['kinds'][kind]:>12}")
+    print(f"  {'road':20} {'generated':>12} {'passed':>12}")
+    for direction in DIRECTIONS:
+        print(f"  {direction:20} {stats['generated'][direction]:>12} {stats['passed'][direction]:>12}")
+    print(f"  latency:             {stats['latency'].describe()}")
+    print(f"  priority latency:    {stats['priority_latency'].describe()}")
+    print(f"  priority override:   {stats['override'].describe()}")
+
+
+def replay(path, host=DISPLAY_HOST, port=DISPLAY_PORT, speed=1.0, dashboard=False):
+    """
+    Replays the light changes and passing vehicles of an event log into a display process,
+    speed times faster than they were simulated (as fast as possible if speed is 0).
+    """
+    # Imported here: the coordinator records into this module.
+    from io import BytesIO
+    from display import main as display_main
+    from simulation import LogSink
+    from coordinator import send_update, announce_light_change
+
+    display_process = multiprocessing.Process(target=display_main, args=(host, port, dashboard), name="Display Process")
+    display_process.start()
+    display_socket = _connect(host, port)
+    if display_socket is None:
+        print(f"[EVENT_LOG] Could not connect to the display on {host}:{port}.")
+        display_process.terminate()
+        return
+
+    sink = LogSink(BytesIO())
+    start_real, start_time = time.monotonic(), None
+    try:
+        for t, kind, flags, source, dest, vehicle_id in iter_ordered_events(path):
+            if start_time is None:
+                start_time = t
+            if speed > 0:
+                delay = (t - start_time) / speed - (time.monotonic() - start_real)
+                if delay > 0.001:
+                    display_socket.sendall(sink.stream.getvalue())
+                    sink.stream = BytesIO()
+                    time.sleep(delay)
+            if kind == LIGHT_CHANGED:
+                announce_light_change(sink, decode_light_state(flags))
+            elif kind == PASSED:
+                vehicle = VehicleMessage(vehicle_id, source, dest, bool(flags & FLAG_PRIORITY))
+                send_update(sink, f"[COORDINATOR] {'🚨' if vehicle.priority else '✅'} {vehicle} PASSES.")
+        display_socket.sendall(sink.stream.getvalue())
+        time.sleep(0.5)  # Let the display draw the last updates
+    finally:
+        display_socket.close()
+        display_process.terminate()
+        display_process.join()
+
+def _connect(host, port, timeout=5.0):
+    """
+    Connects to host:port, retrying until the server listens or the timeout expires (then returns None).
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return socket.create_connection((host, port))
+        except OSError:
+            time.sleep(0.05)
+    return None
+
+
+def main(argv=None):
+    """
+    Entry point of the event log reader.
+    """
+    parser = argparse.ArgumentParser(description="Statistics and replay of a simulation event log.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats_parser = commands.add_parser("stats", help="print statistics of an event log")
+    stats_parser.add_argument("path", help="event log written by main.py --event-log")
+    replay_parser = commands.add_parser("replay", help="replay an event log into the display")
+    replay_parser.add_argument("path", help="event log written by main.py --event-log")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="replay this many times faster than simulated (0: as fast as possible)")
+    replay_parser.add_argument("--dashboard", action="store_true", help="use the display's dashboard mode")
+    replay_parser.add_argument("--port", type=int, default=DISPLAY_PORT, help="port of the display server")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        print_stats(args.path)
+    else:
+        replay(args.path, port=args.port, speed=args.speed, dashboard=args.dashboard)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import os
+import random
+import multiprocessing
+import sim_clock
+import profiling
+from collections import Counter
+from common import (
+    NS_GREEN, VehicleMessage, NORMAL_GEN_INTERVAL, LIGHT_CHANGE_INTERVAL,
+    COORDINATOR_TICK_BUDGET, GRID_POLL_INTERVAL, GRID_REPORT_INTERVAL
+)
+from ipc_utils import queue_keys, init_message_queues, send_vehicles_nowait
+from lights import toggle_lights
+from coordinator import drain_active_directions, process_drained_vehicles
+from simulation import LogSink
+
+
+# Road leading out of an intersection in each direction, and the side it enters the next one from.
+OPPOSITE = {"N": "S", "S": "N", "E": "W", "W": "E"}
+STEP = {"N": (-1, 0), "S": (1, 0), "E": (0, 1), "W": (0, -1)}
+
+
+def neighbour(rows, cols, row, col, direction):
+    """
+    Returns the index of the intersection reached by leaving (row, col) towards direction,
+    or None if the road leaves the grid.
+    """
+    d_row, d_col = STEP[direction]
+    row, col = row + d_row, col + d_col
+    if 0 <= row < rows and 0 <= col < cols:
+        return row * cols + col
+    return None
+
+def shard(count, workers):
+    """
+    Splits intersections 0..count-1 into contiguous blocks, one per worker,
+    so that most neighbours are handled by the same worker.
+    """
+    workers = max(1, min(workers, count))
+    size, extra = divmod(count, workers)
+    blocks, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        blocks.append(list(range(start, end)))
+        start = end
+    return blocks
+
+
+class Intersection:
+    """
+    Lights and coordinator state of one intersection of the grid.
+    """
+    def __init__(self, index, rows, cols, queues):
+        self.index = index
+        self.row, self.col = divmod(index, cols)
+        self.queues = queues
+        self.state = NS_GREEN
+        self.changed_at = sim_clock.now()
+        self.exits = {d: neighbour(rows, cols, self.row, self.col, d) for d in OPPOSITE}
+        self.entries = [d for d, target in self.exits.items() if target is None]
+
+
+def run_worker(worker_index, workers, indices, rows, cols):
+    """
+    Runs the lights and coordinator of the given intersections in a single process.
+    Vehicles enter the grid on its boundary roads, and each vehicle passing an intersection
+    is forwarded to the inbound queue of the neighbour it drives to (or leaves the grid).
+    Sends never block: two workers forwarding to each other's full queues would wait for each other
+    forever. Vehicles that do not fit wait in the worker's outbox, retried every tick, and no new
+    vehicle enters the grid on a road that is backed up.
+    """
+    profiling.install(f"grid_worker{worker_index}")
+    rng = random.Random()
+    sink = LogSink()
+    all_queues = {}
+
+    def queues_of(index):
+        if index not in all_queues:
+            all_queues[index] = init_message_queues(queue_keys(index))
+        return all_queues[index]
+
+    intersections = [Intersection(i, rows, cols, queues_of(i)) for i in indices]
+    boundary = [inter for inter in intersections if inter.entries]
+
+    next_vehicle = 0
+    outbox = {}     # (intersection, inbound road) -> vehicles waiting for room in its queue, in order
+    stats = Counter()
+    next_generation = next_report = sim_clock.now()
+
+    while True:
+        now = sim_clock.now()
+        busy = False
+
+        # Vehicles entering the grid on the boundary roads of this worker's intersections.
+        if now >= next_generation:
+            next_generation += NORMAL_GEN_INTERVAL
+            for inter in boundary:
+                source = rng.choice(inter.entries)
+                if (inter.index, source) in outbox:
+                    continue
+                next_vehicle += 1
+                dest = rng.choice([d for d in OPPOSITE if d != source])
+                vehicle_id = next_vehicle * workers + worker_index
+                outbox[(inter.index, source)] = [VehicleMessage(vehicle_id, source, dest)]
+                stats["generated"] += 1
+
+        for inter in intersections:
+            # Lights: fixed-interval toggling.
+            if now - inter.changed_at >= LIGHT_CHANGE_INTERVAL:
+                inter.state = toggle_lights(inter.state)
+                inter.changed_at = now
+
+            # Coordinator: let the waiting vehicles through and forward them.
+            active_directions = inter.state.get_active_directions()
+            vehicles_by_direction, _ = drain_active_directions(inter.queues, active_directions, COORDINATOR_TICK_BUDGET)
+            if not vehicles_by_direction:
+                continue
+            busy = True
+            process_drained_vehicles(vehicles_by_direction, active_directions, sink)
+            for vehicles in vehicles_by_direction.values():
+                for vehicle in vehicles:
+                    stats["passed"] += 1
+                    target = inter.exits[vehicle.dest_road]
+                    if target is None:
+                        stats["exited"] += 1
+                        continue
+                    source = OPPOSITE[vehicle.dest_road]
+                    dest = rng.choice([d for d in OPPOSITE if d != source])
+                    forwarded = VehicleMessage(vehicle.vehicle_id, source, dest, created_at=vehicle.created_at)
+                    outbox.setdefault((target, source), []).append(forwarded)
+
+        for (target, source), vehicles in list(outbox.items()):
+            sent = send_vehicles_nowait(queues_of(target)[source], vehicles)
+            if sent == len(vehicles):
+                del outbox[(target, source)]
+            else:
+                outbox[(target, source)] = vehicles[sent:]
+
+        if now >= next_report:
+            next_report += GRID_REPORT_INTERVAL
+            print(f"[GRID] Worker {worker_index} ({len(intersections)} intersections): "
+                  f"{stats['generated']} generated, {stats['passed']} passed, {stats['exited']} left the grid, "
+                  f"{sum(map(len, outbox.values()))} waiting for a full queue.")
+
+        if not busy:
+            sim_clock.sleep(GRID_POLL_INTERVAL)
+
+
+def start_grid(rows, cols, workers=None):
+    """
+    Creates the queues of a rows x cols grid and starts the worker processes.
+    Returns the list of processes and a dictionary of all the queues (for cleanup).
+    """
+    count = rows * cols
+    workers = workers or os.cpu_count() or 1
+
+    queues = {}
+    for index in range(count):
+        for direction, queue in init_message_queues(queue_keys(index)).items():
+            queues[(index, direction)] = queue
+
+    blocks = shard(count, workers)
+    processes = []
+    for worker_index, indices in enumerate(blocks):
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(worker_index, len(blocks), indices, rows, cols),
+            name=f"Grid Worker {worker_index}"
+        )
+        process.start()
+        processes.append(process)
+    print(f"[GRID] {rows}x{cols} grid started on {len(blocks)} worker processes.")
+    return processes, queues
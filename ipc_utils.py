@@ -1,52 +1,606 @@
+import os
 import sys
+import select
 import pickle
+import time
+import struct
+import tempfile
 import sysv_ipc
+from collections import deque
+import metrics
+from shm_ring import RingQueue, slots_for
+from common import (
+    VehicleMessage, IPC_TRANSPORT, RING_SLOTS, RING_PRIORITY_SLOTS,
+    QUEUE_CAPACITY, QUEUE_OVERFLOW_POLICY, QUEUE_BLOCK_TIMEOUT, QUEUE_SPILL_DIR, QUEUE_OVERFLOW_REPORT_INTERVAL,
+    QUEUE_SPILL_DRAIN_INTERVAL, QUEUE_SPILL_COMPACT_SIZE
+)
 
 
 # Define unique keys for each road section's message queue.
-QUEUE_KEYS = {
-    'N': 0x2000,
-    'S': 0x2001,
-    'E': 0x2002,
-    'W': 0x2003
-}
+# Each user of the queues has its own range of keys, so that they can run side by side: the simulation and
+# grid intersections, the benchmarks and the sweep runs. A range holds MAX_INTERSECTIONS intersections.
+QUEUE_BASE_KEY = 0x2000
+BENCH_BASE_KEY = 0x6000
+SWEEP_BASE_KEY = 0xA000
+MAX_INTERSECTIONS = 0x1000
+QUEUE_DIRECTIONS = ('N', 'S', 'E', 'W')
 
-def init_message_queues():
+def queue_keys(intersection=0, base=QUEUE_BASE_KEY):
+    """
+    Returns the queue keys of the given intersection (0 for the single-intersection setup):
+    four consecutive keys per intersection, starting at base (one of the key ranges above).
+    """
+    if not 0 <= intersection < MAX_INTERSECTIONS:
+        raise ValueError(f"intersection {intersection} is outside the key range (0 to {MAX_INTERSECTIONS - 1})")
+    base += 4 * intersection
+    return {direction: base + i for i, direction in enumerate(QUEUE_DIRECTIONS)}
+
+QUEUE_KEYS = queue_keys(0)
+
+# SysV message types, used to tell the payload encoding apart.
+MSG_TYPE_PICKLE = 1     # Arbitrary pickled object
+MSG_TYPE_BATCH = 3      # Normal VehicleMessages (one or more), concatenated in the binary format below
+MSG_TYPE_PRIORITY = 4   # Priority VehicleMessage in the binary format below, fetched ahead of the others
+
+# Commands of the lights control channel (see create_wakeup_channel).
+# A priority vehicle is waiting on a road: the command is the road's letter, so that requests never overwrite each other
+LIGHTS_PRIORITY_REQUESTS = {direction: direction.encode("ascii") for direction in QUEUE_DIRECTIONS}
+LIGHTS_PRIORITY_RELEASE = b"R"  # The priority vehicle has passed: back to the normal cycle (acknowledged by
+                                # incrementing shared_state["releases"])
+
+# Vehicles already received as part of a batch but not yet handed out, per queue key (per process).
+_pending = {}
+
+# Binary VehicleMessage: id, source road, destination road, priority flag, generation timestamp.
+VEHICLE_FORMAT = struct.Struct("<iccBd")
+
+# Largest message sysv_ipc sends or receives by default, and the number of vehicles that fit in it.
+MAX_MESSAGE_SIZE = 2048
+BATCH_MAX_VEHICLES = MAX_MESSAGE_SIZE // VEHICLE_FORMAT.size
+
+# Overflow policies of full queues (see configure_overflow), and the current one (per process,
+# inherited by the processes forked after configure_overflow).
+OVERFLOW_POLICIES = ("block", "drop-newest", "drop-oldest", "spill")
+_overflow_policy = QUEUE_OVERFLOW_POLICY
+_block_timeout = QUEUE_BLOCK_TIMEOUT
+_spill_dir = QUEUE_SPILL_DIR
+
+# Spill files of the queues that overflowed with their (queue, direction), and the vehicles delayed, dropped
+# or spilled since the last warning with the time of that warning, per queue key (per process).
+_spills = {}
+_spill_targets = {}
+_overflowing = {}
+
+# Backoff of a sender waiting for room in a full queue (in seconds)
+_MIN_BACKOFF = 0.0001
+_MAX_BACKOFF = 0.01
+
+
+class SpillFile:
+    """
+    On-disk FIFO of the messages that did not fit in a full queue, so that an overloaded queue
+    holds its backlog on disk instead of in memory. The file is unnamed (removed when closed),
+    truncated whenever it empties, and compacted once compact_size bytes at its start were read,
+    so that it never grows much beyond its backlog.
+    """
+    RECORD = struct.Struct("<HB")  # Message length and type
+
+    def __init__(self, directory=None, compact_size=QUEUE_SPILL_COMPACT_SIZE):
+        self.file = tempfile.TemporaryFile(prefix="traffic-spill-", dir=directory)
+        self.compact_size = compact_size
+        self.read_offset = 0
+        self.write_offset = 0
+        self.count = 0
+        self.head = None  # (message, type, record size) of the oldest message, once read
+
+    def __len__(self):
+        return self.count
+
+    def append(self, message, mtype):
+        self.file.seek(self.write_offset)
+        self.file.write(self.RECORD.pack(len(message), mtype) + message)
+        self.write_offset += self.RECORD.size + len(message)
+        self.count += 1
+
+    def peek(self):
+        """
+        Returns (message, type) of the oldest message.
+        """
+        if self.head is None:
+            self.file.seek(self.read_offset)
+            length, mtype = self.RECORD.unpack(self.file.read(self.RECORD.size))
+            self.head = (self.file.read(length), mtype, self.RECORD.size + length)
+        return self.head[:2]
+
+    def pop(self):
+        """
+        Discards the oldest message (after a peek).
+        """
+        self.read_offset += self.head[2]
+        self.head = None
+        self.count -= 1
+        if not self.count:
+            self.file.truncate(0)
+            self.read_offset = self.write_offset = 0
+        elif self.read_offset >= self.compact_size and self.read_offset >= self.write_offset - self.read_offset:
+            self._compact()
+
+    def _compact(self):
+        """
+        Moves the unread messages to the start of the file, chunk by chunk, and truncates it.
+        Only done once the read part is at least as large as the unread one, so each byte is moved
+        a bounded number of times.
+        """
+        source, target = self.read_offset, 0
+        while source < self.write_offset:
+            self.file.seek(source)
+            chunk = self.file.read(min(1 << 16, self.write_offset - source))
+            self.file.seek(target)
+            self.file.write(chunk)
+            source += len(chunk)
+            target += len(chunk)
+        self.file.truncate(target)
+        self.read_offset, self.write_offset = 0, target
+
+def encode_vehicle(vehicle):
+    """
+    Packs a VehicleMessage into VEHICLE_FORMAT.
+    """
+    return VEHICLE_FORMAT.pack(
+        vehicle.vehicle_id,
+        vehicle.source_road.encode("ascii"),
+        vehicle.dest_road.encode("ascii"),
+        1 if vehicle.priority else 0,
+        vehicle.created_at
+    )
+
+def decode_vehicle(data):
+    """
+    Unpacks a VehicleMessage packed by encode_vehicle.
+    """
+    vehicle_id, source, dest, priority, created_at = VEHICLE_FORMAT.unpack(data)
+    return VehicleMessage(vehicle_id, source.decode("ascii"), dest.decode("ascii"), bool(priority), created_at)
+
+def decode_message(message, mtype):
+    """
+    Decodes a raw queue message into the list of objects it carries.
+    """
+    if mtype == MSG_TYPE_PRIORITY:
+        return [decode_vehicle(message)]
+    if mtype == MSG_TYPE_BATCH:
+        return [decode_vehicle(record) for record in _iter_records(message)]
+    return [pickle.loads(message)]
+
+def _iter_records(message):
+    """
+    Splits a batch message into its fixed-size vehicle records.
+    """
+    size = VEHICLE_FORMAT.size
+    view = memoryview(message)
+    for offset in range(0, len(message), size):
+        yield view[offset:offset + size]
+
+def init_message_queues(keys=None, transport=None, capacity=None):
     """
     Initialize message queues for each road section using SysV IPC.
     Returns a dictionary mapping each direction ('N', 'S', 'E', 'W') to its MessageQueue.
+    keys defaults to QUEUE_KEYS; pass queue_keys(i) for another intersection.
+    transport defaults to IPC_TRANSPORT; "ring" creates shared memory RingQueues instead, which
+    must be created before forking and only support one producer per lane (see shm_ring.py).
+    capacity (default QUEUE_CAPACITY) is the number of vehicles each queue holds, or a dict of
+    capacities per direction (QUEUE_CAPACITY for the missing ones); 0 keeps the transport's default.
     """
+    keys = QUEUE_KEYS if keys is None else keys
+    capacity = QUEUE_CAPACITY if capacity is None else capacity
+    capacities = capacity if isinstance(capacity, dict) else dict.fromkeys(keys, capacity)
     queues = {}
-    for direction, key in QUEUE_KEYS.items():
+    for direction, key in keys.items():
+        vehicles = capacities.get(direction, QUEUE_CAPACITY)
+        if (transport or IPC_TRANSPORT) == "ring":
+            # A single vehicle takes one slot; the ring must still fit a full batch
+            slots = max(vehicles, slots_for(MAX_MESSAGE_SIZE)) if vehicles else RING_SLOTS
+            queues[direction] = RingQueue(key, MSG_TYPE_PRIORITY, slots, RING_PRIORITY_SLOTS)
+            continue
         try:
             queues[direction] = sysv_ipc.MessageQueue(key, sysv_ipc.IPC_CREAT)
         except sysv_ipc.Error as e:
             print(f"[IPC_UTILS] Error creating message queue for {direction}: {e}")
             sys.exit(1)
+        if vehicles:
+            set_queue_capacity(queues[direction], vehicles)
     return queues
 
+def set_queue_capacity(queue, vehicles):
+    """
+    Limits a SysV queue to the given number of vehicles, through its byte limit (the kernel only
+    counts the message contents), so at least a full batch (BATCH_MAX_VEHICLES). Raising it above the
+    system default (msgmnb) requires privileges: the queue then keeps its current limit.
+    """
+    try:
+        queue.max_size = max(vehicles * VEHICLE_FORMAT.size, MAX_MESSAGE_SIZE)
+    except sysv_ipc.Error as e:
+        print(f"[IPC_UTILS] ⚠️ Cannot set the capacity of queue {queue.key} to {vehicles} vehicles ({e}), "
+              f"keeping {queue.max_size // VEHICLE_FORMAT.size}.")
+
+def configure_overflow(policy=QUEUE_OVERFLOW_POLICY, block_timeout=QUEUE_BLOCK_TIMEOUT, spill_dir=QUEUE_SPILL_DIR):
+    """
+    Selects what happens to normal vehicles sent to a full queue, in this process and the processes
+    forked afterwards: "block" waits up to block_timeout seconds (forever if None) then drops them,
+    "drop-newest" drops them, "drop-oldest" drops the oldest normal vehicles of the queue instead
+    (SysV queues only, ring queues drop the newest), and "spill" appends them to a file in spill_dir
+    and sends them back in order as the queue drains, on the following sends and on drain_spills().
+    Dropped, spilled and restored vehicles, and the sends that had to wait, are counted in metrics.
+    """
+    global _overflow_policy, _block_timeout, _spill_dir
+    if policy not in OVERFLOW_POLICIES:
+        raise ValueError(f"unknown overflow policy: {policy}")
+    _overflow_policy, _block_timeout, _spill_dir = policy, block_timeout, spill_dir
+
 def send_obj_message(queue, obj):
     """
     Serialize and send an object through the provided SysV IPC MessageQueue.
+    VehicleMessages use the compact binary format (with their own message type if they are priority
+    vehicles), any other object is pickled.
     """
     try:
-        data = pickle.dumps(obj)
-        queue.send(data, type=1)
+        if isinstance(obj, VehicleMessage) and not obj.priority:
+            # A batch of one: all normal vehicles share a message type, so that the queue keeps them in order
+            _send_vehicles(queue, encode_vehicle(obj), MSG_TYPE_BATCH, obj.source_road)
+        elif isinstance(obj, VehicleMessage):
+            queue.send(encode_vehicle(obj), type=MSG_TYPE_PRIORITY)
+        else:
+            queue.send(pickle.dumps(obj), type=MSG_TYPE_PICKLE)
     except Exception as e:
         print(f"[IPC_UTILS] Error sending object: {e}")
 
+def _send_vehicles(queue, message, mtype, direction):
+    """
+    Sends a message of normal vehicles, applying the overflow policy if the queue is full.
+    """
+    spill = _spills.get(queue.key)
+    if spill and not _drain_spill(queue, spill, direction):
+        # Older vehicles are still waiting on disk: keep the order
+        spill.append(message, mtype)
+        count = _vehicle_count(message, mtype)
+        metrics.inc(f"overflow_spilled.{direction}", count)
+        _report_overflow(queue, direction, count)
+        return
+    try:
+        queue.send(message, block=False, type=mtype)
+    except sysv_ipc.BusyError:
+        _report_overflow(queue, direction, _overflow(queue, message, mtype, direction))
+
+def _overflow(queue, message, mtype, direction):
+    """
+    Applies the overflow policy to a message that does not fit in the queue.
+    Returns the number of vehicles delayed, dropped or spilled.
+    """
+    count = _vehicle_count(message, mtype)
+    if _overflow_policy == "spill":
+        spill = _spills.get(queue.key)
+        if spill is None:
+            spill = _spills[queue.key] = SpillFile(_spill_dir)
+            _spill_targets[queue.key] = (queue, direction)
+        spill.append(message, mtype)
+        metrics.inc(f"overflow_spilled.{direction}", count)
+    elif _overflow_policy == "block":
+        metrics.inc(f"overflow_blocked.{direction}")
+        if _block_timeout is None:
+            queue.send(message, type=mtype)
+        elif not _send_before(queue, message, mtype, time.monotonic() + _block_timeout):
+            metrics.inc(f"overflow_dropped.{direction}", count)
+    elif _overflow_policy == "drop-oldest":
+        while True:
+            dropped = _drop_oldest(queue)
+            if not dropped:
+                metrics.inc(f"overflow_dropped.{direction}", count)
+                break
+            metrics.inc(f"overflow_dropped.{direction}", dropped)
+            try:
+                queue.send(message, block=False, type=mtype)
+                break
+            except sysv_ipc.BusyError:
+                continue
+    else:
+        metrics.inc(f"overflow_dropped.{direction}", count)
+    return count
+
+def _report_overflow(queue, direction, count):
+    """
+    Warns when a queue overflows, then at most every QUEUE_OVERFLOW_REPORT_INTERVAL seconds
+    with the number of vehicles affected since the previous warning.
+    """
+    pending, last = _overflowing.get(queue.key, (0, None))
+    pending += count
+    now = time.monotonic()
+    action = {"block": "delayed or dropped", "spill": "spilled to disk"}.get(_overflow_policy, "dropped")
+    if last is None:
+        print(f"[IPC_UTILS] ⚠️ Queue {direction} ({queue.key}) is full: vehicles are {action}.")
+    elif now - last >= QUEUE_OVERFLOW_REPORT_INTERVAL:
+        print(f"[IPC_UTILS] ⚠️ Queue {direction} ({queue.key}) overflowing: {pending} vehicles {action} "
+              f"in the last {now - last:.0f}s.")
+    else:
+        _overflowing[queue.key] = (pending, last)
+        return
+    _overflowing[queue.key] = (0, now)
+
+def _send_before(queue, message, mtype, deadline):
+    """
+    Retries sending a message to a full queue until the deadline. Returns True if it was sent.
+    """
+    backoff = _MIN_BACKOFF
+    while True:
+        try:
+            queue.send(message, block=False, type=mtype)
+            return True
+        except sysv_ipc.BusyError:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(backoff, remaining))
+        backoff = min(backoff * 2, _MAX_BACKOFF)
+
+def _drop_oldest(queue):
+    """
+    Removes the oldest message of normal vehicles from a SysV queue (they are all sent as MSG_TYPE_BATCH,
+    which the queue keeps in order). Returns the number of vehicles removed, 0 if there is none or the
+    queue is a RingQueue (whose consumer side belongs to the coordinator alone).
+    """
+    if isinstance(queue, RingQueue):
+        return 0
+    try:
+        message, _ = queue.receive(type=MSG_TYPE_BATCH, block=False)
+        return _vehicle_count(message, MSG_TYPE_BATCH)
+    except sysv_ipc.BusyError:
+        return 0
+
+def _drain_spill(queue, spill, direction):
+    """
+    Moves spilled messages back into the queue, oldest first, while it has room.
+    Returns True once the spill file is empty.
+    """
+    while spill:
+        message, mtype = spill.peek()
+        try:
+            queue.send(message, block=False, type=mtype)
+        except sysv_ipc.BusyError:
+            return False
+        spill.pop()
+        metrics.inc(f"overflow_restored.{direction}", _vehicle_count(message, mtype))
+    return True
+
+def spilled_messages():
+    """
+    Returns the number of messages waiting in the spill files of this process.
+    """
+    return sum(len(spill) for spill in _spills.values())
+
+def drain_spills():
+    """
+    Moves the spilled messages of every queue back while there is room, without waiting for the next
+    send to that queue (called periodically by the generators). Returns the number of messages still spilled.
+    """
+    for key, spill in _spills.items():
+        if spill:
+            queue, direction = _spill_targets[key]
+            _drain_spill(queue, spill, direction)
+    return spilled_messages()
+
+def wait_for_spills(timeout, wakeup_fd=None, interval=QUEUE_SPILL_DRAIN_INTERVAL):
+    """
+    Keeps draining the spill files until they are empty or timeout seconds have passed, notifying
+    wakeup_fd whenever vehicles were sent back. Returns True if they are empty.
+    """
+    deadline = time.monotonic() + timeout
+    spilled = spilled_messages()
+    while spilled:
+        spilled, before = drain_spills(), spilled
+        if spilled < before:
+            notify(wakeup_fd)
+        remaining = deadline - time.monotonic()
+        if spilled and remaining <= 0:
+            return False
+        if spilled:
+            time.sleep(min(interval, remaining))
+    return True
+
+def discard_spills():
+    """
+    Drops the messages left in the spill files (e.g. when the process exits), counting their vehicles as
+    dropped. Returns the number of vehicles dropped.
+    """
+    dropped = 0
+    for key, spill in _spills.items():
+        _, direction = _spill_targets[key]
+        while spill:
+            message, mtype = spill.peek()
+            spill.pop()
+            count = _vehicle_count(message, mtype)
+            metrics.inc(f"overflow_dropped.{direction}", count)
+            dropped += count
+    return dropped
+
+def _vehicle_count(message, mtype):
+    return len(message) // VEHICLE_FORMAT.size if mtype == MSG_TYPE_BATCH else 1
+
+def queued_vehicles(queue):
+    """
+    Returns the number of vehicles waiting in a queue. A SysV queue only reports its message count, and a
+    batch holds up to BATCH_MAX_VEHICLES vehicles, so its byte count is read from /proc/sysvipc/msg
+    (Linux) and divided by the record size. Falls back to the message count elsewhere and for ring queues.
+    """
+    if isinstance(queue, sysv_ipc.MessageQueue):
+        try:
+            with open("/proc/sysvipc/msg") as f:
+                header = f.readline().split()
+                msqid, cbytes = header.index("msqid"), header.index("cbytes")
+                for line in f:
+                    fields = line.split()
+                    if int(fields[msqid]) == queue.id:
+                        return int(fields[cbytes]) // VEHICLE_FORMAT.size
+        except (OSError, ValueError):
+            pass
+    return queue.current_messages
+
 def receive_obj_message(queue, block=True):
     """
     Receives an object message from a given queue.
     Returns the deserialized object if the message is successfully received.
     If blocking is disabled and no message is available, returns None.
     """
+    pending = _pending.get(queue.key)
+    if pending:
+        return pending.popleft()
     try:
         message, mtype = queue.receive(type=0, block=block)
-        obj = pickle.loads(message)
-        return obj
+        objs = decode_message(message, mtype)
+        if len(objs) > 1:
+            _pending.setdefault(queue.key, deque()).extend(objs[1:])
+        return objs[0]
     except sysv_ipc.BusyError:
         return None
     except Exception as e:
         print(f"[IPC_UTILS] Error receiving message: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def receive_priority_vehicle(queue):
+    """
+    Receives the oldest priority vehicle of the queue without blocking, ahead of any other message.
+    Returns None if there is none.
+    """
+    pending = _pending.get(queue.key)
+    if pending:
+        for vehicle in pending:
+            if getattr(vehicle, "priority", False):
+                pending.remove(vehicle)
+                return vehicle
+    try:
+        message, _ = queue.receive(type=MSG_TYPE_PRIORITY, block=False)
+        return decode_vehicle(message)
+    except sysv_ipc.BusyError:
+        return None
+    except Exception as e:
+        print(f"[IPC_UTILS] Error receiving priority message: {e}")
+        return None
+
+def create_wakeup_channel():
+    """
+    Creates a non-blocking pipe used to wake up the coordinator.
+    Returns (read_fd, write_fd): producers write to write_fd through notify(),
+    the coordinator blocks on read_fd through wait_for_wakeup().
+    """
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+    return read_fd, write_fd
+
+def notify(write_fd, command=b"\0"):
+    """
+    Signals that a new vehicle or light state is available. No-op if write_fd is None.
+    command is the byte written, for channels that carry commands (e.g. LIGHTS_PRIORITY_RELEASE).
+    """
+    if write_fd is None:
+        return
+    try:
+        os.write(write_fd, command)
+    except BlockingIOError:
+        pass  # Pipe full: a wakeup is already pending
+
+def wait_for_wakeup(read_fd, timeout=None):
+    """
+    Blocks until notify() has been called or the timeout (in seconds) expires.
+    Drains pending notifications and returns True if woken up by one.
+    """
+    return bool(read_notifications(read_fd, timeout))
+
+def read_notifications(read_fd, timeout=None):
+    """
+    Blocks until notify() has been called or the timeout (in seconds) expires.
+    Returns the bytes written by the notify() calls since the last read (empty on timeout).
+    """
+    ready, _, _ = select.select([read_fd], [], [], timeout)
+    if not ready:
+        return b""
+    data = b""
+    try:
+        while True:
+            chunk = os.read(read_fd, 4096)
+            if not chunk:
+                break
+            data += chunk
+    except BlockingIOError:
+        pass
+    return data
+
+def send_obj_messages(queue, objs):
+    """
+    Sends several objects through the queue using as few messages as possible.
+    Consecutive non-priority VehicleMessages are packed BATCH_MAX_VEHICLES at a time into a single
+    batch message, other objects are sent one by one with send_obj_message.
+    """
+    batch = []
+    for obj in objs:
+        if isinstance(obj, VehicleMessage) and not obj.priority:
+            batch.append(obj)
+            if len(batch) == BATCH_MAX_VEHICLES:
+                _send_batch(queue, batch)
+                batch = []
+        else:
+            _send_batch(queue, batch)
+            batch = []
+            send_obj_message(queue, obj)
+    _send_batch(queue, batch)
+
+def _send_batch(queue, vehicles):
+    """
+    Sends a list of VehicleMessages as one message.
+    """
+    if not vehicles:
+        return
+    if len(vehicles) == 1:
+        send_obj_message(queue, vehicles[0])
+        return
+    try:
+        _send_vehicles(queue, b"".join(encode_vehicle(vehicle) for vehicle in vehicles), MSG_TYPE_BATCH,
+                       vehicles[0].source_road)
+    except Exception as e:
+        print(f"[IPC_UTILS] Error sending batch: {e}")
+
+def send_vehicles_nowait(queue, vehicles):
+    """
+    Sends normal VehicleMessages through a SysV queue without ever blocking, packed BATCH_MAX_VEHICLES
+    at a time, and without applying the overflow policy (the caller keeps what does not fit).
+    Returns the number of vehicles sent: the first ones of the list, up to the first batch that did not fit.
+    """
+    sent = 0
+    while sent < len(vehicles):
+        batch = vehicles[sent:sent + BATCH_MAX_VEHICLES]
+        try:
+            queue.send(b"".join(encode_vehicle(vehicle) for vehicle in batch), block=False, type=MSG_TYPE_BATCH)
+        except sysv_ipc.BusyError:
+            break
+        sent += len(batch)
+    return sent
+
+def receive_batch(queue, max_n, block=True):
+    """
+    Receives up to max_n objects from the queue, unpacking batch messages transparently.
+    If block is True, waits for at least one object; otherwise returns what is available
+    (possibly an empty list). Objects beyond max_n are kept for the next receive.
+    """
+    pending = _pending.setdefault(queue.key, deque())
+    objs = []
+    while len(objs) < max_n:
+        if pending:
+            objs.append(pending.popleft())
+            continue
+        try:
+            message, mtype = queue.receive(type=0, block=block and not objs)
+        except sysv_ipc.BusyError:
+            break
+        except Exception as e:
+            print(f"[IPC_UTILS] Error receiving message: {e}")
+            break
+        pending.extend(decode_message(message, mtype))
+    return objs
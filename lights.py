@@ -1,94 +1,231 @@
-import time
-import signal
-from common import LightState, LIGHT_CHANGE_INTERVAL
+from collections import deque
+import sim_clock
+import metrics
+import event_log
+import profiling
+import startup
+from common import NS_GREEN, PRIORITY_LIGHTS, LightState, LIGHT_CHANGE_INTERVAL, ADAPTIVE_MIN_GREEN, ADAPTIVE_MAX_GREEN
+from ipc_utils import notify, read_notifications, queued_vehicles, LIGHTS_PRIORITY_REQUESTS, LIGHTS_PRIORITY_RELEASE
 
 
-# Global flags
-priority_mode = False
-priority_requested = False
-just_restored = False
+# Changes reported by LightCycle.step
+TOGGLED = "toggled"     # Normal cycle: the other pair of roads turns green
+PRIORITY = "priority"   # Priority light for the road of a priority vehicle
+RESTORED = "restored"   # Back to the normal cycle (N/S green) after a priority vehicle
+
+# Road of each priority request, by command byte (as read from the control channel)
+PRIORITY_COMMANDS = {command[0]: direction for direction, command in LIGHTS_PRIORITY_REQUESTS.items()}
+
+# Light cycle of the lights process (see main)
+cycle = None
+
+# Last published state and when it was published, for the time-in-state metrics
+published_state = None
+published_at = 0.0
+
+
+class LightCycle:
+    """
+    Decisions of the traffic lights, shared by the lights process, the asyncio runner and the discrete-event
+    simulation, which only differ in how they wait and publish: the normal cycle from N/S green, toggled every
+    light_interval seconds ("fixed" controller) or by adaptive_should_toggle ("adaptive"), and the priority
+    overrides requested and released by the priority generator and the coordinator.
+    """
+    def __init__(self, controller="fixed", light_interval=LIGHT_CHANGE_INTERVAL, now=0.0):
+        self.controller = controller
+        self.light_interval = light_interval
+        self.state = NS_GREEN
+        self.phase_start = now
+        self.priority_start = now
+        self.priority_mode = False
+        self.pending = deque()  # Roads of the priority vehicles waiting for their light, in request order
+        self.release_requested = False
+
+    def request_priority(self, direction):
+        """
+        LIGHTS_PRIORITY_REQUESTS: the priority light of the road is set at the next step, or after the
+        priority lights requested before it.
+        """
+        self.pending.append(direction)
+
+    def release_priority(self):
+        """
+        LIGHTS_PRIORITY_RELEASE: the normal cycle resumes at the next step (ignored outside priority mode).
+        """
+        if self.priority_mode:
+            self.release_requested = True
+
+    def step(self, now, depths=None):
+        """
+        Applies the pending requests and the phase timing at simulated time now. depths (vehicles waiting
+        per road) is only read by the adaptive controller.
+        Returns the states to publish, in order, as (state, change) with change TOGGLED, PRIORITY or RESTORED.
+        """
+        changes = []
+        if self.release_requested:
+            self.release_requested = self.priority_mode = False
+            self.state = NS_GREEN
+            self.phase_start = now
+            changes.append((self.state, RESTORED))
+        if self.priority_mode:
+            return changes
+
+        if self.pending:
+            self.priority_mode = True
+            self.state = set_priority_light(self.pending.popleft())
+            self.priority_start = now
+            changes.append((self.state, PRIORITY))
+            return changes
+
+        # Normal mode: switch lights after the configured interval, or when demand says so
+        elapsed = now - self.phase_start
+        if self.controller == "adaptive":
+            toggle = adaptive_should_toggle(self.state, elapsed, depths, self.light_interval)
+        else:
+            toggle = elapsed >= self.light_interval
+        if toggle:
+            self.state = toggle_lights(self.state)
+            self.phase_start = now
+            changes.append((self.state, TOGGLED))
+        return changes
+
+    def next_step(self, now, step_time):
+        """
+        Returns how long (in simulated seconds) the lights may wait for a command before the next step:
+        until the end of the phase with the fixed controller, step_time with the adaptive one, or None
+        in priority mode, where only the release changes the lights.
+        """
+        if self.priority_mode:
+            return None
+        if self.controller == "adaptive":
+            return step_time
+        return max(self.phase_start + self.light_interval - now, 0.0)
+
 
 # Utility functions
-def handle_priority(signum, frame):
+def handle_priority(direction):
+    """
+    Triggered by LIGHTS_PRIORITY_REQUESTS: request to switch to priority mode for the road.
     """
-    Triggered by SIGUSR1: request to switch to priority mode.
+    cycle.request_priority(direction)
+
+def handle_restore():
+    """
+    Triggered by LIGHTS_PRIORITY_RELEASE: restore normal mode immediately.
     """
-    global priority_requested
-    priority_requested = True
+    cycle.release_priority()
 
-def handle_restore(signum, frame):
+def wait_for_commands(control_fd, timeout):
     """
-    Triggered by SIGUSR2: restore normal mode immediately.
+    Waits up to timeout seconds for commands on the control channel, returning as soon as one arrives,
+    and applies them. Without a control channel, simply sleeps.
     """
-    global priority_mode, just_restored
-    priority_mode = False
-    just_restored = True
+    if control_fd is None:
+        sim_clock.sleep(timeout)
+        return
+    for command in read_notifications(control_fd, sim_clock.real_interval(timeout)):
+        if command in PRIORITY_COMMANDS:
+            handle_priority(PRIORITY_COMMANDS[command])
+        elif command == LIGHTS_PRIORITY_RELEASE[0]:
+            handle_restore()
 
 def set_priority_light(direction):
     """
     Returns a LightState that is green only for the specified direction.
     """
-    state = {
-        "N": LightState(1, 0, 0, 0),
-        "S": LightState(0, 1, 0, 0),
-        "E": LightState(0, 0, 1, 0),
-        "W": LightState(0, 0, 0, 1)
-    }
-    return state.get(direction)
+    return PRIORITY_LIGHTS.get(direction)
 
 def toggle_lights(state):
     """
     Toggles between N/S and E/W green lights.
     """
-    return LightState(
-        north=1 - state.north,
-        south=1 - state.south,
-        east=1 - state.east,
-        west=1 - state.west
-    )
+    return LightState.from_mask(state.mask ^ 0xF)
+
+def queue_depths(queues):
+    """
+    Returns the number of vehicles waiting on each road. The metrics counters also count the vehicles
+    already taken from the queues by the coordinator; without them, only the queued vehicles are counted.
+    """
+    waiting = metrics.waiting_vehicles()
+    if waiting is not None:
+        return waiting
+    return {direction: queued_vehicles(queue) for direction, queue in queues.items()}
+
+def adaptive_should_toggle(state, elapsed, depths, light_interval,
+                           min_green=ADAPTIVE_MIN_GREEN, max_green=ADAPTIVE_MAX_GREEN):
+    """
+    Decides whether the adaptive controller ends the current green phase, given the queue depths:
+      - never before min_green seconds,
+      - never while the red approaches are empty (their phase is skipped),
+      - as soon as the green approaches are empty (the phase is shortened),
+      - after light_interval seconds if the red approaches have at least as much demand,
+      - otherwise extended, up to max_green seconds.
+    """
+    if elapsed < min_green:
+        return False
+    green = sum(depths[d] for d in state.get_active_directions())
+    red = sum(depths.values()) - green
+    if red == 0:
+        return False
+    if green == 0 or elapsed >= max_green:
+        return True
+    return elapsed >= light_interval and red >= green
+
+def publish_state(shared_state, state, wakeup_fd=None):
+    """
+    Publishes a new light state and wakes up the coordinator.
+    """
+    global published_state, published_at
+    now = sim_clock.now()
+    if published_state is not None:
+        metrics.inc(f"light_state_ns.{metrics.state_label(published_state)}", int((now - published_at) * 1e9))
+    published_state, published_at = state, now
+    shared_state["state"] = state
+    notify(wakeup_fd)
+    event_log.record_lights(event_log.LIGHT_CHANGED, state)
+
+def publish_changes(shared_state, changes, priority_start, wakeup_fd=None):
+    """
+    Publishes the states returned by LightCycle.step, recording the end of each priority override.
+    Each release is acknowledged by incrementing shared_state["releases"] once the restored state is
+    published: the next priority light may be the same state, so the coordinator cannot wait for a change.
+    """
+    for state, change in changes:
+        if change == RESTORED:
+            metrics.observe("priority_override", sim_clock.now() - priority_start)
+        publish_state(shared_state, state, wakeup_fd)
+        if change == RESTORED:
+            shared_state["releases"] = shared_state.get("releases", 0) + 1
+            notify(wakeup_fd)
+            event_log.record_lights(event_log.PRIORITY_RESTORED, state)
 
 # Main
-def main(shared_state):
+def main(shared_state, wakeup_fd=None, light_interval=LIGHT_CHANGE_INTERVAL, queues=None, controller="fixed",
+         control_fd=None):
     """
     Entry point for the lights process.
+    If wakeup_fd is given, every published state change is notified on it.
+    controller is "fixed" (toggle every light_interval seconds) or "adaptive"
+    (phase lengths follow the depths of the given queues, see adaptive_should_toggle).
+    control_fd is the read end of the channel carrying the priority requests and releases.
     """
-    global priority_mode, priority_requested, just_restored
+    global cycle
 
-    # Set up signal handlers
-    signal.signal(signal.SIGUSR1, handle_priority)
-    signal.signal(signal.SIGUSR2, handle_restore)
+    profiling.install("lights")
 
     # Initial normal state: N/S green, E/W red
-    current_state = LightState(1, 1, 0, 0)
-    shared_state["state"] = current_state
+    cycle = LightCycle(controller, light_interval, sim_clock.now())
+    publish_state(shared_state, cycle.state, wakeup_fd)
 
     step_time = 0.1  # 100 ms
-    elapsed = 0.0
+    startup.ready("lights")
 
     while True:
-        # If we've just restored, reset to the default normal state
-        if just_restored:
-            current_state = LightState(1, 1, 0, 0)
-            shared_state["state"] = current_state
-            elapsed = 0.0
-            just_restored = False
-
-        # If we are not in priority mode, either check for priority or handle normal toggling
-        if not priority_mode:
-            if priority_requested:
-                priority_requested = False
-                priority_mode = True
-                direction = shared_state.get("priority_direction", "N")
-                current_state = set_priority_light(direction)
-                shared_state["state"] = current_state
-            else:
-                # Normal mode: switch lights after the configured interval
-                if elapsed >= LIGHT_CHANGE_INTERVAL:
-                    current_state = toggle_lights(current_state)
-                    shared_state["state"] = current_state
-                    elapsed = 0.0
-                time.sleep(step_time)
-                elapsed += step_time
-        else:
-            # In priority mode, wait for a restore signal
-            time.sleep(step_time)
+        priority_start = cycle.priority_start
+        depths = queue_depths(queues) if controller == "adaptive" else None
+        changes = cycle.step(sim_clock.now(), depths)
+        publish_changes(shared_state, changes, priority_start, wakeup_fd)
+
+        # A priority request or release interrupts the wait.
+        timeout = cycle.next_step(sim_clock.now(), step_time)
+        wait_for_commands(control_fd, step_time if timeout is None else timeout)
@@ -1,14 +1,34 @@
+import os
+import argparse
 import multiprocessing
 import sys
 import socket
 import threading
-from ipc_utils import init_message_queues
+from ipc_utils import (
+    init_message_queues, create_wakeup_channel, configure_overflow, QUEUE_KEYS, OVERFLOW_POLICIES, MAX_INTERSECTIONS
+)
 from coordinator import main as coordinator_main
 from display import main as display_main
 from lights import main as lights_main
 from normal_traffic_gen import main as normal_traffic_main
 from priority_traffic_gen import main as priority_traffic_main
-from common import DISPLAY_HOST, DISPLAY_PORT
+from state_store import SharedLightState
+from startup import ReadinessBarrier, StartupError
+import sim_clock
+import metrics
+import event_log
+import profiling
+import arrivals
+from common import (
+    DISPLAY_HOST, DISPLAY_PORT, SHARED_STATE_BACKEND, COORDINATOR_EVENT_DRIVEN,
+    LIGHT_CHANGE_INTERVAL, LIGHT_CONTROLLER, NORMAL_GEN_INTERVAL, NORMAL_GEN_BATCH_SIZE, CLOCK_SPEEDUP, FAST_CLOCK_SPEEDUP,
+    METRICS_SNAPSHOT_INTERVAL, IPC_TRANSPORT, COORDINATOR_SCHEDULER, STARTUP_TIMEOUT,
+    PROFILE_MODE, QUEUE_CAPACITY, QUEUE_OVERFLOW_POLICY, QUEUE_BLOCK_TIMEOUT, QUEUE_SPILL_DIR
+)
+
+# Held while listen_for_exit stops the processes and releases the resources, so that main()
+# does not return (and the interpreter exit) halfway through the cleanup.
+stopping = threading.Lock()
 
 
 def stop_processes(processes, queues, shared_state):
@@ -17,11 +37,12 @@ def stop_processes(processes, queues, shared_state):
     """
     print("[MAIN] Terminating all processes...")
 
-    # Terminate all processes
+    # Terminate all processes, then wait for them: they shut down in parallel
     for process in processes:
         if process.is_alive():
             process.terminate()
-            process.join()
+    for process in processes:
+        process.join()
 
     # Remove all message queues
     for queue in queues.values():
@@ -32,8 +53,17 @@ def stop_processes(processes, queues, shared_state):
             print(f"[MAIN] Error removing message queue {queue.key}: {e}")
 
     # Clear shared state
-    shared_state.clear()
-    print("[MAIN] Shared state cleared.")
+    if shared_state is not None:
+        shared_state.clear()
+        if isinstance(shared_state, SharedLightState):
+            shared_state.unlink()
+        print("[MAIN] Shared state cleared.")
+
+    # Release the metrics counters
+    metrics.shutdown()
+
+    # Flush the event log
+    event_log.shutdown()
 
     print("[MAIN] All processes and resources cleaned up.")
 
@@ -41,72 +71,303 @@ def stop_processes(processes, queues, shared_state):
 def listen_for_exit(processes, queues, shared_state):
     """
     Waits for user input and stops all processes when 'j' is pressed.
+    With profiling enabled, 'p' toggles the CPU profilers of every process and 'm' their allocation tracing.
     """
     while True:
         key = input()
         if key.lower() == 'j':
-            stop_processes(processes, queues, shared_state)
+            with stopping:
+                stop_processes(processes, queues, shared_state)
             sys.exit(0)
+        elif key.lower() == 'p' and profiling.enabled():
+            profiling.signal_processes(processes, profiling.PROFILE_SIGNAL)
+        elif key.lower() == 'm' and profiling.enabled():
+            profiling.signal_processes(processes, profiling.TRACEMALLOC_SIGNAL)
 
 
-def main():
+def parse_capacity(text):
     """
-    Initializes all processes required for the simulation.
+    Parses a queue capacity: a number of vehicles for every queue (e.g. "500"),
+    or capacities per direction (e.g. "N=500,S=500,E=2000"; missing directions keep the default).
+    """
+    if "=" not in text:
+        return int(text)
+    return {direction.strip().upper(): int(n) for direction, n in (item.split("=") for item in text.split(","))}
+
+def parse_args(argv=None):
+    """
+    Parses the command line options of the simulation.
+    """
+    parser = argparse.ArgumentParser(description="Multi-process traffic simulation.")
+    parser.add_argument("--speedup", type=float, default=CLOCK_SPEEDUP,
+                        help="run simulated time this many times faster than the wall clock")
+    parser.add_argument("--fast", action="store_const", dest="speedup", const=FAST_CLOCK_SPEEDUP,
+                        help=f"shorthand for --speedup {FAST_CLOCK_SPEEDUP:g}")
+    parser.add_argument("--grid", metavar="ROWSxCOLS",
+                        help="simulate a grid of intersections instead of a single one (e.g. 3x4)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes in grid mode (default: one per CPU)")
+    parser.add_argument("--runner", choices=["processes", "asyncio"], default="processes",
+                        help="run the components as processes, or as asyncio tasks of a single process")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve live metrics on http://localhost:PORT/metrics (single intersection only)")
+    parser.add_argument("--metrics-file", default=None,
+                        help="write a JSON snapshot of the metrics to this file periodically (single intersection only)")
+    parser.add_argument("--controller", choices=["fixed", "adaptive"], default=LIGHT_CONTROLLER,
+                        help="light controller: fixed interval or adaptive to queue depths")
+    parser.add_argument("--scheduler", choices=["pairs", "conflict"], default=COORDINATOR_SCHEDULER,
+                        help="coordinator: opposite vehicles in pairs, or the largest non-conflicting movements")
+    parser.add_argument("--transport", choices=["sysv", "ring"], default=IPC_TRANSPORT,
+                        help="vehicle queues: SysV message queues or shared memory rings")
+    parser.add_argument("--queue-capacity", type=parse_capacity, default=QUEUE_CAPACITY,
+                        help="vehicles each road queue holds, or per direction (e.g. N=500,E=2000); 0 for the default")
+    parser.add_argument("--overflow-policy", choices=OVERFLOW_POLICIES, default=QUEUE_OVERFLOW_POLICY,
+                        help="what happens to normal vehicles sent to a full queue")
+    parser.add_argument("--block-timeout", type=float, default=QUEUE_BLOCK_TIMEOUT,
+                        help="seconds a generator waits for room with --overflow-policy block before dropping")
+    parser.add_argument("--spill-dir", default=QUEUE_SPILL_DIR,
+                        help="directory of the spill files of --overflow-policy spill (default: temporary directory)")
+    parser.add_argument("--event-log", default=None,
+                        help="record every vehicle and light event into this binary file (see event_log.py)")
+    parser.add_argument("--profile-dir", default=None,
+                        help="enable profiling: 'p' + Enter (or kill -USR1 <pid>) toggles the CPU profile of the "
+                             "processes, 'm' (or kill -USR2) their allocation tracing, written to this directory")
+    parser.add_argument("--profile-mode", choices=["cprofile", "sampling"], default=PROFILE_MODE,
+                        help="CPU profiler: cProfile (every call) or sampling (lower overhead)")
+    parser.add_argument("--profile-start", action="store_true",
+                        help="start the CPU profilers with the processes")
+    parser.add_argument("--profile-spans", action="store_true",
+                        help="time the hot functions (see profiling.HOT_PATHS) in every process")
+    parser.add_argument("--dashboard", action="store_true",
+                        help="redraw a summary of the intersection at a fixed rate instead of printing every update")
+    parser.add_argument("--display-log", default=None,
+                        help="append every display update to this file")
+    arrivals.add_arguments(parser)
+    args = parser.parse_args(argv)
+    arrivals.check_arguments(parser, args)
+    if args.overflow_policy == "drop-oldest" and args.transport == "ring":
+        parser.error("--overflow-policy drop-oldest requires --transport sysv")
+    if args.runner == "asyncio" and args.grid:
+        parser.error("--runner asyncio simulates a single intersection")
+    if args.runner == "asyncio" and args.transport != IPC_TRANSPORT:
+        parser.error("--runner asyncio uses in-memory queues, not --transport")
+    if args.runner == "asyncio" and (args.overflow_policy != QUEUE_OVERFLOW_POLICY
+                                     or args.block_timeout != QUEUE_BLOCK_TIMEOUT):
+        parser.error("--runner asyncio waits for room in a full queue; --overflow-policy and --block-timeout "
+                     "apply to the processes runner")
+    if args.scheduler != "pairs" and args.grid:
+        parser.error("--scheduler conflict simulates a single intersection")
+    if args.controller != "fixed" and args.grid:
+        parser.error("--controller adaptive simulates a single intersection")
+    if args.grid and (args.transport != "sysv" or args.queue_capacity != QUEUE_CAPACITY):
+        parser.error("--grid uses SysV queues of the default capacity; --transport and --queue-capacity "
+                     "apply to a single intersection")
+    if args.grid:
+        rows, cols = (int(n) for n in args.grid.lower().split("x"))
+        if rows * cols > MAX_INTERSECTIONS:
+            parser.error(f"--grid has at most {MAX_INTERSECTIONS} intersections")
+    return args
+
+
+def run_grid(args):
+    """
+    Runs the multi-intersection grid mode until 'j' is pressed.
+    """
+    from grid import start_grid
+
+    rows, cols = (int(n) for n in args.grid.lower().split("x"))
+    processes, queues = start_grid(rows, cols, args.workers)
+    listen_for_exit(processes, queues, None)
+
+
+def start_simulation(display_address=(DISPLAY_HOST, DISPLAY_PORT), start_display=True, keys=None,
+                     light_interval=LIGHT_CHANGE_INTERVAL, controller=LIGHT_CONTROLLER,
+                     dashboard=False, display_log=None, transport=IPC_TRANSPORT, capacity=QUEUE_CAPACITY,
+                     scheduler=COORDINATOR_SCHEDULER, normal_target=normal_traffic_main, normal_args=(),
+                     priority_target=priority_traffic_main, priority_args=(), barrier=None):
+    """
+    Starts the display, lights, generators and coordinator processes of one intersection.
+    start_display=False expects a display server to be already listening on display_address.
+    dashboard and display_log select the display's dashboard mode and its log file.
+    transport selects the queues: "sysv" message queues or "ring" shared memory rings,
+    and capacity their size in vehicles (see ipc_utils.init_message_queues).
+    scheduler selects how the coordinator lets vehicles through (see coordinator.main).
+    The generators are called with (queues, wakeup_fd, *normal_args) and
+    (queues, shared_state, lights_fd, wakeup_fd, *priority_args) respectively, lights_fd being
+    the write end of the lights' control channel, and must report "normal_traffic" and
+    "priority_traffic" to startup.ready().
+    The processes are started back to back and initialize in parallel, and the function returns once
+    all of them are ready. Pass a startup.ReadinessBarrier as barrier to read the startup breakdown.
+    Returns the list of processes, the queues and the shared light state; raises startup.StartupError,
+    once the started processes are stopped, if the display cannot be reached.
     """
     processes = []
+    channels = []  # File descriptors of the pipes, only used by the children
+    barrier = ReadinessBarrier() if barrier is None else barrier
+    try:
+        # Create the shared light state (shared memory block, or a Manager dict as fallback)
+        if SHARED_STATE_BACKEND == "manager":
+            manager = multiprocessing.Manager()
+            shared_state = manager.dict()
+        else:
+            shared_state = SharedLightState()
+        barrier.mark("shared state")
+
+        # Initialize the SysV IPC message queues.
+        queues = init_message_queues(keys, transport, capacity)
+        barrier.mark("queues")
+
+        # Create the channel used to wake up the coordinator on events.
+        wakeup_read_fd, wakeup_write_fd = create_wakeup_channel() if COORDINATOR_EVENT_DRIVEN else (None, None)
+        if COORDINATOR_EVENT_DRIVEN:
+            channels += [wakeup_read_fd, wakeup_write_fd]
+
+        # Create the channel carrying the priority requests and releases to the lights.
+        lights_read_fd, lights_write_fd = create_wakeup_channel()
+        channels += [lights_read_fd, lights_write_fd]
+
+        # Start the display process first (TCP server).
+        if start_display:
+            display_process = multiprocessing.Process(
+                target=display_main,
+                # The dashboard reads the depths of SysV queues only
+                args=(*display_address, dashboard, display_log,
+                      None if transport == "ring" else QUEUE_KEYS if keys is None else keys),
+                name="Display Process"
+            )
+            display_process.start()
+            processes.append(display_process)
+            print("[MAIN] Display process started.")
+
+        # Start the lights process.
+        lights_process = multiprocessing.Process(target=lights_main, args=(shared_state, wakeup_write_fd, light_interval, queues, controller, lights_read_fd), name="Lights Process")
+        lights_process.start()
+        processes.append(lights_process)
+        print("[MAIN] Lights process started.")
+
+        # Start the normal traffic generation process.
+        normal_process = multiprocessing.Process(target=normal_target, args=(queues, wakeup_write_fd, *normal_args), name="Normal Traffic Process")
+        normal_process.start()
+        processes.append(normal_process)
+        print("[MAIN] Normal traffic generation process started.")
+
+        # Start the priority traffic generation process
+        priority_process = multiprocessing.Process(target=priority_target, args=(queues, shared_state, lights_write_fd, wakeup_write_fd, *priority_args), name="Priority Traffic Process")
+        priority_process.start()
+        processes.append(priority_process)
+        print("[MAIN] Priority traffic generation process started.")
+        barrier.mark("forks")
+
+        # Establish a TCP connection to the display process, once it listens.
+        if start_display and barrier.wait(["display"], [display_process]):
+            stop_processes(processes, queues, shared_state)
+            raise StartupError(f"Display process not ready, cannot connect to {display_address[0]}:{display_address[1]}")
+        display_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            display_socket.connect(display_address)
+        except OSError as e:
+            display_socket.close()
+            stop_processes(processes, queues, shared_state)
+            raise StartupError(f"Cannot connect to the display at {display_address[0]}:{display_address[1]}: {e}") from e
+        barrier.mark("display connection")
+
+        # Start the coordinator process.
+        coordinator_process = multiprocessing.Process(
+            target=coordinator_main,
+            args=(queues, shared_state, display_socket, lights_write_fd, wakeup_read_fd, scheduler),
+            name="Coordinator Process"
+        )
+        coordinator_process.start()
+        processes.append(coordinator_process)
+        display_socket.close()  # The coordinator has its own copy
+        print("[MAIN] Coordinator process started.")
+        barrier.mark("coordinator fork")
+
+        # Wait for every process to be initialized.
+        components = ["display"] * start_display + ["lights", "normal_traffic", "priority_traffic", "coordinator"]
+        missing = barrier.wait(components, processes)
+        if missing:
+            print(f"[MAIN] ⚠️ Not ready after {STARTUP_TIMEOUT:g}s or exited: {', '.join(missing)}")
+
+    finally:
+        # The children have their own copies of the channels (or were stopped): close the parent's
+        for fd in channels:
+            os.close(fd)
+        barrier.close()
+
+    return processes, queues, shared_state
+
+
+def main(args=None):
+    """
+    Initializes all processes required for the simulation.
+    """
+    if args is None:
+        args = parse_args()
+
+    # Select the clock before any process is started, so that they all share it.
+    sim_clock.configure(args.speedup)
+    if args.speedup != 1:
+        print(f"[MAIN] Simulated time runs {args.speedup:g}x faster than real time.")
+
+    # Enable profiling before forking, so that every process installs its profilers.
+    if args.profile_dir is not None:
+        profiling.configure(args.profile_dir, args.profile_mode, args.profile_spans, args.profile_start)
+        print(f"[MAIN] Profiling into {args.profile_dir}: 'p' + Enter toggles the CPU profiles, "
+              f"'m' + Enter the allocation tracing.")
+
+    # Select the overflow policy of the queues before forking, so that the generators apply it.
+    configure_overflow(args.overflow_policy, args.block_timeout, args.spill_dir)
+
+    if args.grid:
+        run_grid(args)
+        return
+
+    # Enable the shared metrics counters before forking, so that every process records into them.
+    # The adaptive controller reads its queue depths from them.
+    if args.metrics_port is not None or args.metrics_file is not None or args.controller == "adaptive":
+        block = metrics.configure()
+
+    # Open the event log before forking, so that every process appends to it.
+    if args.event_log is not None:
+        event_log.configure(args.event_log)
+
+    # Single-process mode: every component is a task of this process.
+    if args.runner == "asyncio":
+        if args.metrics_port is not None:
+            metrics.serve_http(block, args.metrics_port)
+        if args.metrics_file is not None:
+            metrics.write_snapshots(block, args.metrics_file, METRICS_SNAPSHOT_INTERVAL)
+        import async_runner  # Imports asyncio, which single intersections in processes never need
+        async_runner.run(args)
+        return
+
+    model = arrivals.model_from_args(args, NORMAL_GEN_INTERVAL, NORMAL_GEN_BATCH_SIZE)
+    barrier = ReadinessBarrier()
+    try:
+        processes, queues, shared_state = start_simulation(controller=args.controller, dashboard=args.dashboard,
+                                                           display_log=args.display_log, transport=args.transport,
+                                                           capacity=args.queue_capacity, scheduler=args.scheduler,
+                                                           normal_args=(model,), barrier=barrier)
+    except StartupError as e:
+        print(f"[MAIN] ⚠️ {e}")
+        sys.exit(1)
+    print(f"[MAIN] {barrier.summary()}")
 
-    # Start the display process first (TCP server).
-    display_process = multiprocessing.Process(target=display_main, name="Display Process")
-    display_process.start()
-    processes.append(display_process)
-    print("[MAIN] Display process started.")
-
-    # Create a Manager for shared memory
-    manager = multiprocessing.Manager()
-    shared_state = manager.dict()
-
-    # Initialize the SysV IPC message queues.
-    queues = init_message_queues()
-
-    # Start the lights process.
-    lights_process = multiprocessing.Process(target=lights_main, args=(shared_state,), name="Lights Process")
-    lights_process.start()
-    processes.append(lights_process)
-    print("[MAIN] Lights process started.")
-
-    # Start the normal traffic generation process.
-    normal_process = multiprocessing.Process(target=normal_traffic_main, args=(queues,), name="Normal Traffic Process")
-    normal_process.start()
-    processes.append(normal_process)
-    print("[MAIN] Normal traffic generation process started.")
-
-    # Start the priority traffic generation process
-    priority_process = multiprocessing.Process(target=priority_traffic_main, args=(queues, shared_state, lights_process.pid), name="Priority Traffic Process")
-    priority_process.start()
-    processes.append(priority_process)
-    print("[MAIN] Priority traffic generation process started.")
-
-    # Establish a TCP connection to the display process.
-    display_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    display_socket.connect((DISPLAY_HOST, DISPLAY_PORT))
-
-    # Start the coordinator process.
-    coordinator_process = multiprocessing.Process(
-        target=coordinator_main,
-        args=(queues, shared_state, display_socket, lights_process.pid),
-        name="Coordinator Process"
-    )
-    coordinator_process.start()
-    processes.append(coordinator_process)
-    print("[MAIN] Coordinator process started.")
+    if args.metrics_port is not None:
+        metrics.serve_http(block, args.metrics_port, queues)
+    if args.metrics_file is not None:
+        metrics.write_snapshots(block, args.metrics_file, METRICS_SNAPSHOT_INTERVAL, queues)
 
     # Start a separate thread to listen for user input to stop processes
     input_thread = threading.Thread(target=listen_for_exit, args=(processes, queues, shared_state), daemon=True)
     input_thread.start()
 
-    # Wait for all processes.
+    # Wait for all processes, then for the cleanup if they were stopped.
     for process in processes:
         process.join()
+    with stopping:
+        pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+import os
+import json
+import threading
+from multiprocessing import shared_memory
+
+
+DIRECTIONS = ("N", "S", "E", "W")
+LIGHT_STATES = ("NS", "EW", "N", "S", "E", "W")
+
+# Histogram buckets: bucket i counts durations below 2**i microseconds (the last one is +Inf).
+HISTOGRAM_BUCKETS = 32
+HISTOGRAMS = ("latency", "priority_override")
+
+# Outcomes of the normal vehicles sent to a full queue (see ipc_utils.configure_overflow):
+# sends that had to wait, and vehicles dropped, spilled to disk and sent back from disk.
+OVERFLOW_ACTIONS = ("blocked", "dropped", "spilled", "restored")
+
+# Counter names, in layout order. Each counter is written by a single process:
+#   generated.*, priority_generated.* -> generators
+#   overflow_*.* -> normal generator (priority vehicles never overflow)
+#   passed.*, priority_passed.*, latency.* -> coordinator
+#   light_state_ns.*, priority_override.* -> lights
+COUNTERS = (
+    [f"generated.{d}" for d in DIRECTIONS]
+    + [f"priority_generated.{d}" for d in DIRECTIONS]
+    + [f"passed.{d}" for d in DIRECTIONS]
+    + [f"priority_passed.{d}" for d in DIRECTIONS]
+    + [f"overflow_{a}.{d}" for a in OVERFLOW_ACTIONS for d in DIRECTIONS]
+    + [f"light_state_ns.{s}" for s in LIGHT_STATES]
+    + [f"{h}.{suffix}" for h in HISTOGRAMS for suffix in ("count", "sum_ns")]
+    + [f"{h}.bucket{i}" for h in HISTOGRAMS for i in range(HISTOGRAM_BUCKETS)]
+)
+INDEX = {name: i for i, name in enumerate(COUNTERS)}
+_HISTOGRAM_INDEX = {h: (INDEX[f"{h}.count"], INDEX[f"{h}.sum_ns"], INDEX[f"{h}.bucket0"]) for h in HISTOGRAMS}
+
+
+class MetricsBlock:
+    """
+    Fixed set of 64-bit counters in a multiprocessing.shared_memory block.
+    Counters are updated in place without locking: every counter has a single writer process.
+    """
+    def __init__(self):
+        self._shm = shared_memory.SharedMemory(create=True, size=8 * len(COUNTERS))
+        self.values = self._shm.buf.cast("Q")
+        for i in range(len(COUNTERS)):
+            self.values[i] = 0
+
+    def snapshot(self):
+        """
+        Returns a dictionary of all counter values.
+        """
+        return {name: self.values[i] for i, name in enumerate(COUNTERS)}
+
+    def unlink(self):
+        """
+        Releases the shared memory block. Must be called once, by the process that created it.
+        """
+        self.values.release()
+        self._shm.close()
+        self._shm.unlink()
+
+
+# Block used by every component. Must be configured before the processes are started;
+# recording is a no-op while it is None.
+_block = None
+
+def configure():
+    """
+    Creates the shared counters and enables recording in this process and its children.
+    """
+    global _block
+    _block = MetricsBlock()
+    return _block
+
+def shutdown():
+    """
+    Disables recording and releases the shared counters, if they were configured.
+    """
+    global _block
+    if _block is not None:
+        _block.unlink()
+        _block = None
+
+def inc(name, n=1):
+    """
+    Adds n to a counter.
+    """
+    if _block is not None:
+        _block.values[INDEX[name]] += n
+
+def observe(histogram, seconds):
+    """
+    Records a duration (in seconds) in a histogram.
+    """
+    if _block is None:
+        return
+    values = _block.values
+    count, total, buckets = _HISTOGRAM_INDEX[histogram]
+    ns = max(0, int(seconds * 1e9))
+    values[count] += 1
+    values[total] += ns
+    values[buckets + min((ns // 1000).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+def waiting_vehicles():
+    """
+    Returns the number of vehicles of each direction generated but neither passed nor dropped: queued,
+    spilled, or held by the coordinator in its waiting lines. Returns None if the counters are not configured.
+    """
+    if _block is None:
+        return None
+    values = _block.values
+    return {d: max(0, values[INDEX[f"generated.{d}"]] + values[INDEX[f"priority_generated.{d}"]]
+                   - values[INDEX[f"passed.{d}"]] - values[INDEX[f"priority_passed.{d}"]]
+                   - values[INDEX[f"overflow_dropped.{d}"]])
+            for d in DIRECTIONS}
+
+def state_label(state):
+    """
+    Returns the name of a light state, made of its green directions ("NS", "EW", "N", ...).
+    """
+    return "".join(state.get_active_directions())
+
+
+# Export
+def queue_depths(queues):
+    """
+    Returns the current number of messages of each queue, skipping queues that no longer exist.
+    """
+    depths = {}
+    for direction, queue in queues.items():
+        try:
+            depths[direction] = queue.current_messages
+        except Exception:
+            pass
+    return depths
+
+def render_text(snapshot, queues=None):
+    """
+    Renders a snapshot in the Prometheus text exposition format.
+    queues, if given, adds the current number of messages of each SysV queue.
+    """
+    lines = []
+    def metric(name, kind, samples):
+        lines.append(f"# TYPE traffic_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"traffic_{name}{labels} {value}")
+
+    for counter, name in (("generated", "vehicles_generated_total"),
+                          ("priority_generated", "priority_vehicles_generated_total"),
+                          ("passed", "vehicles_passed_total"),
+                          ("priority_passed", "priority_vehicles_passed_total")):
+        metric(name, "counter", [(f'{{direction="{d}"}}', snapshot[f"{counter}.{d}"]) for d in DIRECTIONS])
+    metric("queue_overflow_total", "counter",
+           [(f'{{direction="{d}",action="{a}"}}', snapshot[f"overflow_{a}.{d}"])
+            for a in OVERFLOW_ACTIONS for d in DIRECTIONS])
+    metric("light_state_seconds_total", "counter",
+           [(f'{{state="{s}"}}', snapshot[f"light_state_ns.{s}"] / 1e9) for s in LIGHT_STATES])
+    if queues is not None:
+        metric("queue_messages", "gauge",
+               [(f'{{direction="{d}"}}', n) for d, n in queue_depths(queues).items()])
+
+    for histogram, name in (("latency", "pass_latency_seconds"),
+                            ("priority_override", "priority_override_seconds")):
+        samples, cumulative = [], 0
+        for i in range(HISTOGRAM_BUCKETS):
+            cumulative += snapshot[f"{histogram}.bucket{i}"]
+            le = "+Inf" if i == HISTOGRAM_BUCKETS - 1 else f"{(2 ** i) / 1e6:g}"
+            samples.append((f'_bucket{{le="{le}"}}', cumulative))
+        samples.append(("_sum", snapshot[f"{histogram}.sum_ns"] / 1e9))
+        samples.append(("_count", snapshot[f"{histogram}.count"]))
+        metric(name, "histogram", samples)
+    return "\n".join(lines) + "\n"
+
+def serve_http(block, port, queues=None, host="localhost"):
+    """
+    Serves the metrics as text on http://host:port/metrics from a background thread.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Imported on demand: http.server pulls in ssl and email
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_text(block.snapshot(), queues).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep the terminal for the simulation logs
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="Metrics HTTP", daemon=True).start()
+    print(f"[METRICS] Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+def write_snapshots(block, path, interval, queues=None, stop=None):
+    """
+    Writes a JSON snapshot of the metrics to path every interval seconds, from a background thread.
+    """
+    stop = stop or threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                snapshot = block.snapshot()
+            except ValueError:
+                return  # Counters released on shutdown
+            if queues is not None:
+                snapshot.update({f"queue_messages.{d}": n for d, n in queue_depths(queues).items()})
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+
+    threading.Thread(target=loop, name="Metrics snapshots", daemon=True).start()
+    return stop
@@ -0,0 +1,171 @@
+from common import RIGHT_OF, LIGHT_BITS, COORDINATOR_RIGHT_ON_RED, NS_GREEN, EW_GREEN, VehicleMessage
+
+
+# Roads in the order of RIGHT_OF: turning right leads to the next road
+DIRECTIONS = ("N", "E", "S", "W")
+assert all(RIGHT_OF[road] == DIRECTIONS[(i + 1) % 4] for i, road in enumerate(DIRECTIONS))
+
+# The 12 movements (source road, destination road), and the bit of each in a movement mask
+MOVEMENTS = tuple((source, dest) for source in DIRECTIONS for dest in DIRECTIONS if source != dest)
+MOVEMENT_INDEX = {movement: i for i, movement in enumerate(MOVEMENTS)}
+RIGHT_TURNS = sum(1 << i for i, (source, dest) in enumerate(MOVEMENTS) if RIGHT_OF[source] == dest)
+
+
+def _crosses(movement1, movement2):
+    """
+    Tells whether the paths of two movements from different roads to different roads cross.
+    Each road has an exit lane then an entry lane around the intersection, in the order of
+    DIRECTIONS, and a movement is a chord from its entry lane to its exit lane: two chords cross
+    if exactly one end of the second lies between the ends of the first.
+    """
+    def chord(source, dest):
+        return 2 * DIRECTIONS.index(source) + 1, 2 * DIRECTIONS.index(dest)
+
+    a, b = chord(*movement1)
+    c, d = chord(*movement2)
+
+    def between(x):
+        return 0 < (x - a) % 8 < (b - a) % 8
+    return between(c) != between(d)
+
+def _conflicts(movement1, movement2):
+    """
+    Tells whether two movements cannot pass at the same time: they come from the same road
+    (one lane per road), go to the same road, or their paths cross.
+    """
+    if movement1 == movement2:
+        return False
+    return movement1[0] == movement2[0] or movement1[1] == movement2[1] or _crosses(movement1, movement2)
+
+# Conflict matrix: mask of the movements conflicting with each movement
+CONFLICTS = tuple(
+    sum(1 << j for j, other in enumerate(MOVEMENTS) if _conflicts(movement, other))
+    for movement in MOVEMENTS
+)
+
+def permitted_movements(light_mask, right_on_red=COORDINATOR_RIGHT_ON_RED):
+    """
+    Returns the mask of the movements allowed by a light state mask: every movement from a green road,
+    and right turns from red roads if right_on_red.
+    """
+    allowed = RIGHT_TURNS if right_on_red else 0
+    for i, (source, _) in enumerate(MOVEMENTS):
+        if light_mask & LIGHT_BITS[source]:
+            allowed |= 1 << i
+    return allowed
+
+PERMITTED = tuple(permitted_movements(mask) for mask in range(16))
+PERMITTED_GREEN_ONLY = tuple(permitted_movements(mask, False) for mask in range(16))
+
+def _is_compatible(mask):
+    """
+    Tells whether no two movements of a mask conflict.
+    """
+    remaining = mask
+    while remaining:
+        bit = remaining & -remaining
+        if CONFLICTS[bit.bit_length() - 1] & mask:
+            return False
+        remaining ^= bit
+    return True
+
+def _largest_sets(candidates):
+    """
+    Returns the largest conflict-free subsets of a mask of movements (at most one per road),
+    as a tuple of masks.
+    """
+    bits = [1 << i for i in range(len(MOVEMENTS)) if candidates >> i & 1]
+    best, best_size = [0], 0
+    for combination in range(1, 1 << len(bits)):
+        mask = sum(bit for j, bit in enumerate(bits) if combination >> j & 1)
+        size = bin(combination).count("1")
+        if size < best_size or not _is_compatible(mask):
+            continue
+        if size > best_size:
+            best, best_size = [], size
+        best.append(mask)
+    return tuple(best)
+
+# Largest conflict-free sets of each mask of allowed queue heads, computed on first use
+# (at most 256 masks with one movement per road).
+_largest_sets_cache = {}
+
+def select_movements(heads, state, right_on_red=COORDINATOR_RIGHT_ON_RED):
+    """
+    Chooses the queue heads that pass together this round, given the light state: the largest set of
+    non-priority heads whose movements are allowed and do not conflict. A right turn on red yields to
+    the green heads it conflicts with. Among equally large sets, the one with the oldest head wins,
+    so that no road waits forever.
+    heads maps each road to the vehicle at the head of its queue. Returns the list of chosen roads.
+    """
+    allowed = (PERMITTED if right_on_red else PERMITTED_GREEN_ONLY)[state.mask]
+    candidates = 0
+    for vehicle in heads.values():
+        if not vehicle.priority:
+            candidates |= 1 << MOVEMENT_INDEX[vehicle.source_road, vehicle.dest_road]
+    candidates &= allowed
+    green = candidates & PERMITTED_GREEN_ONLY[state.mask]
+    on_red = candidates ^ green
+    while on_red:
+        bit = on_red & -on_red
+        if CONFLICTS[bit.bit_length() - 1] & green:
+            candidates ^= bit
+        on_red ^= bit
+    if not candidates:
+        return []
+    sets = _largest_sets_cache.get(candidates)
+    if sets is None:
+        sets = _largest_sets_cache[candidates] = _largest_sets(candidates)
+    chosen = sets[0]
+    if len(sets) > 1:
+        oldest = min((v for v in heads.values() if candidates >> MOVEMENT_INDEX[v.source_road, v.dest_road] & 1),
+                     key=lambda v: v.created_at)
+        bit = 1 << MOVEMENT_INDEX[oldest.source_road, oldest.dest_road]
+        chosen = next((mask for mask in sets if mask & bit), chosen)
+    return [MOVEMENTS[i][0] for i in range(len(MOVEMENTS)) if chosen >> i & 1]
+
+
+def self_check():
+    """
+    Checks the conflict matrix and select_movements on the situations the conflict scheduler relies on.
+    Raises AssertionError on the first one that does not hold.
+    """
+    def conflict(movement1, movement2):
+        return bool(CONFLICTS[MOVEMENT_INDEX[movement1]] >> MOVEMENT_INDEX[movement2] & 1)
+
+    def heads(*routes):
+        # One head per route, created in the given order (the first one is the oldest)
+        return {source: VehicleMessage(i + 1, source, dest, created_at=float(i)) for i, (source, dest) in enumerate(routes)}
+
+    # Conflict matrix
+    assert not conflict(("N", "S"), ("S", "N")) and not conflict(("E", "W"), ("W", "E")), "opposing straights conflict"
+    assert not conflict(("N", "W"), ("S", "E")) and not conflict(("E", "N"), ("W", "S")), "opposing left turns conflict"
+    assert conflict(("N", "S"), ("E", "W")) and conflict(("E", "W"), ("N", "S")), "crossing straights do not conflict"
+    assert conflict(("N", "W"), ("S", "N")), "a left turn does not conflict with the opposing straight"
+    assert conflict(("N", "S"), ("E", "S")), "movements to the same road do not conflict"
+    assert all(CONFLICTS[i] >> j & 1 == CONFLICTS[j] >> i & 1 for i in range(len(MOVEMENTS)) for j in range(len(MOVEMENTS))), \
+        "the conflict matrix is not symmetric"
+
+    # Selection
+    assert sorted(select_movements(heads(("N", "S"), ("S", "N")), NS_GREEN)) == ["N", "S"], \
+        "opposing straights on green do not pass together"
+    assert select_movements(heads(("E", "W"), ("N", "S")), NS_GREEN) == ["N"], "a straight passes on red"
+    # E->S turns right on red into the road N->S goes to: it yields, even to a younger head
+    assert select_movements(heads(("E", "S"), ("N", "S")), NS_GREEN, right_on_red=True) == ["N"], \
+        "a conflicting right turn on red is selected"
+    assert sorted(select_movements(heads(("E", "S"), ("S", "N")), NS_GREEN, right_on_red=True)) == ["E", "S"], \
+        "a right turn on red does not pass with the green heads it does not conflict with"
+    assert select_movements(heads(("E", "S")), NS_GREEN, right_on_red=False) == [], "a right turn passes on red"
+    assert select_movements(heads(("E", "S")), NS_GREEN, right_on_red=True) == ["E"], "a right turn on red does not pass"
+    # N->W and S->N conflict: one passes at a time, the oldest head first
+    assert select_movements(heads(("N", "W"), ("S", "N")), NS_GREEN) == ["N"], "a tie does not go to the oldest head"
+    assert select_movements(heads(("S", "N"), ("N", "W")), NS_GREEN) == ["S"], "a tie does not go to the oldest head"
+    assert sorted(select_movements(heads(("W", "E"), ("E", "W")), EW_GREEN)) == ["E", "W"], \
+        "opposing straights on green do not pass together"
+    assert select_movements({"N": VehicleMessage(-1, "N", "S", priority=True)}, NS_GREEN) == [], \
+        "a priority head is selected"
+
+
+if __name__ == "__main__":
+    self_check()
+    print("[MOVEMENTS] All checks passed.")
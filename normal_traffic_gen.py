@@ -1,30 +1,103 @@
-import time
-import random
-from common import VehicleMessage, NORMAL_GEN_INTERVAL
-from ipc_utils import send_obj_message
+import sys
+import signal
+import sim_clock
+import metrics
+import event_log
+import profiling
+import startup
+from common import (
+    VehicleMessage, NORMAL_GEN_INTERVAL, NORMAL_GEN_BATCH_SIZE, QUEUE_SPILL_DRAIN_INTERVAL, QUEUE_SPILL_FINAL_TIMEOUT
+)
+from ipc_utils import (
+    send_obj_messages, notify, spilled_messages, drain_spills, wait_for_spills, discard_spills, BATCH_MAX_VEHICLES
+)
+from arrivals import ConstantArrivals
 
 
-def run_normal_traffic(queues):
+def send_vehicles(queues, outgoing, wakeup_fd):
+    """
+    Sends each road's pending vehicles in as few messages as possible.
+    """
+    for source, vehicles in outgoing.items():
+        send_obj_messages(queues[source], vehicles)
+    notify(wakeup_fd)
+
+def sleep_draining(delay, wakeup_fd):
+    """
+    Sleeps for delay simulated seconds. Meanwhile, vehicles spilled to disk (overflow policy "spill")
+    are sent back every QUEUE_SPILL_DRAIN_INTERVAL real seconds as their queues free up.
+    """
+    end = sim_clock.now() + delay
+    spilled = spilled_messages()
+    while spilled:
+        remaining = end - sim_clock.now()
+        if remaining <= 0:
+            return
+        sim_clock.sleep(min(remaining, QUEUE_SPILL_DRAIN_INTERVAL * sim_clock.speedup()))
+        restored, spilled = spilled - drain_spills(), spilled_messages()
+        if restored:
+            notify(wakeup_fd)
+    remaining = end - sim_clock.now()
+    if remaining > 0:
+        sim_clock.sleep(remaining)
+
+def handle_shutdown(signum, frame):
+    """
+    Terminates the generator, counting the vehicles still spilled to disk as dropped.
+    sys.exit runs the exit hooks, which flush the buffered event log records.
+    """
+    discard_spills()
+    sys.exit(0)
+
+
+def run_normal_traffic(queues, wakeup_fd=None, model=None):
     """
     Continuously generates and sends vehicle messages to simulate normal traffic.
+    Vehicles arrive according to the given arrival model (see arrivals.py); by default,
+    NORMAL_GEN_BATCH_SIZE vehicles every NORMAL_GEN_INTERVAL seconds.
+    If wakeup_fd is given, the coordinator is notified of every new vehicle.
     """
+    if model is None:
+        model = ConstantArrivals(NORMAL_GEN_INTERVAL, NORMAL_GEN_BATCH_SIZE)
+
     vehicle_id = 0
-    directions = ["N", "E", "S", "W"]
+    start = sim_clock.now()
+    outgoing, pending = {}, 0
+
+    for arrival_time, source, dest in model:
+        # Wait for the arrival, sending the vehicles that are already due first
+        delay = start + arrival_time - sim_clock.now()
+        if delay > 0 or pending >= BATCH_MAX_VEHICLES:
+            send_vehicles(queues, outgoing, wakeup_fd)
+            outgoing, pending = {}, 0
+        if delay > 0:
+            sleep_draining(delay, wakeup_fd)
 
-    while True:
-        # Create and send vehicle
+        # Create vehicle, grouped by source road
         vehicle_id += 1
-        source = random.choice(directions)
-        dest = random.choice([d for d in directions if d != source])
         vehicle = VehicleMessage(vehicle_id, source, dest)
-        send_obj_message(queues[source], vehicle)
+        outgoing.setdefault(source, []).append(vehicle)
+        pending += 1
+        metrics.inc(f"generated.{source}")
+        event_log.record_vehicle(event_log.GENERATED, vehicle)
 
-        # Wait
-        time.sleep(NORMAL_GEN_INTERVAL)
+    # End of a replayed trace: send back the spilled vehicles while the coordinator drains the queues
+    send_vehicles(queues, outgoing, wakeup_fd)
+    if spilled_messages():
+        if not wait_for_spills(QUEUE_SPILL_FINAL_TIMEOUT, wakeup_fd):
+            print(f"[NORMAL_TRAFFIC] ⚠️ {discard_spills()} spilled vehicles dropped after "
+                  f"{QUEUE_SPILL_FINAL_TIMEOUT:g}s at the end of the arrivals.")
 
 
-def main(queues):
+def main(queues, wakeup_fd=None, model=None):
     """
     Entry point for the normal traffic generation process.
     """
-    run_normal_traffic(queues)
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    profiling.install("normal_traffic")
+    startup.ready("normal_traffic")
+    try:
+        run_normal_traffic(queues, wakeup_fd, model)
+    except ValueError as e:  # Invalid line of a replayed trace
+        print(f"[NORMAL_TRAFFIC] ⚠️ Arrivals stopped: {e}")
+        sys.exit(1)
@@ -1,21 +1,25 @@
-import time
+import sim_clock
 import random
-import os
-import signal
+import metrics
+import event_log
+import profiling
+import startup
 from common import VehicleMessage, PRIORITY_GEN_INTERVAL
-from ipc_utils import send_obj_message
+from ipc_utils import send_obj_message, notify, LIGHTS_PRIORITY_REQUESTS
 
 
-def run_priority_traffic(queues, shared_state, lights_pid):
+def run_priority_traffic(queues, lights_fd, wakeup_fd=None):
     """
     Continuously generates and sends priority vehicle messages to simulate priority traffic.
+    Each vehicle is announced to the lights, with its road, on their control channel lights_fd.
+    If wakeup_fd is given, the coordinator is notified of every new vehicle.
     """
     vehicle_id = 0
     directions = ["N", "S", "E", "W"]
 
     while True:
         # Wait
-        time.sleep(PRIORITY_GEN_INTERVAL)
+        sim_clock.sleep(PRIORITY_GEN_INTERVAL)
 
         # Create and send vehicle
         vehicle_id -= 1
@@ -23,13 +27,18 @@ def run_priority_traffic(queues, shared_state, lights_pid):
         dest = random.choice([d for d in directions if d != source])
         vehicle = VehicleMessage(vehicle_id, source, dest, priority=True)
         send_obj_message(queues[source], vehicle)
+        notify(wakeup_fd)
+        metrics.inc(f"priority_generated.{source}")
+        event_log.record_vehicle(event_log.GENERATED, vehicle)
 
-        # Signal lights to change for the priority vehicle.
-        shared_state['priority_direction'] = vehicle.source_road
-        os.kill(lights_pid, signal.SIGUSR1)
+        # Request the lights to change for the priority vehicle.
+        notify(lights_fd, LIGHTS_PRIORITY_REQUESTS[vehicle.source_road])
+        event_log.record_vehicle(event_log.PRIORITY_REQUESTED, vehicle)
 
-def main(queues, shared_state, lights_pid):
+def main(queues, shared_state, lights_fd, wakeup_fd=None):
     """
     Entry point for the priority traffic generation process.
     """
-    run_priority_traffic(queues, shared_state, lights_pid)
+    profiling.install("priority_traffic")
+    startup.ready("priority_traffic")
+    run_priority_traffic(queues, lights_fd, wakeup_fd)
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import signal
+import cProfile
+import argparse
+import functools
+import threading
+import tracemalloc
+from collections import Counter
+from common import PROFILE_MODE, PROFILE_SAMPLE_INTERVAL
+
+
+# Signals toggling the profilers of a running component (e.g. "kill -USR1 <pid>")
+PROFILE_SIGNAL = signal.SIGUSR1     # CPU profile (cProfile or sampling, see configure)
+TRACEMALLOC_SIGNAL = signal.SIGUSR2  # Allocation snapshot
+
+# Functions timed by configure(spans=True), as "module.function"
+HOT_PATHS = (
+    "ipc_utils.receive_obj_message",
+    "ipc_utils.receive_batch",
+    "ipc_utils.send_obj_messages",
+    "coordinator.send_update",
+    "coordinator.drain_active_directions",
+    "coordinator.process_non_priority_vehicles",
+    "lights.toggle_lights",
+    "lights.publish_state",
+)
+
+# Frames kept per sampled stack (innermost ones)
+SAMPLE_DEPTH = 64
+
+
+def _report(message):
+    """
+    Writes a line to stderr with a single system call. The profilers are toggled from signal handlers,
+    which must not print: a handler interrupting a print of the main code would write to the same
+    buffered stream reentrantly, which raises in the main code.
+    """
+    try:
+        os.write(2, f"{message}\n".encode())
+    except OSError:
+        pass
+
+
+class Sampler:
+    """
+    Wall-clock sampling profiler: a background thread records the stack of the main thread every
+    interval seconds. Much cheaper than cProfile on busy code; blocking calls show up as samples
+    in the function that waits. Stacks are written in the collapsed format of flame graph tools
+    ("outer;inner count" per line).
+    """
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = threading.main_thread().ident
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="Profiling sampler", daemon=True)
+
+    def enable(self):
+        self.thread.start()
+
+    def disable(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < SAMPLE_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump_stats(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProcessProfiler:
+    """
+    Profilers of one component process: a CPU profiler toggled by PROFILE_SIGNAL, tracemalloc toggled
+    by TRACEMALLOC_SIGNAL, and the timing spans. Every toggle off writes a file to the run directory,
+    named after the component, its pid and a sequence number; active profilers and the spans are
+    also written when the process is terminated.
+    """
+    def __init__(self, component):
+        self.component = component
+        self.profile = None
+        self.sequence = 0
+
+    def path(self, extension):
+        self.sequence += 1
+        return os.path.join(_run_dir, f"{self.component}-{os.getpid()}-{self.sequence}.{extension}")
+
+    def toggle_profile(self, signum=None, frame=None):
+        if self.profile is None:
+            self.profile = Sampler() if _mode == "sampling" else cProfile.Profile()
+            self.profile.enable()
+            _report(f"[PROFILING] {self.component}: {_mode} profile started.")
+            return
+        self.profile.disable()
+        path = self.path("collapsed" if isinstance(self.profile, Sampler) else "prof")
+        self.profile.dump_stats(path)
+        self.profile = None
+        self.dump_spans()
+        _report(f"[PROFILING] {self.component}: profile written to {path}")
+
+    def toggle_tracemalloc(self, signum=None, frame=None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(SAMPLE_DEPTH)
+            _report(f"[PROFILING] {self.component}: allocation tracing started.")
+            return
+        path = self.path("tracemalloc")
+        tracemalloc.take_snapshot().dump(path)
+        tracemalloc.stop()
+        _report(f"[PROFILING] {self.component}: allocation snapshot written to {path}")
+
+    def dump_spans(self):
+        """
+        Writes the timing spans recorded by this process so far (overwriting the previous dump).
+        """
+        spans = {
+            name: {"count": count, "total_ms": total / 1e6, "mean_us": total / count / 1e3 if count else 0.0,
+                   "max_us": longest / 1e3}
+            for name, (count, total, longest) in _spans.items() if count
+        }
+        if not spans:
+            return
+        with open(os.path.join(_run_dir, f"{self.component}-{os.getpid()}.spans.json"), "w") as f:
+            json.dump(spans, f, indent=2)
+
+    def dump_all(self):
+        if self.profile is not None:
+            self.toggle_profile()
+        if tracemalloc.is_tracing():
+            self.toggle_tracemalloc()
+        self.dump_spans()
+
+
+# Run directory, CPU profiler and timing spans of every component. Must be configured before the
+# processes are started; install() is a no-op while _run_dir is None.
+_run_dir = None
+_mode = PROFILE_MODE
+_start = False
+_profiler = None
+
+# Timing spans of the instrumented functions: [calls, total ns, longest ns] per name (per process)
+_spans = {}
+
+def configure(run_dir, mode=PROFILE_MODE, spans=False, start=False):
+    """
+    Enables profiling in the components started afterwards, which write their files to run_dir.
+    mode is "cprofile" (deterministic, every call) or "sampling" (see Sampler), and start starts
+    their CPU profilers right away instead of waiting for PROFILE_SIGNAL.
+    spans times every call of the HOT_PATHS functions; otherwise they are left untouched.
+    """
+    global _run_dir, _mode, _start
+    if mode not in ("cprofile", "sampling"):
+        raise ValueError(f"unknown profiling mode: {mode}")
+    os.makedirs(run_dir, exist_ok=True)
+    _run_dir, _mode, _start = run_dir, mode, start
+    if spans:
+        instrument(HOT_PATHS)
+
+def enabled():
+    """
+    Returns True if profiling was configured.
+    """
+    return _run_dir is not None
+
+def install(component):
+    """
+    Sets up the profiling signals of a component process (called at the start of its main function,
+    after its own signal handlers).
+    """
+    global _profiler
+    if _run_dir is None:
+        return
+    _profiler = ProcessProfiler(component)
+    signal.signal(PROFILE_SIGNAL, _profiler.toggle_profile)
+    signal.signal(TRACEMALLOC_SIGNAL, _profiler.toggle_tracemalloc)
+    previous = signal.getsignal(signal.SIGTERM)
+    signal.signal(signal.SIGTERM, functools.partial(_dump_and_terminate, previous))
+    if _start:
+        _profiler.toggle_profile()
+
+def _dump_and_terminate(previous, signum, frame):
+    """
+    SIGTERM handler of the profiled processes: writes the active profiles and the spans,
+    then terminates as before.
+    """
+    if _profiler is not None:
+        _profiler.dump_all()
+    if callable(previous):
+        previous(signum, frame)
+    else:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+def signal_processes(processes, signum):
+    """
+    Sends a profiling signal to every running process (e.g. from main.py's prompt).
+    """
+    for process in processes:
+        if process.is_alive():
+            os.kill(process.pid, signum)
+
+
+# Timing spans
+def instrument(paths):
+    """
+    Replaces each "module.function" of paths with a timed wrapper, in its module and in every
+    module that imported it by name.
+    """
+    for path in paths:
+        module_name, name = path.rsplit(".", 1)
+        __import__(module_name)
+        function = getattr(sys.modules[module_name], name)
+        wrapper = _timed(path, function)
+        for module in list(sys.modules.values()):
+            if getattr(module, "__dict__", {}).get(name) is function:
+                setattr(module, name, wrapper)
+
+def _timed(name, function):
+    stats = _spans.setdefault(name, [0, 0, 0])
+    clock = time.perf_counter_ns
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = clock() - start
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+    return wrapper
+
+
+# Report
+def report(run_dir, top=15):
+    """
+    Prints a summary of the files written to run_dir: timing spans, the hottest functions of each
+    CPU profile and the largest allocation sites of each snapshot.
+    """
+    import pstats  # Only the reader needs it
+
+    for name in sorted(os.listdir(run_dir)):
+        path = os.path.join(run_dir, name)
+        if name.endswith(".spans.json"):
+            with open(path) as f:
+                spans = json.load(f)
+            print(f"== {name}")
+            print(f"  {'span':45} {'calls':>10} {'total_ms':>10} {'mean_us':>9} {'max_us':>10}")
+            for span, s in sorted(spans.items(), key=lambda item: -item[1]["total_ms"]):
+                print(f"  {span:45} {s['count']:>10} {s['total_ms']:>10.1f} {s['mean_us']:>9.1f} {s['max_us']:>10.1f}")
+        elif name.endswith(".prof"):
+            print(f"== {name}")
+            pstats.Stats(path, stream=sys.stdout).sort_stats("cumulative").print_stats(top)
+        elif name.endswith(".collapsed"):
+            leaves, total = Counter(), 0
+            with open(path) as f:
+                for line in f:
+                    stack, count = line.rsplit(" ", 1)
+                    leaves[stack.rsplit(";", 1)[-1]] += int(count)
+                    total += int(count)
+            print(f"== {name} ({total} samples)")
+            for function, count in leaves.most_common(top):
+                print(f"  {100 * count / total:5.1f}%  {function}")
+        elif name.endswith(".tracemalloc"):
+            statistics = tracemalloc.Snapshot.load(path).statistics("lineno")
+            print(f"== {name} ({sum(s.size for s in statistics) / 1024:.0f} KiB traced)")
+            for statistic in statistics[:top]:
+                print(f"  {statistic}")
+
+
+def main(argv=None):
+    """
+    Entry point of the profile reader.
+    """
+    parser = argparse.ArgumentParser(description="Summarizes the profiles written by main.py --profile-dir.")
+    parser.add_argument("run_dir", help="directory given to --profile-dir")
+    parser.add_argument("--top", type=int, default=15, help="entries shown per profile")
+    args = parser.parse_args(argv)
+    report(args.run_dir, args.top)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
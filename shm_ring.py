@@ -0,0 +1,161 @@
+import time
+import struct
+import sysv_ipc
+from multiprocessing import shared_memory
+
+
+# Ring header: 64-bit counters, those of the consumer and those of the producer 64 bytes apart
+# so that they do not share a cache line.
+_HEAD = 0       # Next slot to read (consumer)
+_RECEIVED = 1   # Messages read (consumer)
+_TAIL = 8       # Next slot to write (producer)
+_SENT = 9       # Messages written (producer)
+_HEADER_SIZE = 128
+
+# A message takes one or more consecutive 64-byte slots: its length and type, then the message itself.
+SLOT_SIZE = 64
+_SLOT_HEADER = struct.Struct("<HB")
+_PADDING = 0  # Type of the filler written when a message does not fit before the end of the ring
+
+# Backoff of a blocked sender or receiver (in seconds)
+_MIN_BACKOFF = 0.00005
+_MAX_BACKOFF = 0.001
+
+
+def slots_for(size):
+    """
+    Returns the number of slots a message of size bytes takes.
+    """
+    return (_SLOT_HEADER.size + size + SLOT_SIZE - 1) // SLOT_SIZE
+
+
+class Ring:
+    """
+    Single-producer/single-consumer ring of fixed-size slots in a shared memory block.
+
+    head and tail only ever increase; each is written by a single process (consumer and
+    producer respectively) and slot i lives at index i % slots. A message that would wrap around
+    the end of the ring starts at slot 0 instead, after a padding entry. The producer fills the
+    slots before publishing them by advancing tail, and the consumer reads them before releasing
+    them by advancing head, relying on aligned 8-byte stores being atomic and not reordered
+    (as on x86-64).
+    """
+    def __init__(self, slots):
+        self.slots = slots
+        self.max_size = slots * SLOT_SIZE - _SLOT_HEADER.size
+        self._shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + slots * SLOT_SIZE)
+        self._buf = self._shm.buf
+        self._counters = self._buf[:_HEADER_SIZE].cast("Q")
+        for i in (_HEAD, _RECEIVED, _TAIL, _SENT):
+            self._counters[i] = 0
+
+    def __len__(self):
+        """Number of messages in the ring."""
+        counters = self._counters
+        return counters[_SENT] - counters[_RECEIVED]
+
+    def put(self, message, mtype):
+        """
+        Writes a message into the next slots. Returns False if the ring is full.
+        """
+        counters = self._counters
+        tail = counters[_TAIL]
+        position = tail % self.slots
+        needed = (_SLOT_HEADER.size + len(message) + SLOT_SIZE - 1) // SLOT_SIZE
+        padding = self.slots - position if position + needed > self.slots else 0
+        if tail + padding + needed - counters[_HEAD] > self.slots:
+            return False
+        buf = self._buf
+        if padding:
+            _SLOT_HEADER.pack_into(buf, _HEADER_SIZE + position * SLOT_SIZE, padding, _PADDING)
+            position = 0
+        offset = _HEADER_SIZE + position * SLOT_SIZE
+        _SLOT_HEADER.pack_into(buf, offset, len(message), mtype)
+        offset += _SLOT_HEADER.size
+        buf[offset:offset + len(message)] = message
+        counters[_TAIL] = tail + padding + needed
+        counters[_SENT] += 1
+        return True
+
+    def get(self):
+        """
+        Reads the oldest message. Returns (message, type), or None if the ring is empty.
+        """
+        counters = self._counters
+        head = counters[_HEAD]
+        if head == counters[_TAIL]:
+            return None
+        buf = self._buf
+        position = head % self.slots
+        length, mtype = _SLOT_HEADER.unpack_from(buf, _HEADER_SIZE + position * SLOT_SIZE)
+        if mtype == _PADDING:
+            head += length
+            position = 0
+            length, mtype = _SLOT_HEADER.unpack_from(buf, _HEADER_SIZE)
+        offset = _HEADER_SIZE + position * SLOT_SIZE + _SLOT_HEADER.size
+        message = bytes(buf[offset:offset + length])
+        counters[_HEAD] = head + (_SLOT_HEADER.size + length + SLOT_SIZE - 1) // SLOT_SIZE
+        counters[_RECEIVED] += 1
+        return message, mtype
+
+    def unlink(self):
+        self._counters.release()
+        self._buf = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+class RingQueue:
+    """
+    Drop-in replacement for a sysv_ipc.MessageQueue, backed by two shared memory rings:
+    a lane for the messages of priority_type and a lane for all the others. Each lane must have
+    a single producer process (e.g. the priority and the normal generator) and the queue a single
+    consumer (the coordinator); messages never cross the kernel.
+
+    Supports the subset of the MessageQueue interface used by ipc_utils: send(), receive() with
+    type 0 (priority lane first, then the other messages in order) or priority_type,
+    current_messages, key and remove(). Must be created before the processes are forked.
+    """
+    def __init__(self, key, priority_type, slots, priority_slots):
+        self.key = key
+        self.priority_type = priority_type
+        self._normal = Ring(slots)
+        self._priority = Ring(priority_slots)
+
+    @property
+    def current_messages(self):
+        """Number of messages waiting in the queue."""
+        return len(self._normal) + len(self._priority)
+
+    def send(self, message, block=True, type=1):
+        ring = self._priority if type == self.priority_type else self._normal
+        if len(message) > ring.max_size:
+            raise ValueError(f"message of {len(message)} bytes exceeds the ring size ({ring.max_size})")
+        backoff = _MIN_BACKOFF
+        while not ring.put(message, type):
+            if not block:
+                raise sysv_ipc.BusyError("The queue is full")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, _MAX_BACKOFF)
+
+    def receive(self, block=True, type=0):
+        if type not in (0, self.priority_type):
+            raise ValueError(f"unsupported message type: {type}")
+        backoff = _MIN_BACKOFF
+        while True:
+            entry = self._priority.get()
+            if entry is None and type == 0:
+                entry = self._normal.get()
+            if entry is not None:
+                return entry
+            if not block:
+                raise sysv_ipc.BusyError("No available messages of the specified type")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, _MAX_BACKOFF)
+
+    def remove(self):
+        """
+        Releases the shared memory of the rings. Must be called once, by the process that created them.
+        """
+        self._normal.unlink()
+        self._priority.unlink()
@@ -0,0 +1,72 @@
+import time
+
+
+class RealClock:
+    """
+    Wall-clock time: simulated seconds are real seconds.
+    """
+    speedup = 1.0
+
+    def now(self):
+        """Returns the current simulated time (in seconds)."""
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        """Sleeps for the given number of simulated seconds."""
+        time.sleep(seconds)
+
+    def real_interval(self, seconds):
+        """Converts a simulated duration into real seconds."""
+        return seconds
+
+
+class ScaledClock:
+    """
+    Virtual time running speedup times faster than the wall clock.
+    The epoch is taken when the clock is created, so processes forked afterwards share it.
+    """
+    def __init__(self, speedup):
+        if speedup <= 0:
+            raise ValueError(f"speedup must be positive, got {speedup}")
+        self.speedup = float(speedup)
+        self.epoch = time.monotonic()
+
+    def now(self):
+        """Returns the current simulated time (in seconds)."""
+        return self.epoch + (time.monotonic() - self.epoch) * self.speedup
+
+    def sleep(self, seconds):
+        """Sleeps for the given number of simulated seconds."""
+        time.sleep(seconds / self.speedup)
+
+    def real_interval(self, seconds):
+        """Converts a simulated duration into real seconds."""
+        return seconds / self.speedup
+
+
+# Clock used by every component. Must be configured before the processes are started.
+_clock = RealClock()
+
+def configure(speedup=1.0):
+    """
+    Selects the clock: wall-clock time for a speedup of 1, virtual time otherwise.
+    """
+    global _clock
+    _clock = RealClock() if speedup == 1 else ScaledClock(speedup)
+    return _clock
+
+def now():
+    """Returns the current simulated time (in seconds)."""
+    return _clock.now()
+
+def sleep(seconds):
+    """Sleeps for the given number of simulated seconds."""
+    _clock.sleep(seconds)
+
+def real_interval(seconds):
+    """Converts a simulated duration into real seconds."""
+    return _clock.real_interval(seconds)
+
+def speedup():
+    """Returns how many times faster than the wall clock simulated time runs."""
+    return _clock.speedup
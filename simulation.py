@@ -0,0 +1,304 @@
+import sys
+import heapq
+import random
+import argparse
+from collections import deque
+from common import (
+    VehicleMessage, NORMAL_GEN_INTERVAL, NORMAL_GEN_BATCH_SIZE,
+    PRIORITY_GEN_INTERVAL, LIGHT_CHANGE_INTERVAL, COORDINATOR_TICK_BUDGET, COORDINATOR_SCHEDULER,
+    COORDINATOR_RIGHT_ON_RED
+)
+from lights import LightCycle
+from coordinator import (
+    send_update, announce_light_change, pass_priority_vehicle, process_drained_vehicles, process_group,
+    take_priority_vehicle
+)
+from movements import select_movements
+
+
+# Event kinds, in the order they are handled when they happen at the same time
+LIGHTS_STEP = 0
+NORMAL_GEN = 1
+PRIORITY_GEN = 2
+COORDINATOR_TICK = 3
+
+DIRECTIONS = ["N", "E", "S", "W"]
+
+
+class LogSink:
+    """
+    Stands in for the display socket: collects the coordinator's log lines.
+    Writes them to a binary stream, or only counts them if the stream is None.
+    """
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.lines = 0
+
+    def sendall(self, data):
+        self.lines += 1
+        if self.stream is not None:
+            self.stream.write(data)
+
+
+class IntersectionSimulation:
+    """
+    Discrete-event simulation of the intersection, in a single process and without IPC.
+
+    Reproduces the lights process, both generators and the event-driven coordinator:
+    events are kept in a heap ordered by simulated time, and the coordinator runs
+    as soon as a vehicle arrives or the lights change, exactly as when it is woken up.
+    """
+    def __init__(self, display_socket, seed=None, normal_interval=NORMAL_GEN_INTERVAL,
+                 normal_batch=NORMAL_GEN_BATCH_SIZE, priority_interval=PRIORITY_GEN_INTERVAL,
+                 light_interval=LIGHT_CHANGE_INTERVAL, budget=COORDINATOR_TICK_BUDGET,
+                 scheduler=COORDINATOR_SCHEDULER, right_on_red=COORDINATOR_RIGHT_ON_RED):
+        self.display_socket = display_socket
+        self.random = random.Random(seed)
+        self.normal_interval = normal_interval
+        self.normal_batch = normal_batch
+        self.priority_interval = priority_interval
+        self.light_interval = light_interval
+        self.budget = budget
+        self.scheduler = scheduler
+        self.right_on_red = right_on_red
+
+        self.now = 0.0
+        self.events = []
+        self.sequence = 0
+        self.queues = {direction: deque() for direction in DIRECTIONS}
+
+        # Lights process state
+        self.lights = LightCycle("fixed", light_interval)
+        self.state = self.lights.state
+        self.lights_step = 0  # Bumped whenever a lights step is scheduled, invalidates the pending one
+
+        # Coordinator state
+        self.last_state = self.state
+        self.unexpected_vehicles = deque()  # Priority vehicles taken before their lights, in arrival order
+        self.tick_pending = False
+
+        # Statistics
+        self.normal_id = 0
+        self.priority_id = 0
+        self.passed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.latencies = []     # Generation to pass of every normal vehicle, in seconds
+        self.preemptions = []   # Request of the lights to pass of every priority vehicle, in seconds
+
+    def schedule(self, time, kind, payload=None):
+        """
+        Adds an event to the heap. Events at the same time run by kind, then in scheduling order.
+        """
+        self.sequence += 1
+        heapq.heappush(self.events, (time, kind, self.sequence, payload))
+
+    def run(self, duration):
+        """
+        Runs the simulation until the given simulated time (in seconds).
+        """
+        send_update(self.display_socket, f"[COORDINATOR] 🚦 Initial traffic lights: {self.state}")
+        self.schedule(self.light_interval, LIGHTS_STEP, self.lights_step)
+        self.schedule(0.0, NORMAL_GEN)
+        self.schedule(self.priority_interval, PRIORITY_GEN)
+
+        handlers = {
+            LIGHTS_STEP: self.on_lights_step,
+            NORMAL_GEN: self.on_normal_gen,
+            PRIORITY_GEN: self.on_priority_gen,
+            COORDINATOR_TICK: self.on_coordinator_tick,
+        }
+        events = self.events
+        while events and events[0][0] <= duration:
+            self.now, kind, _, payload = heapq.heappop(events)
+            handlers[kind](payload)
+
+    # Lights
+    def publish(self, state):
+        """
+        Changes the light state and wakes up the coordinator.
+        """
+        self.state = state
+        self.wake_coordinator()
+
+    def on_lights_step(self, step):
+        """
+        Runs the lights' decisions (see lights.LightCycle), then schedules the next step, if any.
+        """
+        if step != self.lights_step:
+            return
+        for state, _ in self.lights.step(self.now):
+            self.publish(state)
+        self.lights_step += 1
+        delay = self.lights.next_step(self.now, 0.0)
+        if delay is not None:
+            self.schedule(self.now + delay, LIGHTS_STEP, self.lights_step)
+
+    def run_lights_now(self):
+        """
+        Schedules a lights step right away, as when a command wakes up the lights process.
+        """
+        self.lights_step += 1
+        self.schedule(self.now, LIGHTS_STEP, self.lights_step)
+
+    def restore_lights(self):
+        """
+        Returns the lights to the normal cycle (N/S green), as on a priority release.
+        """
+        self.lights.release_priority()
+        self.run_lights_now()
+
+    # Generators
+    def random_route(self):
+        source = self.random.choice(DIRECTIONS)
+        dest = self.random.choice([d for d in DIRECTIONS if d != source])
+        return source, dest
+
+    def on_normal_gen(self, _):
+        for _ in range(self.normal_batch):
+            self.normal_id += 1
+            source, dest = self.random_route()
+            self.queues[source].append(VehicleMessage(self.normal_id, source, dest, created_at=self.now))
+        self.wake_coordinator()
+        self.schedule(self.now + self.normal_interval, NORMAL_GEN)
+
+    def on_priority_gen(self, _):
+        self.priority_id -= 1
+        source, dest = self.random_route()
+        self.queues[source].append(VehicleMessage(self.priority_id, source, dest, priority=True, created_at=self.now))
+        self.lights.request_priority(source)
+        self.run_lights_now()
+        self.wake_coordinator()
+        self.schedule(self.now + self.priority_interval, PRIORITY_GEN)
+
+    # Coordinator
+    def wake_coordinator(self):
+        if not self.tick_pending:
+            self.tick_pending = True
+            self.schedule(self.now, COORDINATOR_TICK)
+
+    def record_pass(self, vehicle):
+        latency = self.now - vehicle.created_at
+        self.passed += 1
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+        # Priority vehicles request the lights as they are generated
+        (self.preemptions if vehicle.priority else self.latencies).append(latency)
+
+    def on_coordinator_tick(self, _):
+        self.tick_pending = False
+        current_state = self.state
+
+        if current_state != self.last_state:
+            self.last_state = current_state
+            announce_light_change(self.display_socket, current_state)
+
+            if current_state.is_priority_vehicle_light():
+                send_update(self.display_socket, f"[COORDINATOR] 🚨 High priority on the way.")
+                direction = current_state.get_active_directions()[0]
+                vehicle = take_priority_vehicle(self.unexpected_vehicles, direction)
+                if vehicle is None:
+                    # Fetch the priority vehicle ahead of the vehicles waiting in front of it.
+                    queue = self.queues[direction]
+                    vehicle = next((candidate for candidate in queue if candidate.priority), None)
+                    if vehicle is not None:
+                        queue.remove(vehicle)
+                if vehicle is not None:
+                    pass_priority_vehicle(vehicle, self.display_socket)
+                    self.record_pass(vehicle)
+                # The lights step of the release runs before the next tick (events of the same time run by kind),
+                # and what it publishes is a new phase, even the same priority light for the next vehicle.
+                self.restore_lights()
+                self.last_state = None
+                return
+
+        if self.scheduler == "conflict":
+            self.schedule_movements(current_state)
+            return
+
+        active_directions = current_state.get_active_directions()
+        share = max(1, self.budget // len(active_directions))
+        vehicles_by_direction = {}
+        for direction in active_directions:
+            queue = self.queues[direction]
+            vehicles = []
+            for _ in range(min(share, len(queue))):
+                vehicle = queue.popleft()
+                if vehicle.priority:
+                    self.unexpected_vehicles.append(vehicle)
+                else:
+                    vehicles.append(vehicle)
+            if vehicles:
+                vehicles_by_direction[direction] = vehicles
+
+        if vehicles_by_direction:
+            process_drained_vehicles(vehicles_by_direction, active_directions, self.display_socket)
+            for vehicles in vehicles_by_direction.values():
+                for vehicle in vehicles:
+                    self.record_pass(vehicle)
+
+        # Budget exhausted with vehicles still waiting: run again straight away.
+        if any(self.queues[direction] for direction in active_directions):
+            self.wake_coordinator()
+
+    def schedule_movements(self, state):
+        """
+        Coordinator tick of the conflict scheduler (see coordinator.schedule_waiting_vehicles): the
+        queues here hold the vehicles in arrival order, so their heads are the waiting lines' heads.
+        A priority vehicle at the head of a road the coordinator receives from (the green roads, and the red
+        ones too if right turns may pass on red) is taken aside, as coordinator.fill_waiting_lines does.
+        """
+        green = state.get_active_directions()
+        passed = 0
+        while passed < self.budget:
+            heads = {}
+            for direction, queue in self.queues.items():
+                while queue and queue[0].priority and (direction in green or self.right_on_red):
+                    self.unexpected_vehicles.append(queue.popleft())
+                if queue:
+                    heads[direction] = queue[0]
+            directions = select_movements(heads, state, self.right_on_red) if heads else None
+            if not directions:
+                return
+            vehicles = [self.queues[direction].popleft() for direction in directions]
+            process_group(vehicles, self.display_socket)
+            for vehicle in vehicles:
+                self.record_pass(vehicle)
+            passed += len(vehicles)
+
+        # Budget exhausted with vehicles possibly still able to pass: run again straight away.
+        self.wake_coordinator()
+
+    def summary(self):
+        """
+        Returns a one-line summary of the run.
+        """
+        mean_latency = self.total_latency / self.passed if self.passed else 0.0
+        waiting = sum(len(queue) for queue in self.queues.values())
+        return (f"[SIMULATION] {self.now:.1f}s simulated: {self.normal_id} normal and {-self.priority_id} priority "
+                f"vehicles generated, {self.passed} passed, {waiting} waiting, "
+                f"latency mean={mean_latency:.3f}s max={self.max_latency:.3f}s")
+
+
+def main(argv=None):
+    """
+    Entry point of the discrete-event simulation.
+    """
+    parser = argparse.ArgumentParser(description="Single-process discrete-event traffic simulation.")
+    parser.add_argument("--duration", type=float, default=3600, help="simulated time to run, in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random vehicle routes")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary, not the log lines")
+    parser.add_argument("--scheduler", choices=["pairs", "conflict"], default=COORDINATOR_SCHEDULER,
+                        help="coordinator: opposite vehicles in pairs, or the largest non-conflicting movements")
+    args = parser.parse_args(argv)
+
+    sink = LogSink(None if args.quiet else sys.stdout.buffer)
+    simulation = IntersectionSimulation(sink, seed=args.seed, scheduler=args.scheduler)
+    simulation.run(args.duration)
+    sys.stdout.flush()
+    print(simulation.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os
+import time
+import select
+from common import STARTUP_TIMEOUT
+
+
+# Write end of the readiness channel of the processes being started (see ReadinessBarrier).
+# Inherited by the processes forked while a barrier is open; ready() is a no-op while it is None.
+_ready_fd = None
+
+
+def ready(component):
+    """
+    Reports that a component process is initialized (called at the start of its main function, once its
+    sockets, signal handlers and initial state are set up, right before its main loop).
+    """
+    global _ready_fd
+    if _ready_fd is None:
+        return
+    try:
+        os.write(_ready_fd, f"{component} {time.monotonic()}\n".encode())
+    except OSError:
+        pass  # The parent stopped waiting
+    os.close(_ready_fd)
+    _ready_fd = None
+
+
+class StartupError(Exception):
+    """
+    Raised when the processes of an intersection cannot be started (they are stopped first).
+    """
+
+
+class ReadinessBarrier:
+    """
+    Startup of the processes of one intersection: each component reports on a pipe when it is
+    ready (see ready()), and the parent waits for the components it needs. Also times the
+    parent's steps, for the startup breakdown.
+    Must be created before the processes are forked, and closed once they are all started.
+    """
+    def __init__(self):
+        global _ready_fd
+        self.start = time.monotonic()
+        self.steps = []     # (step, seconds since start) of the parent
+        self.ready = {}     # Component -> seconds since start at which it was ready
+        self.read_fd, _ready_fd = os.pipe()
+        self.write_fd = _ready_fd
+
+    def mark(self, step):
+        """
+        Records the end of a step of the parent (e.g. "queues").
+        """
+        self.steps.append((step, time.monotonic() - self.start))
+
+    def wait(self, components, processes=(), timeout=STARTUP_TIMEOUT):
+        """
+        Waits until all the given components are ready, one of the processes exits, or timeout seconds.
+        Returns the components that are not ready.
+        """
+        deadline = time.monotonic() + timeout
+        pending = ""
+        while not set(components) <= self.ready.keys():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or any(not process.is_alive() for process in processes):
+                break
+            if not select.select([self.read_fd], [], [], min(remaining, 0.05))[0]:
+                continue
+            lines = (pending + os.read(self.read_fd, 4096).decode()).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                component, ready_at = line.split()
+                self.ready[component] = float(ready_at) - self.start
+        return [component for component in components if component not in self.ready]
+
+    def close(self):
+        """
+        Closes the readiness channel; the processes started afterwards do not report.
+        Does nothing if it is already closed.
+        """
+        global _ready_fd
+        if self.read_fd is None:
+            return
+        if _ready_fd == self.write_fd:
+            _ready_fd = None
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        self.read_fd = self.write_fd = None
+        self.total = time.monotonic() - self.start
+
+    def timings(self):
+        """
+        Returns the startup breakdown in milliseconds: the end of each step of the parent and the time
+        at which each component was ready, since the start.
+        """
+        return {
+            "total_ms": self.total * 1000,
+            "steps": {step: at * 1000 for step, at in self.steps},
+            "ready": {component: at * 1000 for component, at in sorted(self.ready.items(), key=lambda item: item[1])},
+        }
+
+    def summary(self):
+        """
+        Returns the startup breakdown as a line of text.
+        """
+        timings = self.timings()
+        steps = ", ".join(f"{step} {at:.1f}" for step, at in timings["steps"].items())
+        ready = ", ".join(f"{component} {at:.1f}" for component, at in timings["ready"].items())
+        return f"Started in {timings['total_ms']:.1f} ms (steps: {steps}; ready: {ready})"
@@ -0,0 +1,116 @@
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+from common import LightState
+
+
+# Layout of the shared block: sequence counter, light state mask, priority releases acknowledged by the lights.
+_LAYOUT = struct.Struct("<IBI")
+_SEQ = struct.Struct("<I")
+_FIELDS = struct.Struct("<BI")
+
+# The light state mask is LightState.mask (4 bits, see LIGHT_BITS). Bit 0x10 marks the mask as set,
+# so that an all-red state is still distinguishable from "no state".
+_STATE_SET = 0x10
+
+
+def encode_light_state(state):
+    """
+    Encodes a LightState into a single byte.
+    """
+    if state is None:
+        return 0
+    return _STATE_SET | state.mask
+
+def decode_light_state(mask):
+    """
+    Decodes a byte produced by encode_light_state back into a LightState.
+    """
+    if not mask & _STATE_SET:
+        return None
+    return LightState.from_mask(mask)
+
+
+class SharedLightState:
+    """
+    Light state store backed by a small multiprocessing.shared_memory block.
+
+    Exposes the subset of the dict interface used on the Manager dict ("state" and
+    "releases" keys), so it can be passed wherever shared_state was.
+    Writers are serialized by a lock and bump a sequence counter around each update;
+    readers never lock and retry until they observe an even, unchanged counter.
+    """
+    KEYS = ("state", "releases")
+
+    def __init__(self):
+        self._shm = shared_memory.SharedMemory(create=True, size=_LAYOUT.size)
+        self._shm.buf[:_LAYOUT.size] = bytes(_LAYOUT.size)
+        self._lock = multiprocessing.Lock()
+
+    def _read(self):
+        """
+        Returns a consistent (mask, releases) snapshot of the shared block.
+        """
+        buf = self._shm.buf
+        while True:
+            seq = _SEQ.unpack_from(buf, 0)[0]
+            if seq & 1:
+                continue  # Writer in progress
+            mask, releases = _FIELDS.unpack_from(buf, _SEQ.size)
+            if _SEQ.unpack_from(buf, 0)[0] == seq:
+                return mask, releases
+
+    def _write(self, mask=None, releases=None):
+        """
+        Updates the given fields under the sequence counter.
+        """
+        buf = self._shm.buf
+        with self._lock:
+            seq = _SEQ.unpack_from(buf, 0)[0]
+            _SEQ.pack_into(buf, 0, (seq + 1) & 0xFFFFFFFF)
+            current_mask, current_releases = _FIELDS.unpack_from(buf, _SEQ.size)
+            _FIELDS.pack_into(
+                buf, _SEQ.size,
+                current_mask if mask is None else mask,
+                current_releases if releases is None else releases & 0xFFFFFFFF
+            )
+            _SEQ.pack_into(buf, 0, (seq + 2) & 0xFFFFFFFF)
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored under key, or default if it has not been set.
+        """
+        mask, releases = self._read()
+        if key == "state":
+            state = decode_light_state(mask)
+            return default if state is None else state
+        if key == "releases":
+            return releases
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key == "state":
+            self._write(mask=encode_light_state(value))
+        elif key == "releases":
+            self._write(releases=value)
+        else:
+            raise KeyError(key)
+
+    def clear(self):
+        """
+        Resets all keys to their unset value.
+        """
+        self._write(mask=0, releases=0)
+
+    def unlink(self):
+        """
+        Releases the shared memory block. Must be called once, by the process that created it.
+        """
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import sim_clock
+from common import NORMAL_GEN_INTERVAL, PRIORITY_GEN_INTERVAL, LIGHT_CHANGE_INTERVAL
+from ipc_utils import SWEEP_BASE_KEY, MAX_INTERSECTIONS
+from benchmark import run_end_to_end, percentiles
+from simulation import IntersectionSimulation, LogSink
+
+
+PARAMETERS = ("normal_interval", "priority_interval", "light_interval")
+
+
+def parse_list(text):
+    """
+    Parses a comma-separated list of numbers (e.g. "5,10,20").
+    """
+    return [float(value) for value in text.split(",")]
+
+def configurations(normal_intervals, priority_intervals, light_intervals, seeds):
+    """
+    Returns every combination of the parameters and seeds, each with its own run index.
+    """
+    combinations = itertools.product(normal_intervals, priority_intervals, light_intervals, seeds)
+    return [
+        {"run": run, "normal_interval": normal, "priority_interval": priority, "light_interval": light, "seed": seed}
+        for run, (normal, priority, light, seed) in enumerate(combinations)
+    ]
+
+
+def init_worker(speedup, verbose):
+    """
+    Sets up a pool process: the clock shared by the runs it starts, and silenced logs.
+    """
+    sim_clock.configure(speedup)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+
+def run_configuration(config, engine, duration):
+    """
+    Runs one configuration and returns its results.
+    engine is "process" (the lights, generators and coordinator processes, see benchmark.run_end_to_end)
+    or "des" (the single-process discrete-event simulation).
+    """
+    if engine == "des":
+        simulation = IntersectionSimulation(
+            LogSink(), seed=config["seed"], normal_interval=config["normal_interval"],
+            priority_interval=config["priority_interval"], light_interval=config["light_interval"]
+        )
+        simulation.run(duration)
+        # Same statistics as the end-to-end benchmark: latencies of the normal vehicles, preemptions of the priority ones
+        latency, preemption = percentiles(simulation.latencies) or {}, percentiles(simulation.preemptions) or {}
+        return dict(config, generated=simulation.normal_id - simulation.priority_id, passed=simulation.passed,
+                    vehicles_per_s=simulation.passed / duration, latency_mean_ms=latency.get("mean_ms"),
+                    latency_p99_ms=latency.get("p99_ms"), preemption_p50_ms=preemption.get("p50_ms"))
+
+    results = run_end_to_end(duration, 1.0 / config["normal_interval"], config["priority_interval"],
+                             config["light_interval"], intersection=config["run"], key_base=SWEEP_BASE_KEY,
+                             seed=config["seed"])
+    latency, preemption = results["latency"] or {}, results["preemption_latency"] or {}
+    return dict(config, generated=results["generated"], passed=results["passed"],
+                vehicles_per_s=results["vehicles_per_s"], latency_mean_ms=latency.get("mean_ms"),
+                latency_p99_ms=latency.get("p99_ms"), preemption_p50_ms=preemption.get("p50_ms"))
+
+
+def aggregate(runs):
+    """
+    Averages the runs of each parameter combination over the seeds.
+    Returns one row per combination, sorted by parameters.
+    """
+    groups = {}
+    for run in runs:
+        groups.setdefault(tuple(run[p] for p in PARAMETERS), []).append(run)
+
+    def mean(values):
+        values = [v for v in values if v is not None]
+        return sum(values) / len(values) if values else None
+
+    rows = []
+    for key in sorted(groups):
+        group = groups[key]
+        row = dict(zip(PARAMETERS, key), runs=len(group))
+        for metric in ("vehicles_per_s", "latency_mean_ms", "latency_p99_ms", "preemption_p50_ms"):
+            row[metric] = mean([run[metric] for run in group])
+        rows.append(row)
+
+    # Best light interval for each arrival and priority setting: highest throughput, then lowest mean latency
+    def score(row):
+        latency = row["latency_mean_ms"]
+        return round(row["vehicles_per_s"], 2), -(latency if latency is not None else float("inf"))
+
+    best = {}
+    for row in rows:
+        key = (row["normal_interval"], row["priority_interval"])
+        if key not in best or score(row) > score(best[key]):
+            best[key] = row
+    for row in rows:
+        row["best"] = best[(row["normal_interval"], row["priority_interval"])] is row
+    return rows
+
+def print_table(rows):
+    def cell(value):
+        return "-" if value is None else f"{value:.2f}"
+    print(f"{'normal_s':>9} {'priority_s':>10} {'light_s':>8} {'runs':>5} {'veh/s':>8} "
+          f"{'mean_ms':>10} {'p99_ms':>10} {'preempt_ms':>10}")
+    for row in rows:
+        print(f"{row['normal_interval']:>9g} {row['priority_interval']:>10g} {row['light_interval']:>8g} "
+              f"{row['runs']:>5} {cell(row['vehicles_per_s']):>8} {cell(row['latency_mean_ms']):>10} "
+              f"{cell(row['latency_p99_ms']):>10} {cell(row['preemption_p50_ms']):>10}"
+              f"{'  *' if row['best'] else ''}")
+
+
+def main(argv=None):
+    """
+    Entry point of the parameter sweep.
+    """
+    parser = argparse.ArgumentParser(description="Runs the simulation over a grid of parameters, in parallel.")
+    parser.add_argument("--normal-interval", type=parse_list, default=[NORMAL_GEN_INTERVAL],
+                        help="seconds between normal vehicles (comma-separated values)")
+    parser.add_argument("--priority-interval", type=parse_list, default=[PRIORITY_GEN_INTERVAL],
+                        help="seconds between priority vehicles (comma-separated values)")
+    parser.add_argument("--light-interval", type=parse_list, default=[LIGHT_CHANGE_INTERVAL],
+                        help="seconds between light changes (comma-separated values)")
+    parser.add_argument("--seeds", type=lambda text: [int(s) for s in text.split(",")], default=[0],
+                        help="seeds of the vehicle routes (comma-separated values)")
+    parser.add_argument("--duration", type=float, default=60, help="simulated seconds per run")
+    parser.add_argument("--engine", choices=["process", "des"], default="process",
+                        help="run the real processes, or the discrete-event simulation")
+    parser.add_argument("--speedup", type=float, default=1.0,
+                        help="simulated time runs this many times faster than the wall clock (process engine)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="runs in parallel")
+    parser.add_argument("--output", default="sweep_results.json", help="file the results are written to (JSON)")
+    parser.add_argument("--verbose", action="store_true", help="show the logs of the runs")
+    args = parser.parse_args(argv)
+
+    configs = configurations(args.normal_interval, args.priority_interval, args.light_interval, args.seeds)
+    if args.engine == "process" and len(configs) > MAX_INTERSECTIONS:
+        parser.error(f"at most {MAX_INTERSECTIONS} runs with --engine process (one intersection of queues each)")
+    print(f"[SWEEP] {len(configs)} runs of {args.duration:g}s ({args.engine}) on {args.workers} workers...")
+
+    # Pool processes are forked, so that they can start the simulation processes themselves.
+    start = time.monotonic()
+    runs = []
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("fork"),
+                             initializer=init_worker, initargs=(args.speedup, args.verbose)) as pool:
+        futures = [pool.submit(run_configuration, config, args.engine, args.duration) for config in configs]
+        for future in as_completed(futures):
+            runs.append(future.result())
+            print(f"[SWEEP] {len(runs)}/{len(configs)} runs done.")
+    runs.sort(key=lambda run: run["run"])
+
+    rows = aggregate(runs)
+    with open(args.output, "w") as f:
+        json.dump({"engine": args.engine, "duration_s": args.duration, "rows": rows, "runs": runs}, f, indent=2)
+    print(f"[SWEEP] Done in {time.monotonic() - start:.1f}s, results written to {args.output}")
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    sys.exit(main())